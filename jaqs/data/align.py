@@ -10,50 +10,96 @@ import pandas as pd
 from jaqs.util import is_numeric
 
 
-def _get_neareast(df_ann, df_value, date):
+# dates are YYYYmmdd, always smaller than this. Used as offset between columns when searching in one flat array.
+_DATE_UPPER_BOUND = 100000000
+# announcement date of quarters that have not been announced
+_NOT_ANNOUNCED = 99999999
+
+
+def get_align_positions(df_ann, date_arr):
     """
-    Get the value whose ann_date is earlier and nearest to date.
-    
+    For each (date, security), find the row of the latest report that has been announced on or before date.
+
     Parameters
     ----------
-    df_ann : np.ndarray
-        announcement dates. shape = (n_quarters, n_securities)
-    df_value : np.ndarray
-        announcement values. shape = (n_quarters, n_securities)
-    date : np.ndarray
-        shape = (1,)
+    df_ann : pd.DataFrame or np.ndarray
+        Announcement dates. shape = (n_quarters, n_securities), rows are sorted by report date.
+    date_arr : list or np.array
+        Target date array. dtype = int
 
     Returns
     -------
-    res : np.array
-        The value whose ann_date is earlier and nearest to date. shape (n_securities)
+    pos : np.ndarray
+        Row positions in df_ann, -1 if no report is available. shape = (n_days, n_securities)
+
+    Notes
+    -----
+    The latest report is the last row (not the latest ann_date) whose ann_date <= date.
+    Let m be the suffix minimum of ann_date of each column, which is non-decreasing, then
+    the last row with ann_date <= date is the last row with m <= date, i.e. searchsorted(m, date) - 1.
+    All columns are searched at once by shifting column j with j * _DATE_UPPER_BOUND.
 
     """
+    ann = np.asarray(df_ann, dtype=float)
+    ann = np.where(np.isnan(ann), _NOT_ANNOUNCED, ann).astype(np.int64)
+    date_arr = np.asarray(date_arr, dtype=np.int64)
+    n_quarters, n_securities = ann.shape
+    n_dates = len(date_arr)
+
+    if n_quarters == 0:
+        return np.full((n_dates, n_securities), -1, dtype=np.int64)
+
+    suffix_min = np.minimum.accumulate(ann[::-1], axis=0)[::-1]
+
+    offset = np.arange(n_securities, dtype=np.int64) * _DATE_UPPER_BOUND
+    flat = (suffix_min + offset).T.ravel()  # column by column, sorted
+    query = date_arr.reshape(-1, 1) + offset  # shape = (n_dates, n_securities)
+
+    pos = np.searchsorted(flat, query.ravel(), side='right').reshape(n_dates, n_securities)
+    pos = pos - np.arange(n_securities, dtype=np.int64) * n_quarters - 1
+    return pos
+
+
+def align_by_positions(df_value, pos, date_arr):
     """
-    df_ann.fillna(99999999, inplace=True)  # IMPORTANT: At cells where no quarterly data is available,
-                                           # we know nothing, thus it will be filled nan in the next step
+    Expand df_value using row positions from get_align_positions.
+
+    Parameters
+    ----------
+    df_value : pd.DataFrame
+        shape = (n_quarters, n_securities)
+    pos : np.ndarray
+        shape = (n_days, n_securities)
+    date_arr : list or np.array
+
+    Returns
+    -------
+    df_res : pd.DataFrame
+        shape = (n_days, n_securities)
+
     """
-    if is_numeric(df_value):
-        df_value = df_value.astype(float)
-    mask = date[0] >= df_ann
-    # res = np.where(mask, df_value, np.nan)
-    n = df_value.shape[1]
-    res = np.empty(n, dtype=df_value.dtype)
-    
-    # for each column, get the last True value
-    for i in range(n):
-        v = df_value[:, i]
-        m = mask[:, i]
-        r = v[m]
-        res[i] = r[-1] if len(r) else np.nan
-    
-    return res
-    
+    value = df_value.values
+    if is_numeric(value):
+        value = value.astype(float)
+    elif value.dtype != object:
+        value = value.astype(object)
+
+    n_securities = value.shape[1]
+    mask = pos < 0
+    if value.shape[0]:
+        res = value[np.where(mask, 0, pos), np.arange(n_securities)]
+    else:
+        res = np.empty(pos.shape, dtype=value.dtype)
+    res[mask] = np.nan
+
+    df_res = pd.DataFrame(index=np.asarray(date_arr, dtype=int), columns=df_value.columns, data=res)
+    return df_res
+
 
 def align(df_value, df_ann, date_arr):
     """
     Expand low frequency DataFrame df_value to frequency of data_arr using announcement date from df_ann.
-    
+
     Parameters
     ----------
     df_ann : pd.DataFrame
@@ -68,12 +114,61 @@ def align(df_value, df_ann, date_arr):
     df_res : pd.DataFrame
         Expanded DataFrame. shape = (n_days, n_securities)
 
+    Notes
+    -----
+    At cells where no quarterly data is available (ann_date is NaN), we know nothing, thus the result is NaN.
+    To expand many fields sharing the same df_ann, call get_align_positions once and
+    align_by_positions for each field.
+
     """
-    df_ann = df_ann.fillna(99999999).astype(int)
-    
-    date_arr = np.asarray(date_arr, dtype=int)
-    
-    res = np.apply_along_axis(lambda date: _get_neareast(df_ann.values, df_value.values, date), 1, date_arr.reshape(-1, 1))
+    if not (df_ann.columns.equals(df_value.columns) and df_ann.index.equals(df_value.index)):
+        df_ann = df_ann.reindex(index=df_value.index, columns=df_value.columns)
 
-    df_res = pd.DataFrame(index=date_arr, columns=df_value.columns, data=res)
-    return df_res
+    pos = get_align_positions(df_ann.values, date_arr)
+    return align_by_positions(df_value, pos, date_arr)
+
+
+class AnnouncementIndex(object):
+    """
+    Cached positions of the report in effect on each date, built once from announcement dates
+    and reused to expand every quarterly field sharing these announcement dates.
+
+    Parameters
+    ----------
+    df_ann : pd.DataFrame
+        Announcement dates. shape = (n_quarters, n_securities)
+    date_arr : list or np.array
+        Target date array. dtype = int
+
+    """
+    def __init__(self, df_ann, date_arr):
+        self.df_ann = df_ann
+        self.date_arr = np.asarray(date_arr, dtype=int)
+        self.pos = get_align_positions(df_ann.values, self.date_arr)
+
+    def matches(self, df_ann, date_arr):
+        """Whether this index can be used for df_ann and date_arr."""
+        return (df_ann is self.df_ann or df_ann.equals(self.df_ann)) \
+            and len(date_arr) == len(self.date_arr) and np.all(np.asarray(date_arr) == self.date_arr)
+
+    def align(self, df_value):
+        """
+        Expand df_value, equivalent to align(df_value, df_ann, date_arr).
+
+        Parameters
+        ----------
+        df_value : pd.DataFrame
+            shape = (n_quarters, n_securities). Columns can be a subset of columns of df_ann.
+
+        Returns
+        -------
+        pd.DataFrame
+
+        """
+        if df_value.index.equals(self.df_ann.index):
+            if df_value.columns.equals(self.df_ann.columns):
+                return align_by_positions(df_value, self.pos, self.date_arr)
+            cols = self.df_ann.columns.get_indexer(df_value.columns)
+            if np.all(cols >= 0):
+                return align_by_positions(df_value, self.pos[:, cols], self.date_arr)
+        return align(df_value, self.df_ann, self.date_arr)
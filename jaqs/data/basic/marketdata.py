@@ -73,6 +73,28 @@ class Bar(object):
             bar_list.append(bar)
         return bar_list
 
+    @classmethod
+    def create_from_columns(cls, columns, start=0, end=None):
+        """
+        Create a list of Bars from columns.
+        
+        Parameters
+        ----------
+        columns : dict
+            {attribute name: np.ndarray}, one element per Bar.
+        start : int
+        end : int, optional
+            Only create Bars of rows [start, end).
+
+        Returns
+        -------
+        bar_list : list of Bar
+
+        """
+        names = list(columns.keys())
+        lists = [columns[name][start:end].tolist() for name in names]
+        return [cls.create_from_dict(dict(zip(names, values))) for values in zip(*lists)]
+    
     @classmethod
     def create_from_dict(cls, dic):
         """
@@ -0,0 +1,281 @@
+# encoding: utf-8
+"""
+QueryCache stores results of data queries on local disk, so that identical queries
+(re-running a backtest, rebuilding a DataView) do not download the same data again.
+
+Every result is saved as one compressed .npz file with one array per column,
+its file name is the hash of the query (method and all query arguments).
+
+"""
+from __future__ import print_function
+import os
+import json
+import time
+import hashlib
+import datetime
+import threading
+try:
+    basestring
+except NameError:
+    basestring = str
+
+import numpy as np
+import pandas as pd
+
+import jaqs.util as jutil
+
+# atomic rename which overwrites the destination (os.rename in Python 2 on POSIX)
+_replace = getattr(os, 'replace', os.rename)
+
+
+class QueryCache(object):
+    """
+    Content-addressed on-disk cache of query results with expiration and size-bounded LRU eviction.
+
+    Parameters
+    ----------
+    folder_path : str
+        Directory of cache files.
+    max_size : int, optional
+        Max total size of cache files in bytes, least recently used entries are removed when exceeded.
+        1 GB by default.
+    ttl : dict, optional
+        {view or method name: seconds to live}, None means never expire. Overrides the default policy:
+            daily / bar / views queried by date (e.g. financial statements by ann_date, trade calendar):
+                never expire if the queried dates are all before today, otherwise expire at next market close;
+            forward-adjusted daily and other views: expire after default_ttl.
+    default_ttl : int, optional
+        Seconds to live of results without a specific policy, one day by default.
+    offline : bool, optional
+        If True, results are only served from cache and expired entries are still used.
+
+    """
+    INDEX_FILE_NAME = 'cache_index.json'
+    # data of a trade date is regarded as final after this time (HHMMSS)
+    MARKET_CLOSE_TIME = 160000
+
+    def __init__(self, folder_path, max_size=1024 ** 3, ttl=None, default_ttl=24 * 3600, offline=False):
+        self.folder_path = os.path.abspath(folder_path)
+        self.max_size = max_size
+        self.ttl = ttl or dict()
+        self.default_ttl = default_ttl
+        self.offline = offline
+
+        self._lock = threading.RLock()
+        self._entries = jutil.read_json(self._index_path) or dict()
+        # whether entries in memory differ from the index file
+        self._dirty = False
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.folder_path, self.INDEX_FILE_NAME)
+
+    def _file_path(self, key):
+        return os.path.join(self.folder_path, key + '.npz')
+
+    @property
+    def size(self):
+        """Total bytes of cache files."""
+        return sum(entry['size'] for entry in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    # -----------------------------------------------------------------------------------
+    # Keys and expiration
+    @staticmethod
+    def make_key(method, **kwargs):
+        """Hash of query method and arguments. Arguments with the same values always give the same key."""
+        s = json.dumps([method, kwargs], sort_keys=True, default=str)
+        return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _parse_filter(filter_str):
+        res = dict()
+        for item in filter_str.split('&'):
+            if '=' in item:
+                k, v = item.split('=', 1)
+                res[k.strip()] = v.strip()
+        return res
+
+    @staticmethod
+    def _to_int_date(date):
+        if date is None or date == '' or date == 0:
+            return None
+        try:
+            return int(str(date).replace('-', ''))
+        except ValueError:
+            return None
+
+    def _next_close(self, now):
+        hour, minute, second = self.MARKET_CLOSE_TIME // 10000, self.MARKET_CLOSE_TIME // 100 % 100, \
+            self.MARKET_CLOSE_TIME % 100
+        close_dt = now.replace(hour=hour, minute=minute, second=second, microsecond=0)
+        if now >= close_dt:
+            close_dt += datetime.timedelta(days=1)
+        return time.mktime(close_dt.timetuple())
+
+    def get_expire_time(self, method, params, now=None):
+        """
+        Expiration time (seconds since epoch) of the result of a query, None if it never expires.
+
+        Parameters
+        ----------
+        method : str
+            'daily', 'bar' or 'query'
+        params : dict
+            Query arguments.
+        now : float, optional
+            Current time in seconds since epoch.
+
+        Returns
+        -------
+        float or None
+
+        """
+        if now is None:
+            now = time.time()
+        view = params.get('view', method)
+        for name in (view, method):
+            if name in self.ttl:
+                ttl = self.ttl[name]
+                return None if ttl is None else now + ttl
+        if method == 'daily':
+            if params.get('adjust_mode') == 'pre':
+                # forward-adjusted prices change after every new dividend
+                return now + self.default_ttl
+            end_date = self._to_int_date(params.get('end_date'))
+        elif method == 'bar':
+            end_date = self._to_int_date(params.get('trade_date'))
+        else:
+            dic_filter = self._parse_filter(params.get('filter', ''))
+            end_date = self._to_int_date(dic_filter.get('end_date', dic_filter.get('trade_date')))
+            if end_date is None:
+                return now + self.default_ttl
+
+        now_dt = datetime.datetime.fromtimestamp(now)
+        today = jutil.convert_datetime_to_int(now_dt)
+        if end_date is not None and end_date < today:
+            return None
+        return self._next_close(now_dt)
+
+    # -----------------------------------------------------------------------------------
+    # Get and put
+    def get(self, key):
+        """
+        Return cached DataFrame of key, None if it is not cached or has expired (unless offline).
+
+        Access time is only updated in memory, the index file is written by put, clear and flush.
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not self.offline and entry['expire'] is not None and entry['expire'] <= time.time():
+                self._remove(key)
+                return None
+        # files are replaced atomically by put, reading needs no lock
+        try:
+            df = self._read_frame(self._file_path(key))
+        except (IOError, OSError, ValueError, KeyError):
+            with self._lock:
+                self._remove(key)
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries[key]['last_access'] = time.time()
+                self._dirty = True
+        return df
+
+    def put(self, key, df, expire=None):
+        """
+        Store df under key.
+
+        Parameters
+        ----------
+        key : str
+        df : pd.DataFrame
+        expire : float or None
+            Expiration time in seconds since epoch. None means never expire.
+
+        """
+        with self._lock:
+            path = self._file_path(key)
+            jutil.create_dir(path)
+            self._write_frame(df, path)
+            now = time.time()
+            self._entries[key] = {'size': os.path.getsize(path), 'expire': expire, 'last_access': now}
+            self._evict()
+            self._save_index()
+
+    def flush(self):
+        """Write access times and removals since the last write to the index file."""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def clear(self):
+        """Remove all cached entries."""
+        with self._lock:
+            for key in list(self._entries.keys()):
+                self._remove(key)
+            self._save_index()
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        self._dirty = True
+        path = self._file_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _evict(self):
+        """Remove least recently used entries until total size is within max_size."""
+        total = self.size
+        if total <= self.max_size:
+            return
+        for key in sorted(self._entries, key=lambda k: self._entries[k]['last_access']):
+            total -= self._entries[key]['size']
+            self._remove(key)
+            if total <= self.max_size:
+                break
+
+    def _save_index(self):
+        jutil.save_json(self._entries, self._index_path)
+        self._dirty = False
+
+    # -----------------------------------------------------------------------------------
+    # Columnar file format
+    @staticmethod
+    def _write_frame(df, path):
+        arrays = dict()
+        columns = list(df.columns)
+        for i, col in enumerate(columns):
+            arr = df[col].values
+            if arr.dtype == object and all(isinstance(x, basestring) for x in arr):
+                arr = arr.astype(np.unicode_)
+            arrays['c{:d}'.format(i)] = arr
+        arrays['columns'] = np.array([str(col) for col in columns], dtype=np.unicode_)
+        if not isinstance(df.index, pd.RangeIndex):
+            arrays['index'] = df.index.values
+        # write to a temporary file first, readers never see a partially written file
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        _replace(tmp_path, path)
+
+    @staticmethod
+    def _read_frame(path):
+        with np.load(path, allow_pickle=True) as data:
+            columns = list(data['columns'])
+            dic = dict()
+            for i, col in enumerate(columns):
+                arr = data['c{:d}'.format(i)]
+                if arr.dtype.kind == 'U':
+                    arr = arr.astype(object)
+                dic[col] = arr
+            index = data['index'] if 'index' in data.files else None
+        return pd.DataFrame(dic, columns=columns, index=index)
@@ -28,9 +28,9 @@ def get_symbol_date_map(data_service, df_inst_, start_date, end_date, days_to_de
     j = 0
     for i, td in enumerate(dates):
         delist_date = df_inst_['delist_date'].iat[j]
-        idx = np.nonzero(dates == delist_date)
+        idx = np.searchsorted(dates, delist_date)
         
-        if (delist_date <= dates[-1]) and (idx[0][0] - i <= days_to_delist):
+        if (delist_date <= dates[-1]) and (idx - i <= days_to_delist):
             j += 1
             delist_date = df_inst_['delist_date'].iat[j]
         symbol = df_inst_['symbol'].iat[j]
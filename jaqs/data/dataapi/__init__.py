@@ -11,3 +11,10 @@ from __future__ import unicode_literals
 from .data_api import DataApi
 
 __all__ = ['DataApi']
+
+try:
+    from .async_data_api import AsyncDataApi
+    __all__.append('AsyncDataApi')
+except SyntaxError:
+    # asyncio client requires Python 3.5+
+    pass
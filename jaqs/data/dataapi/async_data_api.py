@@ -0,0 +1,409 @@
+# encoding: utf-8
+"""
+AsyncDataApi is DataApi for asyncio applications: queries are awaitable and
+subscribed quotes are read by an async iterator, all within the event loop
+(no receiving / callback threads).
+
+Python 3.5+ only.
+
+"""
+import asyncio
+import random
+import time
+
+import numpy as np
+import zmq
+import zmq.asyncio
+
+from . import jrpc_py
+from . import utils
+from .data_api import DataApi
+
+_PACKERS = {"msgpack_snappy": (jrpc_py._pack_msgpack_snappy, jrpc_py._unpack_msgpack_snappy),
+            "msgpack": (jrpc_py._pack_msgpack, jrpc_py._unpack_msgpack),
+            "json": (jrpc_py._pack_json, jrpc_py._unpack_json)}
+
+
+class QuoteIterator(object):
+    """
+    Async iterator of subscribed quotes (dict), see AsyncDataApi.quotes.
+
+    Attributes
+    ----------
+    n_dropped : int
+        Number of quotes dropped because the consumer fell behind by more than max_size quotes.
+
+    """
+    def __init__(self, api, max_size=0):
+        self._api = api
+        self._queue = asyncio.Queue(maxsize=max_size)
+        self.n_dropped = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._queue.get()
+
+    def put(self, quote):
+        """Add a quote, the oldest one is dropped if the queue is full."""
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.n_dropped += 1
+        self._queue.put_nowait(quote)
+
+    def close(self):
+        """Stop receiving quotes."""
+        self._api._remove_quote_iterator(self)
+
+
+class AsyncDataApi(DataApi):
+    """
+    DataApi whose query methods (daily, bar, bar_quote, quote, query), login and subscribe are coroutines.
+    Arguments and results are the same as those of DataApi.
+
+    All methods must be called in the same event loop. Heartbeats are sent by a task of the loop,
+    session and subscription are recovered after reconnection.
+
+    Examples
+    --------
+    async def main():
+        api = AsyncDataApi("tcp://data.tushare.org:8910")
+        r, msg = await api.login(username, password)
+        df, msg = await api.daily("600030.SH", start_date=20170503, end_date=20170708)
+
+        quotes = api.quotes()
+        await api.subscribe("600030.SH,000002.SZ")
+        async for quote in quotes:
+            print(quote['symbol'], quote['last'])
+
+    """
+
+    def __init__(self, addr="tcp://data.tushare.org:8910", data_format="msgpack_snappy"):
+        if data_format not in _PACKERS:
+            raise ValueError("unknown data_format " + data_format)
+        self._addr = addr
+        self._pack, self._unpack = _PACKERS[data_format]
+
+        self._ctx = None
+        self._sock = None
+        self._tasks = []
+        self._waiter_map = {}
+        self._next_callid = 0
+        self._last_heartbeat_rsp_time = 0
+        self._heartbeat_interval = 1
+        self._heartbeat_timeout = 3
+        self._quote_iterators = []
+
+        self._on_jsq_callback = None
+
+        self._connected = False
+        self._loggined = False
+        self._username = ""
+        self._password = ""
+        self._data_format = "default"
+        self._callback = None
+        self._schema = []
+        self._schema_id = 0
+        self._schema_map = {}
+        self._sub_hash = ""
+        self._subscribed_set = set()
+        self._timeout = 20
+
+    # -----------------------------------------------------------------------------------
+    # Connection
+    def _start(self):
+        """Connect and start receiving and heartbeat tasks in the running loop."""
+        if self._sock is not None:
+            return
+        self._ctx = zmq.asyncio.Context()
+        sock = self._ctx.socket(zmq.DEALER)
+        identity = str(random.randint(1000000, 100000000)) + '$' + str(random.randint(1000000, 1000000000))
+        sock.setsockopt(zmq.IDENTITY, identity.encode('utf-8'))
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.connect(self._addr)
+        self._sock = sock
+        self._tasks = [asyncio.ensure_future(self._recv_loop()),
+                       asyncio.ensure_future(self._heartbeat_loop())]
+
+    def close(self):
+        """
+        Close the data api.
+
+        """
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for future, _ in self._waiter_map.values():
+            if not future.done():
+                future.cancel()
+        self._waiter_map = {}
+        if self._sock is not None:
+            self._sock.close(0)
+            self._sock = None
+            self._ctx.term()
+        self._connected = False
+
+    def __del__(self):
+        if self._sock is not None:
+            self._sock.close(0)
+
+    def set_heartbeat(self, interval, timeout):
+        self._heartbeat_interval = interval
+        self._heartbeat_timeout = timeout
+
+    async def _recv_loop(self):
+        while True:
+            data = await self._sock.recv()
+            try:
+                self._on_data_arrived(data)
+            except Exception as e:
+                print("_recv_loop:", e)
+
+    async def _heartbeat_loop(self):
+        while True:
+            if self._connected and time.time() - self._last_heartbeat_rsp_time > self._heartbeat_timeout:
+                self._connected = False
+                if self._callback:
+                    self._callback("connection", False)
+            msg = {'jsonrpc': '2.0',
+                   'method': '.sys.heartbeat',
+                   'params': {'time': time.time()},
+                   'id': str(self._new_callid())}
+            await self._sock.send(self._pack(msg))
+            await asyncio.sleep(self._heartbeat_interval)
+
+    def _new_callid(self):
+        self._next_callid += 1
+        return self._next_callid
+
+    def _on_data_arrived(self, data):
+        msg = self._unpack(data)
+        if not msg:
+            print("wrong message format")
+            return
+
+        method = msg.get('method')
+        if method == '.sys.heartbeat':
+            self._last_heartbeat_rsp_time = time.time()
+            if not self._connected:
+                self._connected = True
+                asyncio.ensure_future(self._on_connected_async())
+            result = msg.get('result')
+            if result and 'sub_hash' in result and self._sub_hash and self._sub_hash != result['sub_hash']:
+                print("sub_hash is not same", self._sub_hash, result['sub_hash'])
+                asyncio.ensure_future(self._do_subscribe())
+
+        elif msg.get('id'):
+            waiter = self._waiter_map.pop(int(msg['id']), None)
+            if waiter is not None and not waiter[0].done():
+                future, on_result = waiter
+                if on_result:
+                    on_result(msg)
+                future.set_result(msg)
+
+        elif method == 'jsq.quote_ind' and 'result' in msg:
+            quote = self._convert_quote_ind(msg['result'])
+            if quote:
+                for iterator in self._quote_iterators:
+                    iterator.put(quote)
+                if self._on_jsq_callback:
+                    self._on_jsq_callback("quote", quote)
+
+    async def _on_connected_async(self):
+        await self._do_login()
+        await self._do_subscribe()
+        if self._callback:
+            self._callback("connection", True)
+
+    async def _call(self, method, params, timeout=6, on_result=None):
+        """
+        Same as JRpcClient.call: return the response, or timeout error if it does not arrive in time.
+        on_result(response) is called as soon as the response arrives, before messages after it are handled.
+
+        """
+        self._start()
+        callid = self._new_callid()
+        future = asyncio.get_event_loop().create_future()
+        self._waiter_map[callid] = (future, on_result)
+
+        msg = {'jsonrpc': '2.0',
+               'method': method,
+               'params': params,
+               'id': str(callid)}
+        try:
+            await self._sock.send(self._pack(msg))
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return jrpc_py._timeout_result()
+        finally:
+            self._waiter_map.pop(callid, None)
+
+    # -----------------------------------------------------------------------------------
+    # Session
+    async def login(self, username, password):
+        """
+        Login before using data api, see DataApi.login.
+
+        """
+        self._start()
+        for i in range(30):
+            if self._connected:
+                break
+            await asyncio.sleep(0.1)
+
+        if not self._connected:
+            return (None, "-1,no connection")
+
+        self._username = username
+        self._password = password
+        return await self._do_login()
+
+    async def logout(self):
+        self._loggined = None
+        cr = await self._call("auth.logout", {})
+        return utils.extract_result(cr)
+
+    async def _do_login(self):
+        if self._username and self._password:
+            rpc_params = {"username": self._username,
+                          "password": self._password}
+            cr = await self._call("auth.login", rpc_params)
+            r, msg = utils.extract_result(cr, data_format="", class_name="UserInfo")
+            self._loggined = r
+            return (r, msg)
+        else:
+            self._loggined = None
+            return (False, "-1,empty username or password")
+
+    async def _check_session(self):
+        if not self._connected:
+            return (False, "no connection")
+        elif self._loggined:
+            return (True, "")
+        elif self._username and self._password:
+            return await self._do_login()
+        else:
+            return (False, "no login session")
+
+    async def _call_rpc(self, method, data_format, data_class, **kwargs):
+        r, msg = await self._check_session()
+        if not r:
+            return (r, msg)
+
+        index_column = kwargs.pop('_index_column', None)
+        rpc_params = {}
+        for key, value in kwargs.items():
+            if isinstance(value, (int, np.integer)):
+                value = int(value)
+            rpc_params[key] = value
+
+        cr = await self._call(method, rpc_params, timeout=self._timeout)
+        return utils.extract_result(cr, data_format=data_format, index_column=index_column, class_name=data_class)
+
+    # -----------------------------------------------------------------------------------
+    # Queries: arguments are checked by DataApi, which returns errors directly or the coroutine of _call_rpc
+    @staticmethod
+    async def _await_result(res):
+        if asyncio.iscoroutine(res):
+            return await res
+        return res
+
+    async def quote(self, symbol, fields="", data_format="", **kwargs):
+        """See DataApi.quote."""
+        return await self._await_result(DataApi.quote(self, symbol, fields=fields, data_format=data_format, **kwargs))
+
+    async def bar(self, symbol, *args, **kwargs):
+        """See DataApi.bar."""
+        return await self._await_result(DataApi.bar(self, symbol, *args, **kwargs))
+
+    async def bar_quote(self, symbol, *args, **kwargs):
+        """See DataApi.bar_quote."""
+        return await self._await_result(DataApi.bar_quote(self, symbol, *args, **kwargs))
+
+    async def daily(self, symbol, start_date, end_date, *args, **kwargs):
+        """See DataApi.daily."""
+        return await self._await_result(DataApi.daily(self, symbol, start_date, end_date, *args, **kwargs))
+
+    async def query(self, view, filter="", fields="", data_format="", **kwargs):
+        """See DataApi.query."""
+        return await self._await_result(DataApi.query(self, view, filter=filter, fields=fields,
+                                                      data_format=data_format, **kwargs))
+
+    def call_async(self, func_name, *args, **kwargs):
+        """
+        Schedule a query method in the running loop, return asyncio.Task of its result.
+
+        """
+        if func_name not in ('quote', 'bar', 'bar_quote', 'daily', 'query'):
+            raise ValueError("call_async does not support {}".format(func_name))
+        return asyncio.ensure_future(getattr(self, func_name)(*args, **kwargs))
+
+    # -----------------------------------------------------------------------------------
+    # Subscription
+    def quotes(self, max_size=0):
+        """
+        Async iterator of quotes of subscribed symbols. Create it before subscribe to receive all quotes.
+
+        Parameters
+        ----------
+        max_size : int, optional
+            Max number of quotes kept for a slow consumer, older quotes are dropped. 0 means no limit.
+
+        Returns
+        -------
+        QuoteIterator
+
+        """
+        iterator = QuoteIterator(self, max_size=max_size)
+        self._quote_iterators.append(iterator)
+        return iterator
+
+    def _remove_quote_iterator(self, iterator):
+        if iterator in self._quote_iterators:
+            self._quote_iterators.remove(iterator)
+
+    async def subscribe(self, symbol, func=None, fields=""):
+        """
+        Subscribe securities, see DataApi.subscribe. Quotes are read by quotes() or passed to func("quote", quote).
+
+        """
+        r, msg = await self._check_session()
+        if not r:
+            return (r, msg)
+
+        if func:
+            self._on_jsq_callback = func
+
+        rpc_params = {"symbol": symbol,
+                      "fields": fields}
+        cr = await self._call("jsq.subscribe", rpc_params, on_result=self._on_subscribe_result)
+
+        rsp, msg = utils.extract_result(cr, data_format="", class_name="SubRsp")
+        if not rsp:
+            return (rsp, msg)
+
+        new_codes = [x.strip() for x in symbol.split(',') if x]
+        self._subscribed_set = self._subscribed_set.union(set(new_codes))
+        return (rsp['symbols'], msg)
+
+    def _on_subscribe_result(self, cr):
+        """Update schema before quotes pushed right after the response are converted."""
+        rsp, msg = utils.extract_result(cr, data_format="", class_name="SubRsp")
+        if not rsp:
+            return
+
+        self._schema_id = rsp['schema_id']
+        self._schema = rsp['schema']
+        self._sub_hash = rsp['sub_hash']
+        self._make_schema_map()
+
+    async def _do_subscribe(self):
+        """Subscribe again when reconnected or hash_code is not same"""
+        if not self._subscribed_set:
+            return
+
+        codes = sorted(self._subscribed_set)
+        rpc_params = {"symbol": ",".join(codes),
+                      "fields": ""}
+        await self._call("jsq.subscribe", rpc_params, on_result=self._on_subscribe_result)
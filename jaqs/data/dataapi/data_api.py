@@ -4,12 +4,14 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import time
+from functools import partial
 
 import numpy as np
 
 from . import jrpc_py
 # import jrpc
 from . import utils
+from .quote_stream import QuoteBuffer
 
 
 # def set_log_dir(log_dir):
@@ -54,18 +56,24 @@ class DataApi(object):
     Methods
     -------
     subscribe
+    subscribe_batch
     quote
     daily
     bar
     bar_quote    
+    call_async
 
     """
     
-    def __init__(self, addr="tcp://data.tushare.org:8910", use_jrpc=False):
+    def __init__(self, addr="tcp://data.tushare.org:8910", use_jrpc=False, n_sessions=1):
         """Create DataApi client.
         
         If use_jrpc, try to load the C version of JsonRpc. If failed, use pure
         Python version of JsonRpc.
+        
+        With n_sessions > 1, queries are spread over n_sessions connections (each
+        with its own socket and receiving thread), so that queries from many threads
+        are not serialized behind one socket. Subscription uses the first session.
         """
         self._remote = None
         #        if use_jrpc:
@@ -78,12 +86,22 @@ class DataApi(object):
         if not self._remote:
             self._remote = jrpc_py.JRpcClient()
         
+        # all sessions, queries are sent by the logged in one with fewest pending calls
+        self._remotes = [self._remote]
+        self._loggined_remotes = set()
+        for i in range(n_sessions - 1):
+            remote = jrpc_py.JRpcClient()
+            remote.on_connected = partial(self._on_session_connected, remote)
+            remote.on_disconnected = partial(self._on_session_disconnected, remote)
+            self._remotes.append(remote)
+        
         self._remote.on_rpc_callback = self._on_rpc_callback
+        self._remote.on_rpc_notification = self._on_rpc_notification
         self._remote.on_disconnected = self._on_disconnected
         self._remote.on_connected = self._on_connected
-        self._remote.connect(addr)
         
         self._on_jsq_callback = None
+        self._quote_buffer = None
         
         self._connected = False
         self._loggined = False
@@ -97,6 +115,10 @@ class DataApi(object):
         self._sub_hash = ""
         self._subscribed_set = set()
         self._timeout = 20
+        
+        # callbacks may be called once connected, so connect after all attributes are initialized
+        for remote in self._remotes:
+            remote.connect(addr)
     
     def login(self, username, password):
         
@@ -131,6 +153,10 @@ class DataApi(object):
         
         rpc_params = {}
         
+        for remote in self._remotes[1:]:
+            if remote in self._loggined_remotes:
+                remote.call("auth.logout", rpc_params)
+        self._loggined_remotes.clear()
         cr = self._remote.call("auth.logout", rpc_params)
         return utils.extract_result(cr)
     
@@ -140,7 +166,10 @@ class DataApi(object):
 
         """
         
-        self._remote.close()
+        if self._quote_buffer is not None:
+            self._quote_buffer.close()
+        for remote in self._remotes:
+            remote.close()
         
         # def set_callback(self, callback):
     
@@ -428,8 +457,61 @@ class DataApi(object):
         self._schema = rsp['schema']
         self._sub_hash = rsp['sub_hash']
         self._make_schema_map()
+        if self._quote_buffer is not None:
+            self._quote_buffer.set_schema(self._schema_id, self._schema)
         return (rsp['symbols'], msg)
     
+    def subscribe_batch(self, symbol, func, fields="", batch_size=1000, batch_interval=100,
+                        capacity=100000, conflate=True):
+        """
+        Subscribe securities, quotes are delivered in batches of arrays instead of one call per quote.
+        
+        Quotes are decoded into a bounded buffer in the receiving thread, see QuoteBuffer.
+        Use quote_stats to monitor lag, conflated and dropped quotes.
+        
+        Parameters
+        ----------
+        symbol : str
+            Separated by ','
+        func : callable
+            func(batch), batch is a dict {field name: np.ndarray}.
+        fields : str, optional
+        batch_size : int
+            Deliver as soon as this many quotes are pending.
+        batch_interval : int
+            Max milliseconds between deliveries.
+        capacity : int
+            Max number of pending quotes, the oldest are dropped beyond it.
+        conflate : bool
+            Keep only the latest pending quote of each symbol when the consumer falls behind.
+
+        Returns
+        -------
+        (list of str, str)
+            Subscribed symbols and message, the same as subscribe.
+        
+        Examples
+        --------
+        def on_quotes(batch):
+            print(batch['symbol'], batch['last'])
+        api.subscribe_batch("000001.SZ,600030.SH", on_quotes, batch_interval=50)
+
+        """
+        if self._quote_buffer is None:
+            self._quote_buffer = QuoteBuffer(func, capacity=capacity, batch_size=batch_size,
+                                             batch_interval=batch_interval, conflate=conflate)
+        else:
+            self._quote_buffer.func = func
+        
+        return self.subscribe(symbol, fields=fields)
+    
+    @property
+    def quote_stats(self):
+        """Counters of quotes subscribed by subscribe_batch, None if not subscribed."""
+        if self._quote_buffer is None:
+            return None
+        return self._quote_buffer.stats
+    
     def unsubscribe(self, symbol):
         """Unsubscribe securities.
 
@@ -437,13 +519,51 @@ class DataApi(object):
         """
         assert False, "NOT IMPLEMENTED"
     
+    def call_async(self, func_name, *args, **kwargs):
+        """
+        Call a query method without waiting for the result.
+
+        Parameters
+        ----------
+        func_name : str
+            {'quote', 'bar', 'bar_quote', 'daily', 'query'}
+        args, kwargs
+            Arguments of the query method.
+
+        Returns
+        -------
+        future : jrpc_py.RpcFuture
+            future.result() returns what the query method returns, i.e. (df, msg).
+
+        Examples
+        --------
+        futures = [api.call_async('daily', symbol, start_date=20170503, end_date=20170708)
+                   for symbol in ['000001.SH', '600030.SH']]
+        results = [future.result() for future in futures]
+
+        """
+        if func_name not in ('quote', 'bar', 'bar_quote', 'daily', 'query'):
+            raise ValueError("call_async does not support {}".format(func_name))
+        
+        kwargs['_async'] = True
+        res = getattr(self, func_name)(*args, **kwargs)
+        if isinstance(res, jrpc_py.RpcFuture):
+            return res
+        
+        # arguments error or no session: already done
+        future = jrpc_py.RpcFuture()
+        future.set_result(res)
+        return future
+    
     def __del__(self):
-        self._remote.close()
+        for remote in self._remotes:
+            remote.close()
     
     def _on_disconnected(self):
         """JsonRpc callback"""
         #        print "DataApi: _on_disconnected"
         self._connected = False
+        self._loggined_remotes.discard(self._remote)
         
         if self._callback:
             self._callback("connection", False)
@@ -458,6 +578,15 @@ class DataApi(object):
         if self._callback:
             self._callback("connection", True)
     
+    def _on_session_connected(self, remote):
+        """JsonRpc callback of sessions other than the first one"""
+        if self._loggined:
+            self._login_session(remote)
+    
+    def _on_session_disconnected(self, remote):
+        """JsonRpc callback of sessions other than the first one"""
+        self._loggined_remotes.discard(remote)
+    
     def _check_session(self):
         if not self._connected:
             return (False, "no connection")
@@ -502,6 +631,16 @@ class DataApi(object):
         
         return quote
     
+    def _on_rpc_notification(self, method, data):
+        """JsonRpc callback in the receiving thread: quotes go into the buffer of subscribe_batch."""
+        if method == "jsq.quote_ind" and self._quote_buffer is not None:
+            try:
+                self._quote_buffer.put(data)
+            except Exception as e:
+                print("_on_rpc_notification:", e)
+            return True
+        return False
+    
     def _on_rpc_callback(self, method, data):
         # print "_on_rpc_callback:", method, data
         
@@ -528,18 +667,31 @@ class DataApi(object):
             return (r, msg)
         
         index_column = None
+        is_async = False
         rpc_params = {}
         for key, value in kwargs.items():
             if key == '_index_column':
                 index_column = value
+            elif key == '_async':
+                is_async = value
             else:
                 if isinstance(value, (int, np.integer)):
                     value = int(value)
                 rpc_params[key] = value
         
-        cr = self._remote.call(method, rpc_params, timeout=self._timeout)
-        
-        return utils.extract_result(cr, data_format=data_format, index_column=index_column, class_name=data_class)
+        convert = partial(utils.extract_result,
+                          data_format=data_format, index_column=index_column, class_name=data_class)
+        future = self._get_remote().call_async(method, rpc_params, timeout=self._timeout, convert=convert)
+        if is_async:
+            return future
+        return future.result()
+    
+    def _get_remote(self):
+        """Logged in session with fewest pending calls."""
+        remotes = [remote for remote in self._remotes if remote in self._loggined_remotes]
+        if not remotes:
+            return self._remote
+        return min(remotes, key=lambda remote: remote.n_pending)
     
     def _make_schema_map(self):
         self._schema_map = {}
@@ -552,17 +704,29 @@ class DataApi(object):
         #    return (False, "-1,no connection")
         
         if self._username and self._password:
-            rpc_params = {"username": self._username,
-                          "password": self._password}
-            
-            cr = self._remote.call("auth.login", rpc_params)
-            r, msg = utils.extract_result(cr, data_format="", class_name="UserInfo")
+            r, msg = self._login_session(self._remote)
             self._loggined = r
+            if r:
+                for remote in self._remotes[1:]:
+                    if remote._connected and remote not in self._loggined_remotes:
+                        self._login_session(remote)
             return (r, msg)
         else:
             self._loggined = None
             return (False, "-1,empty username or password")
     
+    def _login_session(self, remote):
+        rpc_params = {"username": self._username,
+                      "password": self._password}
+        
+        cr = remote.call("auth.login", rpc_params)
+        r, msg = utils.extract_result(cr, data_format="", class_name="UserInfo")
+        if r:
+            self._loggined_remotes.add(remote)
+        else:
+            self._loggined_remotes.discard(remote)
+        return (r, msg)
+    
     def _do_subscribe(self):
         """Subscribe again when reconnected or hash_code is not same"""
         if not self._subscribed_set: return
@@ -587,3 +751,5 @@ class DataApi(object):
         # return (rsp.securities, msg)
         
         self._make_schema_map()
+        if self._quote_buffer is not None:
+            self._quote_buffer.set_schema(self._schema_id, self._schema)
@@ -21,13 +21,22 @@ import copy
 qEmpty = copy.copy(queue.Empty)
 
 
+# msgpack >= 0.5.2 replaced encoding by raw / use_bin_type, 1.0 removed it
+if msgpack.version >= (0, 5, 2):
+    _MSGPACK_PACK_KWARGS = {'use_bin_type': False}
+    _MSGPACK_UNPACK_KWARGS = {'raw': False}
+else:
+    _MSGPACK_PACK_KWARGS = {'encoding': 'utf-8'}
+    _MSGPACK_UNPACK_KWARGS = {'encoding': 'utf-8'}
+
+
 def _unpack_msgpack_snappy(str):
     if str.startswith(b'S'):
         tmp = snappy.uncompress(str[1:])
         # print "SNAPPY: ", len(str), len(tmp)
-        obj = msgpack.loads(tmp, encoding='utf-8')
+        obj = msgpack.loads(tmp, **_MSGPACK_UNPACK_KWARGS)
     elif str.startswith(b'\0'):
-        obj = msgpack.loads(str[1:], encoding='utf-8')
+        obj = msgpack.loads(str[1:], **_MSGPACK_UNPACK_KWARGS)
     else:
         return None
     
@@ -36,7 +45,7 @@ def _unpack_msgpack_snappy(str):
 
 def _pack_msgpack_snappy(obj):
     # print "pack", obj
-    tmp = msgpack.dumps(obj, encoding='utf-8')
+    tmp = msgpack.dumps(obj, **_MSGPACK_PACK_KWARGS)
     if len(tmp) > 1000:
         return b'S' + snappy.compress(tmp)
     else:
@@ -44,11 +53,11 @@ def _pack_msgpack_snappy(obj):
 
 
 def _unpack_msgpack(str):
-    return msgpack.loads(str, encoding='utf-8')
+    return msgpack.loads(str, **_MSGPACK_UNPACK_KWARGS)
 
 
 def _pack_msgpack(obj):
-    return msgpack.dumps(obj, encoding='utf-8')
+    return msgpack.dumps(obj, **_MSGPACK_PACK_KWARGS)
 
 
 def _unpack_json(str):
@@ -59,9 +68,79 @@ def _pack_json(obj):
     return json.dumps(obj, encoding='utf-8')
 
 
+def _timeout_result():
+    return {'error': {'error': -1, 'message': "timeout"}}
+
+
+class RpcFuture(object):
+    """
+    Result of an asynchronous call, see JRpcClient.call_async.
+    
+    The call expires after its timeout: result() then returns the same timeout error as JRpcClient.call.
+    
+    """
+    def __init__(self, deadline=None, convert=None, on_expire=None):
+        self._deadline = deadline
+        self._convert = convert
+        self._on_expire = on_expire
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._callbacks = []
+    
+    @property
+    def deadline(self):
+        return self._deadline
+    
+    def done(self):
+        return self._event.is_set()
+    
+    def set_result(self, result):
+        """Set raw result and run callbacks, results set after the first one are ignored."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._result = result
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
+    
+    def expire(self):
+        """Finish with timeout error if no result has arrived."""
+        if self._on_expire:
+            self._on_expire(self)
+        self.set_result(_timeout_result())
+    
+    def wait(self, timeout=None):
+        """Wait at most timeout seconds (until the deadline of the call if None), return whether it is done."""
+        if self._deadline is not None:
+            remaining = max(self._deadline - time.time(), 0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        self._event.wait(timeout)
+        if not self.done() and self._deadline is not None and time.time() >= self._deadline:
+            self.expire()
+        return self.done()
+    
+    def result(self):
+        """Wait until the result arrives or the call expires, return the (converted) result."""
+        self.wait()
+        if self._convert is not None:
+            return self._convert(self._result)
+        return self._result
+    
+    def add_done_callback(self, func):
+        """func(future) is called when the future is done, in the thread setting the result."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+
 class JRpcClient(object):
     def __init__(self, data_format="msgpack_snappy"):
-        self._waiter_lock = threading.Lock()
+        # call id -> RpcFuture of pending calls. Single dict operations are atomic, no lock is needed.
         self._waiter_map = {}
 
         self._should_close = False
@@ -72,10 +151,12 @@ class JRpcClient(object):
         self._last_heartbeat_rsp_time = 0
         self._connected = False
 
+        self.on_connected = None
         self.on_disconnected = None
         self.on_rpc_callback = None
+        # called in the receiving thread for notifications, returns True if handled (then not queued)
+        self.on_rpc_notification = None
         self._callback_queue = queue.Queue()
-        self._call_wait_queue = queue.Queue()
 
         self._ctx = zmq.Context()
         self._pull_sock = self._ctx.socket(zmq.PULL)
@@ -116,6 +197,11 @@ class JRpcClient(object):
     def __del__(self):
         self.close()
 
+    @property
+    def n_pending(self):
+        """Number of calls waiting for results."""
+        return len(self._waiter_map)
+
     def next_callid(self):
         self._callid_lock.acquire()
         self._next_callid += 1
@@ -146,6 +232,7 @@ class JRpcClient(object):
                 if remote_sock and time.time() - heartbeat_time > self._heartbeat_interval:
                     self._send_hearbeat()
                     heartbeat_time = time.time()
+                    self._expire_waiters()
 
                 socks = dict(poller.poll(500))
                 if self._pull_sock in socks and socks[self._pull_sock] == zmq.POLLIN:
@@ -179,6 +266,9 @@ class JRpcClient(object):
             except Exception as e:
                 print("_recv_run:", e)
 
+        if remote_sock:
+            remote_sock.close(0)
+
     def _callback_run(self):
         while not self._should_close:
             try:
@@ -230,6 +320,8 @@ class JRpcClient(object):
         self._should_close = True
         self._callback_thread.join()
         self._recv_thread.join()
+        self._push_sock.close(0)
+        self._pull_sock.close(0)
 
     def _on_data_arrived(self, str):
         try:
@@ -254,15 +346,14 @@ class JRpcClient(object):
             elif 'id' in msg and msg['id']:
                 
                 # Call result
-                id = int(msg['id'])
-                
-                if self._waiter_lock.acquire():
-                    if id in self._waiter_map:
-                        q = self._waiter_map[id]
-                        if q: q.put(msg)
-                    self._waiter_lock.release()
+                future = self._waiter_map.pop(int(msg['id']), None)
+                if future is not None:
+                    future.set_result(msg)
             else:
                 # Notification message
+                if ('method' in msg and 'result' in msg and self.on_rpc_notification
+                        and self.on_rpc_notification(msg['method'], msg['result'])):
+                    return
                 if 'method' in msg and 'result' in msg and self.on_rpc_callback:
                     self._async_call(lambda: self.on_rpc_callback(msg['method'], msg['result']))
         
@@ -278,63 +369,65 @@ class JRpcClient(object):
         json_str = self._pack(msg)
         self._send_request(json_str)
 
-    def _alloc_wait_queue(self):
-        self._waiter_lock.acquire()
-        if self._call_wait_queue:
-            q = self._call_wait_queue
-            self._call_wait_queue = None
-        else:
-            q = queue.Queue()
-        self._waiter_lock.release()
-        return q
-
-    def _free_wait_queue(self, q):
-        self._waiter_lock.acquire()
-        if not self._call_wait_queue:
-            self._call_wait_queue = q
-        else:
-            del q
-        self._waiter_lock.release()
+    def _expire_waiters(self):
+        """Finish calls whose deadlines have passed, so that callbacks of lost calls are called."""
+        now = time.time()
+        for future in list(self._waiter_map.values()):
+            if future.deadline is not None and future.deadline <= now:
+                future.expire()
 
-    def call(self, method, params, timeout=6):
-        # print "call", method, params, timeout
-        callid = self.next_callid()
-        if timeout:
-            q = self._alloc_wait_queue()
+    def _drop_waiter(self, callid):
+        self._waiter_map.pop(callid, None)
 
-            self._waiter_lock.acquire()
-            self._waiter_map[callid] = q
-            self._waiter_lock.release()
+    def call_async(self, method, params, timeout=6, convert=None):
+        """
+        Send a request without waiting for the result.
+        
+        Calls are multiplexed by call id, so any number of calls can be in flight on one connection.
+
+        Parameters
+        ----------
+        method : str
+        params : dict
+        timeout : float
+            Seconds to wait for the result.
+        convert : callable, optional
+            Applied to the raw result {'result': ..., 'error': ...} in RpcFuture.result.
+
+        Returns
+        -------
+        RpcFuture
+
+        """
+        callid = self.next_callid()
+        future = RpcFuture(deadline=time.time() + timeout, convert=convert,
+                           on_expire=lambda f: self._drop_waiter(callid))
+        self._waiter_map[callid] = future
         
         msg = {'jsonrpc': '2.0',
                'method': method,
                'params': params,
                'id': str(callid)}
-
+        
         # print "SEND", msg
         json_str = self._pack(msg)
         self._send_request(json_str)
-        
-        if timeout:
-            ret = {}
-            try:
-                r = q.get(timeout=timeout)
-                q.task_done()
-            except qEmpty:
-                r = None
-
-            self._waiter_lock.acquire()
-            self._waiter_map[callid] = None
-            self._waiter_lock.release()
-            self._free_wait_queue(q)
-
-            if r:
-                if 'result' in r:
-                    ret['result'] = r['result']
-
-                if 'error' in r:
-                    ret['error'] = r['error']
+        return future
 
-            return ret if ret else {'error': {'error': -1, 'message': "timeout"}}
-        else:
+    def call(self, method, params, timeout=6):
+        # print "call", method, params, timeout
+        if not timeout:
+            msg = {'jsonrpc': '2.0',
+                   'method': method,
+                   'params': params,
+                   'id': str(self.next_callid())}
+            self._send_request(self._pack(msg))
             return {'result': True}
+        
+        r = self.call_async(method, params, timeout=timeout).result()
+        ret = {}
+        if 'result' in r:
+            ret['result'] = r['result']
+        if 'error' in r:
+            ret['error'] = r['error']
+        return ret if ret else _timeout_result()
@@ -0,0 +1,328 @@
+"""
+LocalDataServer is a stand-in of the remote data server for offline tests and benchmarks.
+
+It speaks the same protocol as jrpc_py (ZMQ ROUTER socket, msgpack + snappy messages)
+and answers auth.login, jsd.query (daily), jsi.query (bar), jset.query (reference data),
+jsq.subscribe (quotes) and heartbeats from tables loaded from a directory of files:
+
+    daily.parquet           jsd.query, columns symbol, trade_date, ...
+    bar.parquet             jsi.query, columns symbol, trade_date, time, ...
+    quote.parquet           jsq.subscribe, one row per pushed quote, columns symbol, ...
+    jz.secTradeCal.parquet  jset.query of view jz.secTradeCal (any view name)
+
+.h5 / .hdf (key 'data') and .csv files are read as well.
+Latency and throughput limits can be injected to measure clients reproducibly.
+
+Run: python -m jaqs.data.dataapi.local_server --data-dir DIR --port 8910 --latency 0.05
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import heapq
+import os
+import threading
+import time
+
+import pandas as pd
+import zmq
+
+from . import jrpc_py
+
+
+_DATE_COLUMNS = ['trade_date', 'ann_date', 'date', 'in_date']
+_KEY_COLUMNS = ['symbol', 'trade_date', 'time']
+_EXTENSIONS = ['.parquet', '.h5', '.hdf', '.csv']
+
+
+def _read_table(path):
+    ext = os.path.splitext(path)[1]
+    if ext == '.parquet':
+        return pd.read_parquet(path)
+    elif ext in ('.h5', '.hdf'):
+        return pd.read_hdf(path, key='data')
+    else:
+        return pd.read_csv(path)
+
+
+def _to_str(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+
+def _to_columns(df):
+    """Column-oriented result, as the remote server returns."""
+    return {col: df[col].tolist() for col in df.columns}
+
+
+class LocalDataServer(object):
+    """
+    Local data server backed by files or DataFrames.
+
+    Parameters
+    ----------
+    data_dir : str, optional
+        Directory of table files, see module doc.
+    tables : dict, optional
+        {table name: pd.DataFrame}, used before files of data_dir.
+    addr : str
+        Address to bind, a random port of 127.0.0.1 by default. See attribute addr.
+    latency : float
+        Seconds added to every reply except heartbeats.
+    rows_per_sec : float, optional
+        Max rows replied per second over all clients, no limit by default.
+    quotes_per_sec : float, optional
+        Max quotes pushed per second after a subscription, no limit by default.
+    users : dict, optional
+        {username: password}, any user can login by default.
+
+    Attributes
+    ----------
+    addr : str
+        Address clients connect to, e.g. 'tcp://127.0.0.1:8910'.
+    stats : dict
+        Counts of requests by method and of rows replied.
+
+    """
+    def __init__(self, data_dir=None, tables=None, addr='tcp://127.0.0.1:*',
+                 latency=0.0, rows_per_sec=None, quotes_per_sec=None, users=None):
+        self.data_dir = data_dir
+        self.latency = latency
+        self.rows_per_sec = rows_per_sec
+        self.quotes_per_sec = quotes_per_sec
+        self.users = users
+        self.stats = {'n_rows': 0}
+
+        self._tables = dict(tables or {})
+        self._table_lock = threading.Lock()
+        # replies scheduled by sending time: (time, seq, identity, message)
+        self._scheduled = []
+        self._seq = 0
+        self._busy_until = 0.0
+
+        self._ctx = zmq.Context()
+        self._sock = self._ctx.socket(zmq.ROUTER)
+        self._sock.setsockopt(zmq.LINGER, 0)
+        self._sock.bind(addr)
+        self.addr = self._sock.getsockopt(zmq.LAST_ENDPOINT)
+        if isinstance(self.addr, bytes):
+            self.addr = self.addr.decode('utf-8')
+
+        self._should_close = False
+        self._thread = None
+
+    # -----------------------------------------------------------------------------------
+    # Tables
+    def get_table(self, name):
+        """DataFrame of table name, None if there is no such table."""
+        with self._table_lock:
+            if name not in self._tables:
+                df = None
+                if self.data_dir:
+                    for ext in _EXTENSIONS:
+                        path = os.path.join(self.data_dir, name + ext)
+                        if os.path.exists(path):
+                            df = _read_table(path)
+                            break
+                self._tables[name] = df
+            return self._tables[name]
+
+    @staticmethod
+    def _select(df, fields, symbol=None):
+        if symbol:
+            symbols = [s.strip() for s in _to_str(symbol).split(',') if s.strip()]
+            df = df.loc[df['symbol'].isin(symbols)]
+        if fields:
+            fields = [f.strip() for f in _to_str(fields).split(',') if f.strip()]
+            cols = [col for col in df.columns if col in _KEY_COLUMNS or col in fields]
+            df = df.loc[:, cols]
+        return df
+
+    @staticmethod
+    def _filter_dates(df, start_date, end_date):
+        for col in _DATE_COLUMNS:
+            if col in df.columns:
+                if start_date:
+                    df = df.loc[df[col] >= int(start_date)]
+                if end_date:
+                    df = df.loc[df[col] <= int(end_date)]
+                break
+        return df
+
+    def _daily(self, params):
+        df = self.get_table('daily')
+        if df is None:
+            return None, "no daily table"
+        df = self._filter_dates(df, params.get('begin_date'), params.get('end_date'))
+        return self._select(df, params.get('fields'), params.get('symbol')), None
+
+    def _bar(self, params):
+        df = self.get_table('bar')
+        if df is None:
+            return None, "no bar table"
+        df = self._select(df, params.get('fields'), params.get('symbol'))
+        trade_date = params.get('trade_date')
+        if trade_date:
+            df = df.loc[df['trade_date'] == int(trade_date)]
+        if 'time' in df.columns:
+            begin_time, end_time = params.get('begin_time', 0), params.get('end_time', 240000)
+            if begin_time <= end_time:
+                mask = (df['time'] >= begin_time) & (df['time'] <= end_time)
+            else:
+                # e.g. 200000 ~ 160000: from night session of the previous day
+                mask = (df['time'] >= begin_time) | (df['time'] <= end_time)
+            df = df.loc[mask]
+        return df, None
+
+    def _jset(self, params):
+        view = params.get('view', '')
+        df = self.get_table(view)
+        if df is None:
+            return None, "no view {}".format(view)
+        dic_filter = dict()
+        for item in _to_str(params.get('filter', '')).split('&'):
+            if '=' in item:
+                k, v = item.split('=', 1)
+                dic_filter[k.strip()] = v.strip()
+        df = self._filter_dates(df, dic_filter.pop('start_date', None), dic_filter.pop('end_date', None))
+        for key, value in dic_filter.items():
+            if key in df.columns and value:
+                values = value.split(',')
+                if df[key].dtype.kind in 'iuf':
+                    values = [float(v) for v in values]
+                df = df.loc[df[key].isin(values)]
+        return self._select(df, params.get('fields')), None
+
+    # -----------------------------------------------------------------------------------
+    # Protocol
+    def _schedule(self, identity, msg, n_rows=0, delay=None):
+        now = time.time()
+        if delay is None:
+            delay = self.latency
+            if self.rows_per_sec:
+                # throughput is shared by all clients: replies wait for earlier ones
+                self._busy_until = max(now, self._busy_until) + n_rows / float(self.rows_per_sec)
+                delay += self._busy_until - now
+        self._seq += 1
+        heapq.heappush(self._scheduled, (now + delay, self._seq, identity, msg))
+
+    def _reply(self, identity, msg, result=None, error=None, n_rows=0, delay=None):
+        rsp = {'jsonrpc': '2.0', 'method': msg['method'], 'id': msg['id'],
+               'error': {'error': 0} if error is None else {'error': -1, 'message': error}}
+        if result is not None:
+            rsp['result'] = result
+        self._schedule(identity, rsp, n_rows=n_rows, delay=delay)
+
+    def _subscribe(self, identity, msg):
+        params = msg['params']
+        df = self.get_table('quote')
+        if df is None:
+            self._reply(identity, msg, error="no quote table")
+            return
+        df = self._select(df, params.get('fields'), params.get('symbol'))
+        schema = [{'id': i, 'name': col} for i, col in enumerate(df.columns)]
+        symbols = sorted(set(df['symbol']))
+        self._reply(identity, msg, result={'schema_id': 1, 'schema': schema, 'sub_hash': str(hash(tuple(symbols))),
+                                           'symbols': symbols})
+
+        indicators = list(range(len(schema)))
+        start = time.time() + self.latency
+        interval = 1.0 / self.quotes_per_sec if self.quotes_per_sec else 0.0
+        rows = zip(*[df[col].tolist() for col in df.columns])
+        for i, values in enumerate(rows):
+            notification = {'jsonrpc': '2.0', 'method': 'jsq.quote_ind',
+                            'result': {'schema_id': 1, 'indicators': indicators, 'values': list(values)}}
+            self._schedule(identity, notification, delay=start - time.time() + i * interval)
+
+    def _handle(self, identity, msg):
+        method = msg.get('method', '')
+        params = msg.get('params') or {}
+        self.stats[method] = self.stats.get(method, 0) + 1
+        if method == '.sys.heartbeat':
+            self._reply(identity, msg, result={'time': time.time()}, delay=0.0)
+        elif method == 'auth.login':
+            username = params.get('username')
+            if self.users is not None and self.users.get(username) != params.get('password'):
+                self._reply(identity, msg, error="wrong username or password")
+            else:
+                self._reply(identity, msg, result={'username': username, 'name': username})
+        elif method == 'auth.logout':
+            self._reply(identity, msg, result=True)
+        elif method == 'jsq.subscribe':
+            self._subscribe(identity, msg)
+        elif method in ('jsd.query', 'jsi.query', 'jset.query'):
+            func = {'jsd.query': self._daily, 'jsi.query': self._bar, 'jset.query': self._jset}[method]
+            try:
+                df, error = func(params)
+            except Exception as e:
+                df, error = None, "{}: {}".format(type(e).__name__, e)
+            if error:
+                self._reply(identity, msg, error=error)
+            else:
+                self.stats['n_rows'] += len(df)
+                self._reply(identity, msg, result=_to_columns(df), n_rows=len(df))
+        else:
+            self._reply(identity, msg, error="unknown method {}".format(method))
+
+    def _send_due(self):
+        """Send scheduled messages that are due, return seconds until the next one."""
+        now = time.time()
+        while self._scheduled and self._scheduled[0][0] <= now:
+            _, _, identity, msg = heapq.heappop(self._scheduled)
+            self._sock.send_multipart([identity, jrpc_py._pack_msgpack_snappy(msg)])
+        if self._scheduled:
+            return self._scheduled[0][0] - now
+        return None
+
+    def run(self):
+        """Serve until close is called."""
+        while not self._should_close:
+            wait = self._send_due()
+            timeout = 100 if wait is None else min(100, max(int(wait * 1000), 0))
+            if not self._sock.poll(timeout):
+                continue
+            identity, data = self._sock.recv_multipart()
+            msg = jrpc_py._unpack_msgpack_snappy(data)
+            if msg:
+                self._handle(identity, msg)
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._should_close = True
+        if self._thread is not None:
+            self._thread.join()
+        self._sock.close()
+        self._ctx.term()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in of the remote data server.")
+    parser.add_argument('--data-dir', required=True, help="directory of table files")
+    parser.add_argument('--port', type=int, default=8910)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every reply")
+    parser.add_argument('--rows-per-sec', type=float, default=None, help="max rows replied per second")
+    parser.add_argument('--quotes-per-sec', type=float, default=None, help="max quotes pushed per second")
+    args = parser.parse_args()
+
+    server = LocalDataServer(data_dir=args.data_dir, addr='tcp://*:{:d}'.format(args.port),
+                             latency=args.latency, rows_per_sec=args.rows_per_sec,
+                             quotes_per_sec=args.quotes_per_sec)
+    print("Serving {} on {}".format(os.path.abspath(args.data_dir), server.addr))
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
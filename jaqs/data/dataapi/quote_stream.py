@@ -0,0 +1,308 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+import time
+
+import numpy as np
+
+from . import utils
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+def _to_float_array(values, positions):
+    """values at positions as float64, long_nan and non-numeric values become NaN."""
+    try:
+        arr = np.asarray(values, dtype=object)[positions].astype(np.float64)
+    except (TypeError, ValueError):
+        arr = np.empty(len(positions))
+        for i, pos in enumerate(positions):
+            try:
+                arr[i] = float(values[pos])
+            except (TypeError, ValueError):
+                arr[i] = np.nan
+    arr[arr == utils.long_nan] = np.nan
+    return arr
+
+
+class QuoteBuffer(object):
+    """
+    Bounded buffer of subscribed quotes, delivered to the consumer in batches of arrays.
+
+    Quotes are decoded with the subscription schema into a preallocated ring of rows
+    as soon as they arrive. A delivering thread hands all pending rows to func every
+    batch_interval milliseconds, or earlier once batch_size quotes are pending.
+    When the consumer falls behind (more than conflate_after quotes pending),
+    a new quote of a symbol replaces its pending quote instead of taking a new row.
+    When the ring is full, the oldest pending quotes are dropped.
+
+    Parameters
+    ----------
+    func : callable
+        func(batch), batch is a dict {field name: np.ndarray}, one element per quote.
+        Numeric fields are float64 with NaN for missing values, 'symbol' and string fields are object.
+    capacity : int
+        Max number of pending quotes.
+    batch_size : int
+        Deliver as soon as this many quotes are pending.
+    batch_interval : int
+        Max milliseconds a quote waits before being delivered.
+    conflate : bool
+        Whether to conflate quotes of the same symbol when the consumer falls behind.
+    conflate_after : int, optional
+        Number of pending quotes above which quotes are conflated, batch_size by default.
+    start : bool
+        Whether to start the delivering thread. If False, call flush to deliver.
+
+    Attributes
+    ----------
+    stats : dict
+        Counters: n_received, n_delivered, n_conflated, n_dropped, n_batches, pending,
+        last_lag and max_lag (seconds from arrival of the oldest quote of a batch to its delivery).
+
+    """
+    SYMBOL_FIELD = 'symbol'
+
+    def __init__(self, func, capacity=100000, batch_size=1000, batch_interval=100,
+                 conflate=True, conflate_after=None, start=True):
+        self.func = func
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.conflate = conflate
+        self.conflate_after = batch_size if conflate_after is None else conflate_after
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        # one consumer call at a time, also when flush is called from another thread
+        self._deliver_lock = threading.RLock()
+
+        self._schema_id = None
+        self._fields = []
+        self._col_of_id = dict()
+        self._symbol_id = None
+        self._layouts = dict()
+        self._values = np.empty((capacity, 0))
+        self._str_values = dict()
+
+        self._symbols = []
+        self._symbol_index = dict()
+        self._row_symbol = np.zeros(capacity, dtype=np.int64)
+        self._row_time = np.zeros(capacity)
+        # sequence numbers, row of sequence number i is i % capacity
+        self._head = 0
+        self._tail = 0
+        # symbol index -> sequence number of its pending quote
+        self._pending_seq = dict()
+
+        self._n_received = 0
+        self._n_delivered = 0
+        self._n_conflated = 0
+        self._n_dropped = 0
+        self._n_batches = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+
+        self._should_close = False
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    @property
+    def pending(self):
+        return self._head - self._tail
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {'n_received': self._n_received,
+                    'n_delivered': self._n_delivered,
+                    'n_conflated': self._n_conflated,
+                    'n_dropped': self._n_dropped,
+                    'n_batches': self._n_batches,
+                    'pending': self.pending,
+                    'last_lag': self._last_lag,
+                    'max_lag': self._max_lag}
+
+    def set_schema(self, schema_id, schema):
+        """
+        Use schema of a (new) subscription. Quotes of the old schema are delivered first.
+
+        Parameters
+        ----------
+        schema_id : int
+        schema : list of dict
+            [{'id': field id, 'name': field name}, ...]
+
+        """
+        fields = [s['name'] for s in schema]
+        if schema_id == self._schema_id and fields == self._fields:
+            return
+        self.flush()
+        with self._lock:
+            self._schema_id = schema_id
+            self._fields = fields
+            self._col_of_id = {s['id']: i for i, s in enumerate(schema)}
+            self._symbol_id = None
+            for s in schema:
+                if s['name'] == self.SYMBOL_FIELD:
+                    self._symbol_id = s['id']
+            self._layouts = dict()
+            self._values = np.empty((self.capacity, len(self._fields)))
+            self._str_values = dict()
+
+    # -----------------------------------------------------------------------------------
+    # Producer
+    def _get_layout(self, indicators, values):
+        """
+        Positions of numeric and string values in quote_ind and their columns.
+        Cached by indicators, as most quotes of one subscription have the same indicators.
+
+        """
+        key = tuple(indicators)
+        layout = self._layouts.get(key)
+        if layout is None:
+            num_pos, num_cols, str_pos, str_cols = [], [], [], []
+            sym_pos = None
+            for pos, ind in enumerate(indicators):
+                col = self._col_of_id.get(ind)
+                if col is None:
+                    continue
+                if ind == self._symbol_id:
+                    sym_pos = pos
+                elif isinstance(values[pos], (basestring, bytes)):
+                    str_pos.append(pos)
+                    str_cols.append(col)
+                else:
+                    num_pos.append(pos)
+                    num_cols.append(col)
+            layout = (sym_pos, np.array(num_pos, dtype=np.int64), np.array(num_cols, dtype=np.int64),
+                      str_pos, str_cols)
+            self._layouts[key] = layout
+        return layout
+
+    def put(self, quote_ind):
+        """
+        Decode one quote_ind {'schema_id', 'indicators', 'values'} into the buffer.
+        Called in the receiving thread, so it never waits for the consumer.
+
+        Returns
+        -------
+        bool
+            False if the quote does not match the current schema.
+
+        """
+        if quote_ind['schema_id'] != self._schema_id:
+            return False
+        indicators = quote_ind['indicators']
+        values = quote_ind['values']
+
+        with self._lock:
+            sym_pos, num_pos, num_cols, str_pos, str_cols = self._get_layout(indicators, values)
+            if sym_pos is None:
+                return False
+            symbol = values[sym_pos]
+            sym = self._symbol_index.get(symbol)
+            if sym is None:
+                sym = len(self._symbols)
+                self._symbol_index[symbol] = sym
+                self._symbols.append(symbol)
+
+            self._n_received += 1
+            seq = self._pending_seq.get(sym)
+            if self.conflate and seq is not None and self.pending > self.conflate_after:
+                # update the pending quote of the symbol in place
+                self._n_conflated += 1
+                row = seq % self.capacity
+            else:
+                if self.pending >= self.capacity:
+                    self._drop_oldest()
+                seq = self._head
+                row = seq % self.capacity
+                self._values[row] = np.nan
+                for col in self._str_values:
+                    self._str_values[col][row] = None
+                self._row_symbol[row] = sym
+                self._row_time[row] = time.time()
+                self._pending_seq[sym] = seq
+                self._head += 1
+
+            if len(num_pos):
+                arr = _to_float_array(values, num_pos)
+                self._values[row, num_cols] = arr
+            for pos, col in zip(str_pos, str_cols):
+                if col not in self._str_values:
+                    self._str_values[col] = np.empty(self.capacity, dtype=object)
+                self._str_values[col][row] = values[pos]
+
+            if self.pending >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def _drop_oldest(self):
+        row = self._tail % self.capacity
+        sym = self._row_symbol[row]
+        if self._pending_seq.get(sym) == self._tail:
+            del self._pending_seq[sym]
+        self._tail += 1
+        self._n_dropped += 1
+
+    # -----------------------------------------------------------------------------------
+    # Consumer
+    def _take(self):
+        """Copy all pending quotes out of the ring. Must be called with lock held."""
+        if self.pending == 0:
+            return None
+        rows = np.arange(self._tail, self._head) % self.capacity
+        batch = dict()
+        for col, name in enumerate(self._fields):
+            if col in self._str_values:
+                batch[name] = self._str_values[col][rows]
+            elif name != self.SYMBOL_FIELD:
+                batch[name] = self._values[rows, col]
+        symbols = np.empty(len(self._symbols), dtype=object)
+        symbols[:] = self._symbols
+        batch[self.SYMBOL_FIELD] = symbols[self._row_symbol[rows]]
+
+        lag = time.time() - self._row_time[rows].min()
+        self._last_lag = lag
+        self._max_lag = max(self._max_lag, lag)
+        self._n_delivered += len(rows)
+        self._n_batches += 1
+        self._tail = self._head
+        self._pending_seq.clear()
+        return batch
+
+    def flush(self):
+        """Deliver all pending quotes in the calling thread."""
+        with self._deliver_lock:
+            with self._lock:
+                batch = self._take()
+            if batch is not None:
+                self.func(batch)
+
+    def _run(self):
+        while not self._should_close:
+            with self._lock:
+                if self.pending < self.batch_size:
+                    self._cond.wait(self.batch_interval / 1000.0)
+            try:
+                self.flush()
+            except Exception as e:
+                print("QuoteBuffer callback", type(e), e)
+
+    def close(self):
+        """Stop the delivering thread."""
+        self._should_close = True
+        with self._lock:
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
@@ -40,20 +40,63 @@ def _to_datetime(row):
                        hour=time // 10000, minute=time // 100 % 100, second=time % 100)
 
 
+def _to_array(values):
+    """
+    Convert one column of result to array without per element Python calls.
+    Integer columns containing long_nan become float with NaN.
+
+    """
+    if isinstance(values, np.ndarray):
+        arr = values
+    elif len(values) and isinstance(values[0], basestring):
+        arr = np.empty(len(values), dtype=object)
+        arr[:] = values
+    else:
+        arr = np.asarray(values)
+        if arr.dtype.kind not in 'biuf':
+            # mixed types or missing values: infer as pandas does
+            arr = pd.Series(list(values)).values
+    
+    if arr.dtype == np.int64:
+        mask = arr == long_nan
+        if mask.any():
+            arr = arr.astype(np.float64)
+            arr[mask] = np.nan
+    return arr
+
+
 def _to_dataframe(cloumset, index_func=None, index_column=None):
-    df = pd.DataFrame(cloumset)
-    for col in df.columns:
-        if df.dtypes.loc[col] == np.int64:
-            df.loc[:, col] = df.loc[:, col].apply(to_nan)
+    if isinstance(cloumset, dict) and all(isinstance(v, (list, tuple, np.ndarray)) for v in cloumset.values()):
+        # column-oriented result: build DataFrame from one array per column
+        columns = list(cloumset.keys())
+        df = pd.DataFrame({col: _to_array(cloumset[col]) for col in columns}, columns=columns)
+    else:
+        df = pd.DataFrame(cloumset)
+        for col in df.columns:
+            if df.dtypes.loc[col] == np.int64:
+                df[col] = _to_array(df[col].values)
     if index_func:
         df.index = df.apply(index_func, axis=1)
     elif index_column:
         df.index = df[index_column]
-        del df.index.name
+        df.index.name = None
     
     return df
 
 
+def _to_namedtuples(class_name, rows):
+    """Convert list of dict to list of namedtuple, one class for each set of keys."""
+    classes = dict()
+    result = []
+    for d in rows:
+        keys = tuple(d.keys())
+        cls = classes.get(keys)
+        if cls is None:
+            cls = classes[keys] = namedtuple(class_name, keys)
+        result.append(cls(*d.values()))
+    return result
+
+
 def _error_to_str(error):
     if error:
         if 'message' in error:
@@ -67,10 +110,7 @@ def _error_to_str(error):
 def to_obj(class_name, data):
     try:
         if isinstance(data, (list, tuple)):
-            result = []
-            for d in data:
-                result.append(namedtuple(class_name, list(d.keys()))(*list(d.values())))
-            return result
+            return _to_namedtuples(class_name, data)
         
         elif type(data) == dict:
             result = namedtuple(class_name, list(data.keys()))(*list(data.values()))
@@ -134,9 +174,7 @@ def extract_result(cr, data_format="", index_column=None, class_name=""):
         elif data_format == "obj" and cr['result'] and class_name:
             r = cr['result']
             if isinstance(r, (list, tuple)):
-                result = []
-                for d in r:
-                    result.append(namedtuple(class_name, list(d.keys()))(*list(d.values())))
+                result = _to_namedtuples(class_name, r)
             elif isinstance(r, dict):
                 result = namedtuple(class_name, list(r.keys()))(*list(r.values()))
             else:
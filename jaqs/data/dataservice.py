@@ -12,6 +12,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from builtins import str
 from abc import abstractmethod
+from collections import OrderedDict
 from six import with_metaclass
 try:
     basestring
@@ -24,6 +25,8 @@ import pandas as pd
 from jaqs.trade.event import EVENT_TYPE, Event
 from jaqs.data import DataApi
 from jaqs.data import align
+from jaqs.data.cache import QueryCache
+from jaqs.data.trade_calendar import TradingCalendar
 import jaqs.util as jutil
 
 
@@ -250,6 +253,9 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
     It wraps DataApi and simplify usage.
 
     """
+    # number of results of query_index_member_daily and query_industry_daily kept in memory
+    MEMO_SIZE = 32
+
     def __init__(self):
         # print("Init RemoteDataService DEBUG")
         super(RemoteDataService, self).__init__()
@@ -260,6 +266,14 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
         self._username = ""
         self._password = ""
         self._timeout = 60
+        self._n_sessions = 1
+        
+        self.cache = None
+        self._calendar = None
+        # recently used results of query_index_member_daily and query_industry_daily, least recent first
+        self._memo = OrderedDict()
+        # (data_api, cache) that calendar and memo are loaded from
+        self._data_source = (None, None)
         
         self._REPORT_DATE_FIELD_NAME = 'report_date'
         
@@ -280,7 +294,11 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
         -------
         {"remote.data.address": "tcp://Address:Port",
         "remote.data.username": "your username",
-        "remote.data.password": "your password"}
+        "remote.data.password": "your password",
+        "remote.data.n_sessions": "number of connections used for queries (optional)",
+        "cache.path": "cache directory (optional)",
+        "cache.max_size": "max bytes of cache (optional)",
+        "cache.offline": "whether only use cached data without login (optional)"}
 
         """
         def get_from_list_of_dict(l, key, default=None):
@@ -300,6 +318,17 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
         username = get_from_list_of_dict(dic_list, "remote.data.username", "")
         password = get_from_list_of_dict(dic_list, "remote.data.password", "")
         time_out = get_from_list_of_dict(dic_list, "timeout", 60)
+        n_sessions = get_from_list_of_dict(dic_list, "remote.data.n_sessions", 1)
+        
+        cache_path = get_from_list_of_dict(dic_list, "cache.path", "")
+        if cache_path:
+            cache = QueryCache(cache_path,
+                               max_size=get_from_list_of_dict(dic_list, "cache.max_size", 1024 ** 3),
+                               offline=get_from_list_of_dict(dic_list, "cache.offline", False))
+            self.set_cache(cache)
+            if cache.offline:
+                print("\nDataApi offline mode: data are only read from cache {}".format(cache_path))
+                return '0,'
 
         print("\nBegin: DataApi login {}@{}".format(username, address))
         INDENT = ' ' * 4
@@ -308,7 +337,8 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
             if (address == "") or (username == "") or (password == ""):
                 raise InitializeError("no address, username or password available!")
             elif ((address == self._address) and (time_out == self._timeout)
-                and (username == self._username) and (password == self._password)):
+                and (username == self._username) and (password == self._password)
+                and (n_sessions == self._n_sessions)):
                 print(INDENT + "Already login as {:s}, skip init_from_config".format(username))
                 return '0,'  # do not login with the same props again
             else:
@@ -319,8 +349,9 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
         self._username = username
         self._password = password
         self._timeout = time_out
+        self._n_sessions = n_sessions
         
-        data_api = DataApi(self._address, use_jrpc=False)
+        data_api = DataApi(self._address, use_jrpc=False, n_sessions=self._n_sessions)
         data_api.set_timeout(timeout=self._timeout)
         r, err_msg = data_api.login(username=self._username, password=self._password)
         if not r:
@@ -345,6 +376,41 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
         if not (splited and (splited[0] == '0')):
             raise QueryDataError(err_msg)
     
+    def set_cache(self, cache):
+        """
+        Cache results of daily, bar and query (so all query_* helpers) on local disk.
+        
+        Parameters
+        ----------
+        cache : QueryCache or None
+            None to disable cache.
+
+        """
+        self.cache = cache
+    
+    def _query_with_cache(self, method, func, **kwargs):
+        """
+        Call func(**kwargs), which queries data_api, or return cached result of the same query.
+        In offline mode, QueryDataError is raised if the result is not cached.
+
+        """
+        cache = self.cache
+        if cache is not None:
+            key = cache.make_key(method, **kwargs)
+            df = cache.get(key)
+            if df is not None:
+                return df, '0,'
+            if cache.offline:
+                raise QueryDataError("-1,offline mode: no cached data of {} {}".format(method, kwargs))
+        
+        self._raise_error_if_no_data_api()
+        df, err_msg = func(**kwargs)
+        self._raise_error_if_msg(err_msg)
+        
+        if cache is not None and isinstance(df, pd.DataFrame):
+            cache.put(key, df, cache.get_expire_time(method, kwargs))
+        return df, err_msg
+    
     # -----------------------------------------------------------------------------------
     # Basic APIs
     def daily(self, symbol, start_date, end_date,
@@ -383,12 +449,9 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
                             fields="open,high,low,last,volume", fq=None, skip_suspended=True)
 
         """
-        self._raise_error_if_no_data_api()
-        
-        df, err_msg = self.data_api.daily(symbol=symbol, start_date=start_date, end_date=end_date,
-                                          fields=fields, adjust_mode=adjust_mode, data_format="")
-
-        self._raise_error_if_msg(err_msg)
+        df, err_msg = self._query_with_cache('daily', self._daily,
+                                             symbol=symbol, start_date=start_date, end_date=end_date,
+                                             fields=fields, adjust_mode=adjust_mode)
         
         # TODO there will be duplicate entries when on stocks' IPO day
         df = df.drop_duplicates()
@@ -429,15 +492,21 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
                           trade_date="20170823", fields="open,high,low,last,volume", freq="5m")
 
         """
-        self._raise_error_if_no_data_api()
-        
-        df, err_msg = self.data_api.bar(symbol=symbol, fields=fields,
-                                        start_time=start_time, end_time=end_time, trade_date=trade_date,
-                                        freq=freq, data_format="")
-        
-        self._raise_error_if_msg(err_msg)
+        df, err_msg = self._query_with_cache('bar', self._bar,
+                                             symbol=symbol, fields=fields,
+                                             start_time=start_time, end_time=end_time, trade_date=trade_date,
+                                             freq=freq)
         return df, err_msg
     
+    def _daily(self, **kwargs):
+        return self.data_api.daily(data_format="", **kwargs)
+    
+    def _bar(self, **kwargs):
+        return self.data_api.bar(data_format="", **kwargs)
+    
+    def _query(self, **kwargs):
+        return self.data_api.query(**kwargs)
+    
     def quote(self, symbol, fields=""):
         """
         Query latest market data in DataFrame.
@@ -534,11 +603,7 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
             view does not change. fileds can be any field predefined in reference data api.
 
         """
-        self._raise_error_if_no_data_api()
-        
-        df, err_msg = self.data_api.query(view, fields=fields, filter=filter, **kwargs)
-        
-        self._raise_error_if_msg(err_msg)
+        df, err_msg = self._query_with_cache('query', self._query, view=view, fields=fields, filter=filter, **kwargs)
         return df, err_msg
 
     # -----------------------------------------------------------------------------------
@@ -810,36 +875,45 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
             values are 0 (not in) or 1 (in)
 
         """
+        key = ('index_member', index, start_date, end_date)
+        res = self._memo_get(key)
+        if res is not None:
+            return res
+        
         df_io, err_msg = self._get_index_comp(index, start_date, end_date)
         if err_msg != '0,':
             print(err_msg)
         
-        def str2int(s):
-            if isinstance(s, basestring):
-                return int(s) if s else 99999999
-            elif isinstance(s, (int, np.integer, float, np.float)):
-                return s
-            else:
-                raise NotImplementedError("type s = {}".format(type(s)))
-        df_io.loc[:, 'in_date'] = df_io.loc[:, 'in_date'].apply(str2int)
-        df_io.loc[:, 'out_date'] = df_io.loc[:, 'out_date'].apply(str2int)
+        def to_int_date(ser):
+            # empty string means not yet out of index
+            if ser.dtype == object:
+                ser = ser.replace('', 99999999)
+            return pd.to_numeric(ser).values.astype(float)
+        in_date = to_int_date(df_io['in_date'])
+        out_date = to_int_date(df_io['out_date'])
         
-        # df_io.set_index('symbol', inplace=True)
         dates = self.query_trade_dates(start_date=start_date, end_date=end_date)
-
-        dic = dict()
-        gp = df_io.groupby(by='symbol')
-        for sec, df in gp:
-            mask = np.zeros_like(dates, dtype=np.integer)
-            for idx, row in df.iterrows():
-                bool_index = np.logical_and(dates > row['in_date'], dates < row['out_date'])
-                mask[bool_index] = 1
-            dic[sec] = mask
-            
-        res = pd.DataFrame(index=dates, data=dic)
+        symbols, col = np.unique(df_io['symbol'].values, return_inverse=True)
+        
+        # a security is in index on dates in_date < date < out_date, i.e. rows [row_in, row_out) of dates
+        valid = ~(np.isnan(in_date) | np.isnan(out_date))
+        row_in = np.searchsorted(dates, in_date[valid], side='right')
+        row_out = np.searchsorted(dates, out_date[valid], side='left')
+        col = col[valid]
+        non_empty = row_in < row_out
+        row_in, row_out, col = row_in[non_empty], row_out[non_empty], col[non_empty]
+        
+        events = np.zeros((len(dates) + 1, len(symbols)), dtype=np.int64)
+        np.add.at(events, (row_in, col), 1)
+        np.add.at(events, (row_out, col), -1)
+        # intervals of one security may overlap
+        mask = (np.cumsum(events[:-1], axis=0) > 0).astype(np.int64)
+        
+        res = pd.DataFrame(index=dates, columns=symbols, data=mask)
         res.index.name = 'trade_date'
         
-        return res
+        self._memo_put(key, res)
+        return res.copy()
 
     def query_industry_daily(self, symbol, start_date, end_date, type_='SW', level=1):
         """
@@ -860,32 +934,45 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
             values are industry code
 
         """
+        key = ('industry', symbol, start_date, end_date, type_, level)
+        res = self._memo_get(key)
+        if res is not None:
+            return res
+        
         df_raw = self.query_industry_raw(symbol, type_=type_, level=level)
+        symbol_arr = np.sort(symbol.split(','))
         
-        dic_sec = jutil.group_df_to_dict(df_raw, by='symbol')
-        dic_sec = {sec: df.sort_values(by='in_date', axis=0).reset_index()
-                   for sec, df in dic_sec.items()}
-
-        df_ann_tmp = pd.concat({sec: df.loc[:, 'in_date'] for sec, df in dic_sec.items()}, axis=1)
-        df_value_tmp = pd.concat({sec: df.loc[:, 'industry{:d}_code'.format(level)]
-                                  for sec, df in dic_sec.items()},
-                                 axis=1)
+        # records of each security sorted by in_date
+        df_raw = df_raw.loc[df_raw['symbol'].isin(symbol_arr)]
+        col = np.searchsorted(symbol_arr, df_raw['symbol'].values)
+        in_date = df_raw['in_date'].values.astype(np.int64)
+        order = np.lexsort((in_date, col))
+        col, in_date = col[order], in_date[order]
+        value = df_raw['industry{:d}_code'.format(level)].values[order]
         
-        idx = np.unique(np.concatenate([df.index.values for df in dic_sec.values()]))
-        symbol_arr = np.sort(symbol.split(','))
-        df_ann = pd.DataFrame(index=idx, columns=symbol_arr, data=np.nan)
-        df_ann.loc[df_ann_tmp.index, df_ann_tmp.columns] = df_ann_tmp
-        df_value = pd.DataFrame(index=idx, columns=symbol_arr, data=np.nan)
-        df_value.loc[df_value_tmp.index, df_value_tmp.columns] = df_value_tmp
-
         dates_arr = self.query_trade_dates(start_date, end_date)
-        df_industry = align.align(df_value, df_ann, dates_arr)
+        n_symbols = len(symbol_arr)
         
+        # industry on each date is the last record with in_date <= date, searched for all securities at once
+        offset = np.arange(n_symbols, dtype=np.int64) * align._DATE_UPPER_BOUND
+        flat = col * align._DATE_UPPER_BOUND + in_date
+        query = dates_arr.astype(np.int64).reshape(-1, 1) + offset
+        pos = np.searchsorted(flat, query.ravel(), side='right').reshape(len(dates_arr), n_symbols) - 1
         # TODO before industry classification is available, we assume they belong to their first group.
-        df_industry = df_industry.fillna(method='bfill')
+        first = np.searchsorted(col, np.arange(n_symbols), side='left')
+        n_records = np.bincount(col, minlength=n_symbols)
+        pos = np.maximum(pos, first)
+        
+        res = np.empty(pos.shape, dtype=object)
+        res[:] = np.nan
+        has_record = n_records > 0
+        res[:, has_record] = value[pos[:, has_record]]
+        
+        df_industry = pd.DataFrame(index=dates_arr.astype(int), columns=symbol_arr, data=res)
         df_industry = df_industry.astype(str)
         
-        return df_industry
+        self._memo_put(key, df_industry)
+        return df_industry.copy()
         
     def query_industry_raw(self, symbol, type_='ZZ', level=1):
         """
@@ -1081,6 +1168,70 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
     # ---------------------------------------------------------------------
     # Calendar
     
+    # first and last dates of the trade calendar loaded at once
+    CALENDAR_START_DATE = 19900101
+    CALENDAR_END_DATE = 20991231
+    
+    @property
+    def calendar(self):
+        """
+        TradingCalendar of all trade dates, queried once and reused by all calendar methods.
+        It is reloaded after data_api or cache changes. With a QueryCache it is also kept on disk
+        until next market close, so that dates published later are queried again.
+
+        """
+        self._check_data_source()
+        if self._calendar is None:
+            self._calendar = self._load_calendar()
+        return self._calendar
+    
+    def _check_data_source(self):
+        """Drop calendar and memorized results if data_api or cache has changed since they were loaded."""
+        source = (self.data_api, self.cache)
+        if self._data_source[0] is not source[0] or self._data_source[1] is not source[1]:
+            self._calendar = None
+            self._memo = OrderedDict()
+            self._data_source = source
+    
+    def _memo_get(self, key):
+        """Copy of a memorized result, None if not memorized. The result becomes the most recently used."""
+        self._check_data_source()
+        res = self._memo.pop(key, None)
+        if res is None:
+            return None
+        self._memo[key] = res
+        return res.copy()
+    
+    def _memo_put(self, key, res):
+        """Memorize a result, the least recently used ones are dropped beyond MEMO_SIZE."""
+        self._memo[key] = res
+        while len(self._memo) > self.MEMO_SIZE:
+            self._memo.popitem(last=False)
+    
+    def set_calendar(self, calendar):
+        """
+        Use given calendar instead of querying it, e.g. one loaded by TradingCalendar.load.
+        
+        Parameters
+        ----------
+        calendar : TradingCalendar or None
+            None to query calendar again on next use.
+
+        """
+        self._check_data_source()
+        self._calendar = calendar
+    
+    def _load_calendar(self):
+        filter_argument = self._dic2url({'start_date': self.CALENDAR_START_DATE,
+                                         'end_date': self.CALENDAR_END_DATE})
+        df_raw, err_msg = self.query("jz.secTradeCal", fields="trade_date",
+                                     filter=filter_argument, orderby="")
+        self._raise_error_if_msg(err_msg)
+        
+        if df_raw.empty:
+            return TradingCalendar([])
+        return TradingCalendar(df_raw['trade_date'].values)
+    
     def query_trade_dates(self, start_date, end_date):
         """
         Get array of trade dates within given range.
@@ -1098,18 +1249,7 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
             dtype = int
 
         """
-        filter_argument = self._dic2url({'start_date': start_date,
-                                         'end_date': end_date})
-    
-        df_raw, err_msg = self.query("jz.secTradeCal", fields="trade_date",
-                                     filter=filter_argument, orderby="")
-        self._raise_error_if_msg(err_msg)
-        
-        if df_raw.empty:
-            return np.array([], dtype=int)
-    
-        trade_dates_arr = df_raw['trade_date'].values.astype(np.integer)
-        return trade_dates_arr
+        return self.calendar.get_trade_dates(int(start_date), int(end_date))
 
     def query_last_trade_date(self, date):
         """
@@ -1123,16 +1263,7 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
         res : int
 
         """
-        dt = jutil.convert_int_to_datetime(date)
-        delta = pd.Timedelta(weeks=2)
-        dt_old = dt - delta
-        date_old = jutil.convert_datetime_to_int(dt_old)
-    
-        dates = self.query_trade_dates(date_old, date)
-        mask = dates < date
-        res = dates[mask][-1]
-    
-        return int(res)
+        return self.calendar.get_last_trade_date(int(date))
 
     def is_trade_date(self, date):
         """
@@ -1147,8 +1278,7 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
         bool
 
         """
-        dates = self.query_trade_dates(date, date)
-        return len(dates) > 0
+        return self.calendar.is_trade_date(int(date))
 
     def query_next_trade_date(self, date, n=1):
         """
@@ -1164,13 +1294,4 @@ class RemoteDataService(with_metaclass(Singleton, DataService)):
         res : int
 
         """
-        dt = jutil.convert_int_to_datetime(date)
-        delta = pd.Timedelta(weeks=(n // 7 + 2))
-        dt_new = dt + delta
-        date_new = jutil.convert_datetime_to_int(dt_new)
-    
-        dates = self.query_trade_dates(date, date_new)
-        mask = dates > date
-        res = dates[mask][n-1]
-    
-        return int(res)
+        return self.calendar.get_next_trade_date(int(date), n)
@@ -4,7 +4,11 @@
 
 """
 from __future__ import print_function
+import copy
 import os
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
 
 try:
     basestring
@@ -15,9 +19,14 @@ import numpy as np
 import pandas as pd
 
 import jaqs.util as jutil
-from jaqs.data.align import align
+from jaqs.data.align import align, get_align_positions, align_by_positions, AnnouncementIndex
+from jaqs.data.dataservice import QueryDataError
+from jaqs.data.fieldstore import FieldStore
 from jaqs.data.py_expression_eval import Parser
 
+# functions of formulas whose value on a date depends on all history before it, not on a fixed window
+PATH_DEPENDENT_FUNCTIONS = {'ewma', 'sma', 'step'}
+
 
 class FactorDef:
     def __init__(self, name, args, body, is_quarterly=False):
@@ -55,11 +64,20 @@ class FactorFunc:
         # TODO: send ann_date into expr.evaluate. We assume that ann_date of all fields of a symbol is the same
         df_ann = self._dv._get_ann_df()
 
-        df_eval = parser.evaluate(var_df_dic, ann_dts=df_ann, trade_dts=self._dv.dates)
+        df_eval = parser.evaluate(var_df_dic, ann_dts=df_ann, trade_dts=self._dv.dates,
+                                  ann_index=self._dv._get_ann_index())
 
         return df_eval
 
 
+def _evaluate_formulas_worker(args):
+    """Evaluate a group of formulas in a worker process of DataView.add_formulas."""
+    formulas, func_name_style, values, context = args
+    parser = Parser()
+    parser.set_capital(func_name_style)
+    return parser.compile(formulas).evaluate(values, **context)
+
+
 class LabelDef(FactorDef):
     pass
 
@@ -83,12 +101,18 @@ class DataView(object):
     freq : int
     market_daily_fields, reference_daily_fields : list
     data_d : pd.DataFrame
-        All daily frequency data will be merged and stored here.
+        All daily frequency data, materialized from the underlying field store on access.
         index is date, columns is symbol-field MultiIndex
     data_q : pd.DataFrame
-        All quarterly frequency data will be merged and stored here.
+        All quarterly frequency data, materialized from the underlying field store on access.
         index is date, columns is symbol-field MultiIndex
 
+    Notes
+    -----
+    Data are stored field by field in FieldStore (see jaqs.data.fieldstore), so adding or removing
+    a field only costs memory and time of that field. data_d and data_q are built for compatibility,
+    modifying them in place will NOT change data stored in DataView.
+
     """
 
     def __init__(self):
@@ -105,24 +129,38 @@ class DataView(object):
         self.fields = []
         self.freq = 1
         self.all_price = True
+        # max number of queries sent to data_api at the same time
+        self.query_concurrency = 4
+        # number of retries of a query that timed out
+        self.query_retries = 2
         self._snapshot = None
         self.factors = []
         self.load_factors = []
         self.labels = []
         self.load_labels = []
+        # formulas added by add_formula, in order: [field_name, formula, is_quarterly, func_name_style, within_index]
+        self.formulas = []
+        # formula DAG: field_name -> set of variables used in its formula
+        self._formula_deps = dict()
+        # formulas registered but not evaluated yet, or whose upstream fields have changed
+        self._pending_formulas = set()
 
         self.meta_data_list = ['start_date', 'end_date',
                                'extended_start_date_d', 'extended_start_date_q',
                                'freq', 'fields', 'symbol', 'universe', 'benchmark',
                                'custom_daily_fields', 'custom_quarterly_fields',
                                'factors', 'load_factors',
-                               'labels', 'load_labels'
+                               'labels', 'load_labels', 'formulas'
                                ]
 
         self.adjust_mode = 'post'
 
-        self.data_d = None
-        self.data_q = None
+        self._store_d = None
+        self._store_q = None
+        self._data_d_cache = None
+        self._data_q_cache = None
+        # announcement index of quarterly data on self.dates, shared by all quarterly expansions
+        self._ann_index = None
         self._data_benchmark = None
         self._data_inst = None
         # self._data_group = None
@@ -335,11 +373,18 @@ class DataView(object):
 
         self.lgt_data = {"lgt_holding", "lgt_holding_ratio"}
 
+        # boolean (dates x symbols) matrices of trading status, see _prepare_status
+        self.status_fields = OrderedDict([('suspended', '_suspended'),
+                                          ('limit_reached', '_limit_reached'),
+                                          ('listed', '_listed'),
+                                          ('index_member', '_index_member'),
+                                          ('tradable', '_tradable')])
+
         self.default_fields = { \
                           '_daily_adjust_factor', '_limit', 'adjust_factor', 'close',
                           'close_adj', 'high', 'high_adj', 'index_member', 'index_weight',
                           'low', 'low_adj', 'open', 'open_adj', 'trade_status', 'vwap',
-                          'vwap_adj'}
+                          'vwap_adj'} | set(self.status_fields.values())
 
         self.custom_daily_fields = []
         self.custom_quarterly_fields = []
@@ -369,10 +414,41 @@ class DataView(object):
 
     @data_benchmark.setter
     def data_benchmark(self, df_new):
-        if self.data_d is not None and df_new.shape[0] != self.data_d.shape[0]:
+        if self._store_d is not None and df_new.shape[0] != len(self._store_d.index):
             raise ValueError("You must provide a DataFrame with the same shape of data_benchmark.")
         self._data_benchmark = df_new
 
+    @property
+    def data_d(self):
+        self._evaluate_pending()
+        if self._data_d_cache is None and self._store_d is not None:
+            self._data_d_cache = self._store_d.to_frame()
+        return self._data_d_cache
+
+    @data_d.setter
+    def data_d(self, df_new):
+        self._store_d = None if df_new is None else FieldStore.from_frame(df_new)
+        self._data_d_cache = None
+
+    @property
+    def data_q(self):
+        self._evaluate_pending()
+        if self._data_q_cache is None and self._store_q is not None:
+            self._data_q_cache = self._store_q.to_frame()
+        return self._data_q_cache
+
+    @data_q.setter
+    def data_q(self, df_new):
+        self._store_q = None if df_new is None else FieldStore.from_frame(df_new)
+        self._data_q_cache = None
+        self._ann_index = None
+
+    def _invalidate_cache(self):
+        """Drop materialized data_d / data_q after the field stores are modified."""
+        self._data_d_cache = None
+        self._data_q_cache = None
+        self._snapshot = None
+
     @property
     def dates(self):
         """
@@ -384,8 +460,8 @@ class DataView(object):
             dtype: int
 
         """
-        if self.data_d is not None:
-            res = self.data_d.index.values
+        if self._store_d is not None:
+            res = self._store_d.index
         elif self.data_api is not None:
             res = self.data_api.query_trade_dates(self.extended_start_date_d, self.end_date)
         else:
@@ -548,6 +624,8 @@ class DataView(object):
         self.end_date = props['end_date']
         self.all_price = props.get('all_price', True)
         self.freq = props.get('freq', 1)
+        self.query_concurrency = props.get('query_concurrency', self.query_concurrency)
+        self.query_retries = props.get('query_retries', self.query_retries)
 
         # get and filter fields
         fields = props.get('fields', [])
@@ -658,43 +736,121 @@ class DataView(object):
                 self.fields.append(dep)
 
     def distributed_query(self, query_func_name, symbol, start_date, end_date, limit=100000, **kwargs):
-        n_symbols = len(symbol.split(','))
+        """
+        Query data of many symbols and dates by splitting it into chunks of at most limit rows,
+        chunks are queried concurrently (see query_concurrency) and results are concatenated in order.
+
+        Parameters
+        ----------
+        query_func_name : str
+            Name of method of data_api, it must accept symbol, start_date and end_date.
+        symbol : str
+            Separated by ','.
+        start_date : int
+        end_date : int
+        limit : int
+            Max number of rows (symbols x trade days) of one query.
+        kwargs
+            Other arguments passed to the query method.
+
+        Returns
+        -------
+        df : pd.DataFrame
+        msg : str
+
+        """
+        tasks = self._split_query(query_func_name, symbol, start_date, end_date, limit=limit, **kwargs)
+        return self._concat_results(self._run_queries(tasks))
+
+    def _split_query(self, query_func_name, symbol, start_date, end_date, limit=100000, **kwargs):
+        """
+        Split a query into tasks [(query_func_name, args, kwargs)] of at most limit rows each,
+        by chunks of symbols and, if one chunk of all symbols is still too large, chunks of trade days.
+
+        """
+        symbols = symbol.split(',')
+        n_symbols = len(symbols)
         dates = self.data_api.query_trade_dates(start_date, end_date)
         n_days = len(dates)
 
-        if n_symbols * n_days > limit:
-            n = limit // n_symbols
+        if n_symbols * n_days <= limit:
+            kwargs.update(symbol=symbol, start_date=start_date, end_date=end_date)
+            return [(query_func_name, (), kwargs)]
+
+        n_symbols_chunk = min(n_symbols, limit)
+        n_days_chunk = max(limit // n_symbols_chunk, 1)
+        tasks = []
+        for i in range(0, n_symbols, n_symbols_chunk):
+            symbol_chunk = ','.join(symbols[i: i + n_symbols_chunk])
+            for j in range(0, n_days, n_days_chunk):
+                dates_chunk = dates[j: j + n_days_chunk]
+                kwargs_chunk = dict(kwargs)
+                kwargs_chunk.update(symbol=symbol_chunk,
+                                    start_date=int(dates_chunk[0]), end_date=int(dates_chunk[-1]))
+                tasks.append((query_func_name, (), kwargs_chunk))
+        return tasks
 
-            df_list = []
-            i = 0
-            pos1, pos2 = n * i, n * (i + 1) - 1
-            while pos2 < n_days:
-                print(pos2)
-                df, msg = getattr(self.data_api, query_func_name)(symbol=symbol,
-                                                                  start_date=dates[pos1], end_date=dates[pos2],
-                                                                  **kwargs)
-                df_list.append(df)
-                i += 1
-                pos1, pos2 = n * i, n * (i + 1) - 1
-            if pos1 < n_days:
-                df, msg = getattr(self.data_api, query_func_name)(symbol=symbol,
-                                                                  start_date=dates[pos1], end_date=dates[-1],
-                                                                  **kwargs)
-                df_list.append(df)
-            df = pd.concat(df_list, axis=0)
-        else:
-            df, msg = getattr(self.data_api, query_func_name)(symbol,
-                                                              start_date=start_date, end_date=end_date,
-                                                              **kwargs)
+    @staticmethod
+    def _concat_results(results):
+        """Concatenate [(df, msg)] of chunks of one query, msg of the first failed chunk is returned if any."""
+        if len(results) == 1:
+            return results[0]
+        df = pd.concat([df for df, _ in results], axis=0)
+        msg_list = [msg for _, msg in results if not msg.startswith('0,')]
+        msg = msg_list[0] if msg_list else results[-1][1]
         return df, msg
 
+    def _call_data_api(self, func_name, *args, **kwargs):
+        """Call method func_name of data_api, retry at most self.query_retries times if the query times out."""
+        n_retries = 0
+        while True:
+            try:
+                res = getattr(self.data_api, func_name)(*args, **kwargs)
+            except QueryDataError as e:
+                err_msg = str(e)
+                if n_retries >= self.query_retries or 'timeout' not in err_msg:
+                    raise
+            else:
+                # RemoteDataService raises QueryDataError, while DataApi returns the error message
+                is_result = isinstance(res, tuple) and len(res) == 2 and isinstance(res[1], basestring)
+                err_msg = res[1] if is_result else ''
+                if n_retries >= self.query_retries or 'timeout' not in err_msg:
+                    return res
+
+            n_retries += 1
+            print("Query [{:s}] timed out ({:s}), retry {:d}/{:d}".format(func_name, err_msg,
+                                                                        n_retries, self.query_retries))
+
+    def _run_queries(self, tasks):
+        """
+        Run tasks [(func_name, args, kwargs)] on a pool of at most self.query_concurrency threads.
+        Results are returned in the order of tasks.
+
+        """
+        def run(task):
+            func_name, args, kwargs = task
+            return self._call_data_api(func_name, *args, **kwargs)
+
+        n_workers = min(self.query_concurrency, len(tasks))
+        if n_workers <= 1:
+            return [run(task) for task in tasks]
+
+        pool = ThreadPool(n_workers)
+        try:
+            return pool.map(run, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
     def prepare_data(self):
         """Prepare data for the FIRST time."""
         # prepare benchmark and group
         print("Query data...")
-        data_d, data_q = self._prepare_daily_quarterly(self.fields)
-        self.data_d, self.data_q = data_d, data_q
-        if self.data_q is not None:
+        store_d, store_q = self._prepare_daily_quarterly(self.fields)
+        self._store_d, self._store_q = store_d, store_q
+        self._ann_index = None
+        self._invalidate_cache()
+        if self._store_q is not None:
             self._prepare_report_date()
         self._align_and_merge_q_into_d()
 
@@ -720,6 +876,279 @@ class DataView(object):
 
         print("Data has been successfully prepared.")
 
+    def update_to(self, end_date, folder_path=None, file_format='hd5'):
+        """
+        Extend data of a prepared (or loaded) DataView to end_date.
+        Only trade dates after current end_date are queried.
+
+        Parameters
+        ----------
+        end_date : int
+        folder_path : str or unicode, optional
+            If provided, save the updated DataView to this folder.
+        file_format : {'hd5', 'npy'}, optional
+            File format used when folder_path is provided.
+
+        Notes
+        -----
+        1. Prices must be post-adjusted, otherwise history changes every day.
+        2. Financial statements of the last year are queried again to catch newly announced reports,
+           only symbols with new announcements are re-aligned.
+        3. Fields added by add_formula are re-calculated on a tail window, which also covers old dates
+           of formulas looking forward; formulas using Ewma, Sma or Step are re-calculated on all dates.
+           Other fields added by append_df are filled with NaN on new dates.
+        4. For a view of universe, securities which become members after current end_date are added
+           with data of all dates, and formulas are re-calculated on all dates.
+        5. Only queries are incremental: the updated view is held in memory (fields memory-mapped from
+           'npy' files are read as a whole) and save_dataview writes all fields again.
+
+        """
+        if self.data_api is None:
+            raise ValueError("Update failed. No data_api available.")
+        if self._store_d is None:
+            raise ValueError("Please prepare or load data before update.")
+        if self.adjust_mode != 'post':
+            raise ValueError("Only DataView with adjust_mode = 'post' can be updated incrementally.")
+
+        end_date = int(end_date)
+        if end_date <= self.end_date:
+            print("DataView is already up to {}.".format(self.end_date))
+            return
+
+        last_date = self._store_d.index[-1]
+        new_dates = self.data_api.query_trade_dates(last_date, end_date)
+        new_dates = new_dates[new_dates > last_date]
+        if len(new_dates) == 0:
+            print("No new trade date until {}.".format(end_date))
+            self.end_date = end_date
+            return
+
+        print("Update data from {} to {}...".format(new_dates[0], end_date))
+        pending_orig = set(self._pending_formulas)
+        symbols_new = self._query_new_members(new_dates[0], end_date)
+        if symbols_new:
+            print("Add {} new members of universe...".format(len(symbols_new)))
+            self._add_symbols(symbols_new, last_date)
+        delta_d, delta_q, delta_benchmark = self._query_delta(new_dates[0], end_date)
+
+        store_d = self._store_d.append(delta_d)
+        self._ann_index = None
+        if self._store_q is not None and delta_q is not None:
+            df_ann_old = self._get_ann_df()
+            self._store_q = self._store_q.update(delta_q)
+            self._prepare_report_date()
+            df_ann_new = self._get_ann_df()
+            self._store_d = store_d
+            self._align_new_dates(df_ann_old, df_ann_new, new_dates)
+        else:
+            self._store_d = store_d
+
+        if delta_benchmark is not None and self._data_benchmark is not None:
+            delta_benchmark = delta_benchmark.loc[delta_benchmark.index > self._data_benchmark.index[-1]]
+            self._data_benchmark = pd.concat([self._data_benchmark, delta_benchmark], axis=0)
+        self.end_date = end_date
+        self._invalidate_cache()
+        # fields are extended instead of overwritten, formulas are updated below
+        self._pending_formulas = pending_orig
+
+        print("Update formulas...")
+        # new symbols have no formula values on existing dates
+        self._update_formulas(self.dates[0] if symbols_new else new_dates[0])
+
+        for field_name in ['_daily_adjust_factor', '_limit'] + list(self.status_fields.values()):
+            if field_name in self.fields:
+                self.remove_field(field_name)
+        self._process_data()
+
+        if folder_path is not None:
+            self.save_dataview(folder_path, file_format=file_format)
+
+        print("Data has been successfully updated.")
+
+    def _query_new_members(self, start_date, end_date):
+        """Members of universe between start_date and end_date which are not in self.symbol yet."""
+        if not self.universe:
+            return []
+        symbols = set()
+        for univ in self.universe:
+            symbols.update(self.data_api.query_index_member(univ, start_date, end_date))
+        return sorted(symbols - set(self.symbol))
+
+    def _add_symbols(self, symbols, end_date):
+        """Add symbols to the view, with their data of existing dates (up to end_date) queried."""
+        store_d, store_q, _ = self._query_delta(self.extended_start_date_d, end_date, symbols=symbols,
+                                                start_date_q=self.extended_start_date_q)
+        self.symbol = sorted(set(self.symbol) | set(symbols))
+        self._store_d = self._store_d.join(store_d)
+        if store_q is not None:
+            self._store_q = store_q if self._store_q is None else self._store_q.join(store_q)
+            self._ann_index = None
+            self._prepare_report_date()
+            self._align_and_merge_q_into_d()
+        self._prepare_inst_info()
+        self._invalidate_cache()
+
+    def _query_delta(self, start_date, end_date, symbols=None, start_date_q=None):
+        """
+        Query data between start_date and end_date, using the same procedures as prepare_data.
+
+        Parameters
+        ----------
+        start_date : int
+        end_date : int
+        symbols : list of str, optional
+            self.symbol by default.
+        start_date_q : int, optional
+            Start date of quarterly data. By default 52 weeks before start_date,
+            as reports of the last year may be announced after start_date.
+
+        Returns
+        -------
+        store_d : FieldStore
+        store_q : FieldStore or None
+        data_benchmark : pd.DataFrame or None
+
+        """
+        attr_names = ['_store_d', '_store_q', 'extended_start_date_d', 'extended_start_date_q', 'end_date',
+                      'symbol']
+        attr_orig = {name: getattr(self, name) for name in attr_names}
+
+        self._store_d, self._store_q = None, None
+        self.extended_start_date_d = start_date
+        if start_date_q is None:
+            start_date_q = jutil.shift(start_date, n_weeks=-52)
+        self.extended_start_date_q = start_date_q
+        self.end_date = end_date
+        if symbols is not None:
+            self.symbol = symbols
+        try:
+            fields = [field for field in self.fields if field not in ('index_member', 'index_weight')]
+            store_d, store_q = self._prepare_daily_quarterly(fields)
+            if store_d is None:
+                store_d = FieldStore(self.dates, self.symbol, index_name=self.TRADE_DATE_FIELD_NAME)
+            self._store_d = store_d
+
+            self._prepare_adj_factor()
+            if self.universe:
+                self._prepare_comp_info()
+            group_fields = self._get_fields('group', self.fields)
+            if group_fields:
+                self._prepare_group(group_fields)
+            data_benchmark = self._prepare_benchmark() if self.benchmark else None
+
+            store_d = self._store_d
+        finally:
+            for name, value in attr_orig.items():
+                setattr(self, name, value)
+            self._invalidate_cache()
+
+        return store_d, store_q, data_benchmark
+
+    def _align_new_dates(self, df_ann_old, df_ann_new, new_dates):
+        """
+        Expand quarterly fields to new dates. Only symbols with new announcements are re-aligned,
+        values of other symbols are the same as the last existing date.
+
+        """
+        df_ann_old = df_ann_old.reindex(index=df_ann_new.index)
+        mask_changed = (df_ann_old.fillna(0) != df_ann_new.fillna(0)).any(axis=0)
+        symbols_changed = list(df_ann_new.columns[mask_changed.values])
+
+        store_d, store_q = self._store_d, self._store_q
+        rows_new = store_d.row_slice(start_date=new_dates[0])
+        pos_last = rows_new.start - 1
+        cols_changed = store_d.col_indexer(symbols_changed)
+        pos_changed = get_align_positions(df_ann_new.loc[:, symbols_changed].values, new_dates)
+        n_new = len(new_dates)
+        for field_name in store_q.fields:
+            if field_name not in store_d:
+                continue
+            last = store_d.get_values(field_name, slice(pos_last, pos_last + 1)) if pos_last >= 0 else None
+            if last is None:
+                values = np.full((n_new, len(store_d.symbols)), np.nan)
+            else:
+                values = np.array(np.repeat(last, n_new, axis=0), dtype=object if last.dtype == object else float)
+            if symbols_changed:
+                df_value = store_q.get_frame(field_name, symbols=symbols_changed, copy=False)
+                df_expanded = align_by_positions(df_value, pos_changed, new_dates)
+                values[:, cols_changed] = df_expanded.values
+            store_d.set_values(field_name, values, rows=rows_new)
+
+    @staticmethod
+    def _get_formula_window(expr):
+        """Upper bound of look back window of a formula: sum of all integer constants."""
+        from jaqs.data.py_expression_eval import TNUMBER
+        window = 1
+        for token in expr.tokens:
+            if token.type_ == TNUMBER and isinstance(token.number_, (int, float)) and token.number_ > 0:
+                window += int(np.ceil(token.number_))
+        return window
+
+    @staticmethod
+    def _get_formula_forward_window(expr):
+        """
+        Upper bound of look forward window of a formula (e.g. Delay(close, -2)): sum of all negative
+        integer constants, whether written as a negative number or as a negated one.
+
+        """
+        from jaqs.data.py_expression_eval import TNUMBER, TOP1
+        window = 0
+        tokens = expr.tokens
+        for i, token in enumerate(tokens):
+            if not (token.type_ == TNUMBER and isinstance(token.number_, (int, float))):
+                continue
+            negated = i + 1 < len(tokens) and tokens[i + 1].type_ == TOP1 and tokens[i + 1].index_ == '-'
+            if token.number_ < 0 or (negated and token.number_ > 0):
+                window += int(np.ceil(abs(token.number_)))
+        return window
+
+    @staticmethod
+    def _is_path_dependent(parser, expr):
+        """Whether a formula uses functions which depend on all history, e.g. Ewma, rather than a fixed window."""
+        from jaqs.data.py_expression_eval import TVAR
+        for token in expr.tokens:
+            if (token.type_ == TVAR and token.index_ in parser.functions
+                    and token.index_.lower() in PATH_DEPENDENT_FUNCTIONS):
+                return True
+        return False
+
+    def _update_formulas(self, start_date):
+        """
+        Re-calculate registered formulas on dates from start_date, so that they are the same as calculated
+        on all dates.
+
+        A formula looking forward (e.g. Delay(x, -n)) is also re-calculated on the last n existing dates,
+        and so are formulas using it. A formula using functions depending on all history (e.g. Ewma)
+        is evaluated on all dates, other formulas only on a look back window.
+
+        """
+        dates = self.dates
+        pos_start = np.searchsorted(dates, start_date)
+        # first row which has changed, for each formula field
+        changed_pos = dict()
+        for field_name, formula, is_quarterly, func_name_style, within_index in self.formulas:
+            if field_name not in self.fields or field_name in self._pending_formulas:
+                # pending formulas will be evaluated on all dates when used
+                continue
+            if is_quarterly:
+                self._evaluate_formula_field(field_name)
+                changed_pos[field_name] = 0
+                continue
+
+            parser = self._create_parser(func_name_style)
+            expr = parser.parse(formula)
+            pos_input = min([changed_pos.get(var, pos_start) for var in expr.variables()] + [pos_start])
+            pos_update = max(0, pos_input - self._get_formula_forward_window(expr))
+            if self._is_path_dependent(parser, expr):
+                eval_start = 0
+            else:
+                eval_start = dates[max(0, pos_update - self._get_formula_window(expr))]
+            df_eval = self._evaluate_formula(parser, expr, is_quarterly, within_index, start_date=eval_start)
+            df_eval = df_eval.reindex(index=dates[pos_update:], columns=self._store_d.symbols)
+            self._store_d.set_values(field_name, df_eval.values, rows=slice(pos_update, None))
+            changed_pos[field_name] = pos_update
+        self._invalidate_cache()
+
     @staticmethod
     def _process_index_co(df, index_name):
         df = df.astype(dtype={index_name: int})
@@ -736,8 +1165,8 @@ class DataView(object):
 
         Returns
         -------
-        merge_d : pd.DataFrame or None
-        merge_q : pd.DataFrame or None
+        store_d : FieldStore or None
+        store_q : FieldStore or None
 
         """
         if not fields:
@@ -747,38 +1176,66 @@ class DataView(object):
         print("Query data - query...")
         daily_list, quarterly_list = self._query_data(self.symbol, fields)
 
-        def pivot_and_sort(df, index_name):
-            df = self._process_index_co(df, index_name)
-            df = df.pivot(index=index_name, columns='symbol')
-            df.columns = df.columns.swaplevel()
-            col_names = ['symbol', 'field']
-            df.columns.names = col_names
-            df = df.sort_index(axis=1, level=col_names)
-            df.index.name = index_name
-            return df
-
-        multi_daily = None
-        multi_quarterly = None
+        store_d = None
+        store_q = None
         if daily_list:
-            daily_list_pivot = [pivot_and_sort(df, self.TRADE_DATE_FIELD_NAME) for df in daily_list]
-            multi_daily = self._merge_data(daily_list_pivot, self.TRADE_DATE_FIELD_NAME)
             # use self.dates as index because original data have weekends
-            multi_daily = self._fill_missing_idx_col(multi_daily, index=self.dates, symbols=self.symbol)
+            store_d = self._create_store(daily_list, self.TRADE_DATE_FIELD_NAME, index=self.dates)
             print("Query data - daily fields prepared.")
         if quarterly_list:
-            quarterly_list_pivot = [pivot_and_sort(df, self.REPORT_DATE_FIELD_NAME) for df in quarterly_list]
-            multi_quarterly = self._merge_data(quarterly_list_pivot, self.REPORT_DATE_FIELD_NAME)
-            multi_quarterly = self._fill_missing_idx_col(multi_quarterly, index=None, symbols=self.symbol)
+            store_q = self._create_store(quarterly_list, self.REPORT_DATE_FIELD_NAME)
             print("Query data - quarterly fields prepared.")
 
         # FIXME: patch for lgt_data
         fields_lgt_ind = self._get_fields('lgt_data', fields, append=True)
         if fields_lgt_ind:
-            multi_daily = self.query_lgt_data(fields_lgt_ind, multi_daily)
+            if store_d is None:
+                store_d = FieldStore(self.dates, self.symbol, index_name=self.TRADE_DATE_FIELD_NAME)
+            store_d = self.query_lgt_data(fields_lgt_ind, store_d)
+
+        return store_d, store_q
+
+    def _create_store(self, df_list, index_name, index=None):
+        """
+        Pivot long DataFrames returned by data_api, store each field as a (date, symbol) block.
+
+        Parameters
+        ----------
+        df_list : list of pd.DataFrame
+            Columns are symbol, index_name and fields.
+        index_name : str
+        index : np.ndarray, optional
+            Date index of the store. If None, use union of dates of all DataFrames.
 
-        return multi_daily, multi_quarterly
+        Returns
+        -------
+        FieldStore
 
-    def query_lgt_data(self, fields_lgt_ind, daily_df):
+        """
+        df_list = [self._process_index_co(df, index_name) for df in df_list]
+        if index is None:
+            index = np.unique(np.concatenate([df[index_name].values for df in df_list]))
+        store = FieldStore(index, self.symbol, index_name=index_name)
+
+        fields_incomplete = set()
+        for df in df_list:
+            fields = [col for col in df.columns if col not in ('symbol', index_name)]
+            if not fields:
+                continue
+            df_pivot = df.pivot(index=index_name, columns='symbol')
+            for field in fields:
+                if field in store:
+                    continue
+                store.set_field(field, df_pivot[field])
+            if len(set(self.symbol) - set(df['symbol'].values)) > 0:
+                fields_incomplete.update(fields)
+
+        if fields_incomplete:
+            print("WARNING: some data is unavailable: "
+                  + "\n    At fields " + ', '.join(sorted(fields_incomplete)))
+        return store
+
+    def query_lgt_data(self, fields_lgt_ind, store_d):
         filter_str = "symbol={0}&start_date={1}&end_date={2}".format(
             ','.join(self.symbol),
             self.extended_start_date_q,
@@ -807,8 +1264,8 @@ class DataView(object):
         df_regdt = df_dividend.pivot_table(index='record_date', columns='symbol', values='values').replace(np.nan, 0)
         df_regdt = df_regdt.replace(np.nan, 0)
 
-        data_d_orig = self.data_d
-        self.data_d = daily_df
+        store_d_orig = self._store_d
+        self._store_d = store_d
 
         # 将除权除息日信息加入DataView
         self.append_df(df_regdt, '_regdt', is_quarterly=False)
@@ -830,9 +1287,10 @@ class DataView(object):
         self.append_df(lgt_holding_ratio, 'lgt_holding_ratio', is_quarterly=False)
 
         self.remove_field('_regdt,lgt_holding_origin,lgt_holding_ratio_origin')
-        daily_df = self.data_d
-        self.data_d = data_d_orig
-        return daily_df
+        store_d = self._store_d
+        self._store_d = store_d_orig
+        self._invalidate_cache()
+        return store_d
 
     def _query_data(self, symbol, fields):
         """
@@ -858,209 +1316,96 @@ class DataView(object):
             daily_list = []
             quarterly_list = []
 
+            # queries of all views are sent concurrently: {name: [(query_func_name, args, kwargs)]}
+            queries = OrderedDict()
+            drop_dup_cols = ['symbol', self.REPORT_DATE_FIELD_NAME]
+
             # TODO : use fields = {field: kwargs} to enable params
             fields_market_daily = self._get_fields('market_daily', fields, append=True)
             if fields_market_daily:
                 print("NOTE: price adjust method is [{:s} adjust]".format(self.adjust_mode))
                 # no adjust prices and other market daily fields
-                df_daily, msg1 = self.distributed_query('daily', symbol_str,
-                                                        start_date=self.extended_start_date_d, end_date=self.end_date,
-                                                        adjust_mode=None, fields=sep.join(fields_market_daily),
-                                                        limit=100000)
-                # df_daily, msg1 = self.data_api.daily(symbol_str, start_date=self.extended_start_date_d, end_date=self.end_date,
-                #                                     adjust_mode=None, fields=sep.join(fields_market_daily))
-
+                queries['market_daily'] = self._split_query('daily', symbol_str,
+                                                            start_date=self.extended_start_date_d,
+                                                            end_date=self.end_date,
+                                                            adjust_mode=None, fields=sep.join(fields_market_daily),
+                                                            limit=100000)
                 if self.all_price:
-                    adj_cols = ['open', 'high', 'low', 'close', 'vwap']
                     # adjusted prices
-                    # df_daily_adjust, msg11 = self.data_api.daily(symbol_str, start_date=self.extended_start_date_d, end_date=self.end_date,
-                    #                                             adjust_mode=self.adjust_mode, fields=','.join(adj_cols))
-                    df_daily_adjust, msg1 = self.distributed_query('daily', symbol_str,
-                                                                   start_date=self.extended_start_date_d,
-                                                                   end_date=self.end_date,
-                                                                   adjust_mode=self.adjust_mode,
-                                                                   fields=sep.join(fields_market_daily), limit=100000)
+                    queries['market_daily_adj'] = self._split_query('daily', symbol_str,
+                                                                    start_date=self.extended_start_date_d,
+                                                                    end_date=self.end_date,
+                                                                    adjust_mode=self.adjust_mode,
+                                                                    fields=sep.join(fields_market_daily),
+                                                                    limit=100000)
 
+            fields_ref_daily = self._get_fields('ref_daily', fields, append=True)
+            if fields_ref_daily:
+                queries['ref_daily'] = self._split_query('query_lb_dailyindicator', symbol_str,
+                                                         start_date=self.extended_start_date_d,
+                                                         end_date=self.end_date,
+                                                         fields=sep.join(fields_ref_daily), limit=20000)
+
+            fields_quarterly = OrderedDict()
+            for view in ['income', 'balance_sheet', 'cash_flow', 'fin_indicator']:
+                fields_quarterly[view] = self._get_fields(view, fields, append=True)
+                if fields_quarterly[view]:
+                    queries[view] = [('query_lb_fin_stat',
+                                      (view, symbol_str, self.extended_start_date_q, self.end_date,
+                                       sep.join(fields_quarterly[view])),
+                                      {'drop_dup_cols': drop_dup_cols})]
+
+            fields_risk_model = self._get_fields('risk_model', fields, append=True)
+            if fields_risk_model:
+                queries['risk_model'] = [('query_risk_model',
+                                          (symbol_str, self.extended_start_date_q, self.end_date,
+                                           sep.join(fields_risk_model)),
+                                          {})]
+
+            # run chunks of all queries on one pool, then concatenate chunks of each query
+            tasks = [task for task_list in queries.values() for task in task_list]
+            results_flat = self._run_queries(tasks)
+            results = dict()
+            i = 0
+            for name, task_list in queries.items():
+                results[name] = self._concat_results(results_flat[i: i + len(task_list)])
+                i += len(task_list)
+
+            if fields_market_daily:
+                df_daily, msg1 = results['market_daily']
+                if self.all_price:
+                    df_daily_adjust, msg1 = results['market_daily_adj']
                     df_daily = pd.merge(df_daily, df_daily_adjust, how='outer',
                                         on=['symbol', 'trade_date'], suffixes=('', '_adj'))
                 daily_list.append(df_daily.loc[:, fields_market_daily])
 
-            fields_ref_daily = self._get_fields('ref_daily', fields, append=True)
             if fields_ref_daily:
-                df_ref_daily, msg2 = self.distributed_query('query_lb_dailyindicator', symbol_str,
-                                                            start_date=self.extended_start_date_d,
-                                                            end_date=self.end_date,
-                                                            fields=sep.join(fields_ref_daily), limit=20000)
+                df_ref_daily, msg2 = results['ref_daily']
                 daily_list.append(df_ref_daily.loc[:, fields_ref_daily])
 
-            fields_income = self._get_fields('income', fields, append=True)
-            if fields_income:
-                df_income, msg3 = self.data_api.query_lb_fin_stat('income', symbol_str, self.extended_start_date_q,
-                                                                  self.end_date,
-                                                                  sep.join(fields_income),
-                                                                  drop_dup_cols=['symbol', self.REPORT_DATE_FIELD_NAME])
-                quarterly_list.append(df_income.loc[:, fields_income])
-
-            fields_balance = self._get_fields('balance_sheet', fields, append=True)
-            if fields_balance:
-                df_balance, msg3 = self.data_api.query_lb_fin_stat('balance_sheet', symbol_str,
-                                                                   self.extended_start_date_q, self.end_date,
-                                                                   sep.join(fields_balance), drop_dup_cols=['symbol',
-                                                                                                            self.REPORT_DATE_FIELD_NAME])
-                quarterly_list.append(df_balance.loc[:, fields_balance])
-
-            fields_cf = self._get_fields('cash_flow', fields, append=True)
-            if fields_cf:
-                df_cf, msg3 = self.data_api.query_lb_fin_stat('cash_flow', symbol_str, self.extended_start_date_q,
-                                                              self.end_date,
-                                                              sep.join(fields_cf),
-                                                              drop_dup_cols=['symbol', self.REPORT_DATE_FIELD_NAME])
-                quarterly_list.append(df_cf.loc[:, fields_cf])
-
-            fields_fin_ind = self._get_fields('fin_indicator', fields, append=True)
-            if fields_fin_ind:
-                df_fin_ind, msg4 = self.data_api.query_lb_fin_stat('fin_indicator', symbol_str,
-                                                                   self.extended_start_date_q, self.end_date,
-                                                                   sep.join(fields_fin_ind), drop_dup_cols=['symbol',
-                                                                                                            self.REPORT_DATE_FIELD_NAME])
-                quarterly_list.append(df_fin_ind.loc[:, fields_fin_ind])
-
-            fields_risk_model = self._get_fields('risk_model', fields, append=True)    
+            for view, fields_view in fields_quarterly.items():
+                if fields_view:
+                    df_view, msg3 = results[view]
+                    quarterly_list.append(df_view.loc[:, fields_view])
+
             if fields_risk_model:
-                df_risk_model, msg5 = self.data_api.query_risk_model( symbol_str,
-                                                                   self.extended_start_date_q, self.end_date,
-                                                                   sep.join(fields_risk_model))
-                daily_list.append(df_risk_model.loc[:, fields_risk_model])                  
+                df_risk_model, msg5 = results['risk_model']
+                daily_list.append(df_risk_model.loc[:, fields_risk_model])
 
         else:
             raise NotImplementedError("freq = {}".format(self.freq))
 
         return daily_list, quarterly_list
 
-    @staticmethod
-    def _merge_data(dfs, index_name='trade_date', join='outer', keep_input=True):
-        """
-        Merge data from different APIs into one DataFrame.
-
-        Parameters
-        ----------
-        dfs : list of pd.DataFrame
-
-        Returns
-        -------
-        merge : pd.DataFrame or None
-            If dfs is empty, return None
-
-        Notes
-        -----
-        Align on date index, concatenate on columns (symbol and fields)
-
-        """
-        # dfs = [df for df in dfs if df is not None]
-        new_dfs = []
-        # column level swap: [symbol, field] => [field, symbol]
-        for df in dfs:
-            if keep_input:
-                df_new = df.copy()
-            else:
-                df_new = df
-            df_new.columns = df_new.columns.swaplevel()
-            df_new = df_new.sort_index(axis=1)
-            new_dfs.append(df_new)
-
-        index_set = None
-        for df in new_dfs:
-            if index_set is None:
-                index_set = set(df.index)
-            else:
-                if join == 'inner':
-                    index_set = index_set & set(df.index)
-                else:
-                    index_set = index_set | set(df.index)
-        index_list = list(index_set)
-        index_list.sort()
-            
-        cols = None
-        for df in new_dfs:
-            if cols is None:
-                cols = df.columns
-            else:
-                cols = cols.append(df.columns)
-        
-        merge = pd.DataFrame(data=np.nan, index=index_list, columns=cols)
-        
-        for df in new_dfs:
-            for col in df.columns.levels[0]:
-                merge[col] = df[col]
-        
-        merge.columns = merge.columns.swaplevel()
-        merge = merge.sort_index(axis=1)
-    
-        # merge1 = pd.concat(dfs, axis=1, join='outer')
-        # drop duplicated columns. ONE LINE EFFICIENT version
-        mask_duplicated = merge.columns.duplicated()
-        if np.any(mask_duplicated):
-            # print("Duplicated columns found. Dropped.")
-            merge = merge.loc[:, ~mask_duplicated]
-
-            # if merge.isnull().sum().sum() > 0:
-            # print "WARNING: nan in final merged data. NO fill"
-            # merge.fillna(method='ffill', inplace=True)
-
-        merge = merge.sort_index(axis=1, level=['symbol', 'field'])
-        merge.index.name = index_name
-
-        return merge
-
-    def _fill_missing_idx_col(self, df, index=None, symbols=None):
-        if index is None:
-            index = df.index
-        if symbols is None:
-            symbols = self.symbol
-        fields = df.columns.levels[1]
-
-        if len(fields) * len(self.symbol) != len(df.columns) or set(index) != set(df.index):
-            cols_multi = pd.MultiIndex.from_product([fields, symbols], names=['field', 'symbol'])
-            cols_multi = cols_multi.sort_values()
-
-            df_final = pd.DataFrame(index=index, columns=cols_multi, data=np.nan)
-            df_final.index.name = df.index.name
-            
-            df.columns = df.columns.swaplevel()
-            df = df.sort_index(axis=1)
-            
-            for col in df.columns.levels[0]:
-                df_final[col] = df[col]
-            
-            df_final.columns = df_final.columns.swaplevel()
-            df_final = df_final.sort_index(axis=1)
-            # df_final.update(df)
-        
-            # idx_diff = sorted(set(df_final.index) - set(df.index))
-            col_diff = sorted(set(df_final.columns.levels[0].values) - set(df.columns.levels[0].values))
-            print("WARNING: some data is unavailable: "
-                   # + "\n    At index " + ', '.join(idx_diff)
-                   + "\n    At fields " + ', '.join(col_diff))
-            return df_final
-        else:
-            return df
-
     def _align_and_merge_q_into_d(self):
-        data_d, data_q = self.data_d, self.data_q
-        if data_d is not None and data_q is not None:
-            df_ref_ann = data_q.loc[:, pd.IndexSlice[:, self.ANN_DATE_FIELD_NAME]].copy()
-            df_ref_ann.columns = df_ref_ann.columns.droplevel(level='field')
-
-            dic_expanded = dict()
-            for field_name, df in data_q.groupby(level=1, axis=1):  # by column multiindex fields
-                df_expanded = align(df, df_ref_ann, self.dates)
-                dic_expanded[field_name] = df_expanded
-            df_quarterly_expanded = pd.concat(dic_expanded.values(), axis=1)
-            df_quarterly_expanded.index.name = self.TRADE_DATE_FIELD_NAME
-
-            data_d_merge = self._merge_data([data_d, df_quarterly_expanded], index_name=self.TRADE_DATE_FIELD_NAME)
-            data_d = data_d_merge.loc[data_d.index, :]
-        self.data_d = data_d
+        store_d, store_q = self._store_d, self._store_q
+        if store_d is not None and store_q is not None:
+            # all quarterly fields share the same announcement dates: search positions only once
+            ann_index = self._get_ann_index()
+            for field_name in store_q.fields:
+                df_expanded = ann_index.align(store_q.get_frame(field_name, copy=False))
+                store_d.set_field(field_name, df_expanded)
+            self._invalidate_cache()
 
     def _prepare_adj_factor(self):
         """Query and append daily adjust factor for prices."""
@@ -1096,11 +1441,11 @@ class DataView(object):
         self.append_df(df_weights, 'index_weight', is_quarterly=False)
 
     def _prepare_report_date(self):
-        idx = self.data_q.index
-        df_report_date = pd.DataFrame(index=idx, columns=self.symbol, data=0)
+        idx = self._store_q.index
         n = len(idx)
-        quarter = idx.values // 100 % 100
-        df_report_date.loc[:, :] = quarter.reshape(n, -1)
+        quarter = idx // 100 % 100
+        df_report_date = pd.DataFrame(index=idx, columns=self._store_q.symbols,
+                                      data=np.tile(quarter.reshape(n, -1), (1, len(self._store_q.symbols))))
 
         self.append_df(df_report_date, 'quarter', is_quarterly=True)
 
@@ -1181,27 +1526,24 @@ class DataView(object):
             print("Field name [{}] not valid, ignore.".format(field_name))
             return False
 
-        merge_d, merge_q = self._prepare_daily_quarterly([field_name])
-
         if self._is_daily_field(field_name):
-            if self.data_d is None:
+            if self._store_d is None:
                 raise ValueError("Please prepare [{:s}] first.".format(field_name))
-            merge, _ = self._prepare_daily_quarterly([field_name])
             is_quarterly = False
         else:
-            if self.data_q is None:
+            if self._store_q is None:
                 raise ValueError("Please prepare [{:s}] first.".format(field_name))
-            _, merge = self._prepare_daily_quarterly([field_name])
             is_quarterly = True
 
-        merge = merge.loc[:, pd.IndexSlice[:, field_name]]
-        merge.columns = merge.columns.droplevel(level=1)
+        store_d, store_q = self._prepare_daily_quarterly([field_name])
+        store = store_q if is_quarterly else store_d
+        merge = store.get_frame(field_name)
         self.append_df(merge, field_name, is_quarterly=is_quarterly)  # whether contain only trade days is decided by existing data.
         
         if is_quarterly:
-            df_ann = merge_q.loc[:, pd.IndexSlice[:, self.ANN_DATE_FIELD_NAME]]
-            df_ann.columns = df_ann.columns.droplevel(level='field')
-            df_expanded = align(merge, df_ann, self.dates)
+            # expand with the cached announcement index, as other quarterly fields of this view
+            df_quarterly = self._store_q.get_frame(field_name, copy=False)
+            df_expanded = self._get_ann_index().align(df_quarterly)
             self.append_df(df_expanded, field_name, is_quarterly=False)
         return True
 
@@ -1234,18 +1576,18 @@ class DataView(object):
             # must use extended date. Default is start_date
             return self.get_ts(var, start_date=self.extended_start_date_d, end_date=self.end_date)
 
-    def add_factor(self, factor, name=None, is_quarterly=False):  # within_index=True):
+    def add_factor(self, factor, name=None, is_quarterly=False, lazy=False):  # within_index=True):
         if not name:
             name = factor.split('(')[0]
 
-        self.add_formula(field_name=name, formula=factor, is_quarterly=is_quarterly)
+        self.add_formula(field_name=name, formula=factor, is_quarterly=is_quarterly, lazy=lazy)
 
-    def add_label(self, factor, name=None, is_quarterly=False):  # within_index=True):
-        self.add_factor(factor, name, is_quarterly)
+    def add_label(self, factor, name=None, is_quarterly=False, lazy=False):  # within_index=True):
+        self.add_factor(factor, name, is_quarterly, lazy=lazy)
 
     def add_formula(self, field_name, formula, is_quarterly, overwrite=True,
                     formula_func_name_style='camel', data_api=None,
-                    within_index=True):
+                    within_index=True, lazy=False):
         """
         Add a new field, which is calculated using existing fields.
 
@@ -1263,12 +1605,17 @@ class DataView(object):
         data_api : RemoteDataService, optional
         within_index : bool
             When do cross-section operatioins, whether just do within index components.
+        lazy : bool, optional
+            If True, only register the formula. It will be evaluated when the field is first fetched
+            (get_ts, get, get_snapshot, etc.). False by default.
 
         Notes
         -----
         Time cost of this function:
             For a simple formula (like 'a + 1'), almost all time is consumed by append_df;
             For a complex formula (like 'GroupRank'), half of time is consumed by evaluation and half by append_df.
+        Formulas form a dependency graph. When a field is overwritten (by append_df, add_formula, etc.),
+        all formulas depending on it, directly or not, will be re-evaluated when fetched next time.
         """
         if data_api is not None:
             self.data_api = data_api
@@ -1285,39 +1632,244 @@ class DataView(object):
         parser = self._create_parser(formula_func_name_style)
         expr = parser.parse(formula)
 
-        var_df_dic = dict()
         var_list = expr.variables()
-
-        factors = [var for var in var_list if var in self._import_factors]
-
         var_list = [var for var in var_list if var not in expr.functions]
 
         # TODO: users do not need to prepare data before add_formula
         if not self.fields:
             self.fields.extend(var_list)
             self.prepare_data()
+
+        self.formulas.append([field_name, formula, is_quarterly, formula_func_name_style, within_index])
+        self._formula_deps[field_name] = set(expr.variables())
+        self._add_field(field_name, is_quarterly)
+        self._pending_formulas.add(field_name)
+
+        if not lazy:
+            success = self._evaluate_formula_field(field_name)
+            if not success:
+                self.remove_field(field_name)
+
+    def add_formulas(self, formulas, is_quarterly=False, overwrite=True,
+                     formula_func_name_style='camel', data_api=None,
+                     within_index=True, n_jobs=1):
+        """
+        Add many new fields at once, each calculated by a formula.
+        The result is the same as calling add_formula for each of them, but all formulas are evaluated
+        in one pass: each variable is fetched only once and sub-expressions shared by formulas are
+        calculated only once.
+
+        Parameters
+        ----------
+        formulas : dict
+            {field_name: formula}. A formula can refer to other fields in formulas.
+        is_quarterly : bool, optional
+            Whether results are quarterly data. False by default.
+        overwrite : bool, optional
+            Whether overwrite existing field. True by default.
+        formula_func_name_style : {'upper', 'lower'}, optional
+        data_api : RemoteDataService, optional
+        within_index : bool, optional
+            When do cross-section operatioins, whether just do within index components.
+        n_jobs : int, optional
+            Number of processes used to evaluate formulas, 1 (in this process) by default.
+            Formulas are split into n_jobs groups, sub-expressions are shared only within a group.
+
+        """
+        if data_api is not None:
+            self.data_api = data_api
+
+        formulas = OrderedDict(formulas)
+        for field_name in formulas:
+            if field_name in self.fields:
+                if overwrite:
+                    self.remove_field(field_name)
+                    print("Field [{:s}] is overwritten.".format(field_name))
+                else:
+                    raise ValueError("Add formula failed: name [{:s}] exist. Try another name.".format(field_name))
+            elif self._is_predefined_field(field_name):
+                raise ValueError("[{:s}] is alread a pre-defined field. Please use another name.".format(field_name))
+
+        parser = self._create_parser(formula_func_name_style)
+        deps = OrderedDict((field_name, set(parser.parse(formula).variables()))
+                           for field_name, formula in formulas.items())
+
+        # TODO: users do not need to prepare data before add_formula
+        if not self.fields:
+            var_set = set().union(*deps.values())
+            self.fields.extend([var for var in var_set if var not in formulas and var not in parser.functions])
+            self.prepare_data()
+
+        for field_name, formula in formulas.items():
+            self.formulas.append([field_name, formula, is_quarterly, formula_func_name_style, within_index])
+            self._formula_deps[field_name] = deps[field_name]
+            self._add_field(field_name, is_quarterly)
+            self._pending_formulas.add(field_name)
+
+        # formulas referring to other new fields are evaluated after them
+        remaining = list(formulas.keys())
+        while remaining:
+            remaining_set = set(remaining)
+            ready = [field_name for field_name in remaining if not (deps[field_name] - {field_name}) & remaining_set]
+            if not ready:
+                # circular reference, leave it to the lazy evaluation
+                break
+            self._evaluate_formula_batch(parser, OrderedDict((field_name, formulas[field_name]) for field_name in ready),
+                                         is_quarterly, within_index, formula_func_name_style, n_jobs)
+            remaining = [field_name for field_name in remaining if field_name not in ready]
+
+    def _evaluate_formula_batch(self, parser, formulas, is_quarterly, within_index, func_name_style, n_jobs=1):
+        """Evaluate registered formulas together and store results, formulas with unavailable variables are removed."""
+        deps = {field_name: [var for var in self._formula_deps[field_name] if var not in parser.functions]
+                for field_name in formulas}
+        var_list = []
+        for field_name in formulas:
+            var_list.extend([var for var in deps[field_name] if var not in var_list])
+
+        failed = set()
+        for var in var_list:
+            if var not in self.fields:
+                print("Variable [{:s}] is not recognized (it may be wrong)," \
+                      "try to fetch from the server...".format(var))
+                if not self.add_field(var):
+                    failed.add(var)
+        for field_name in list(formulas.keys()):
+            if failed.intersection(deps[field_name]):
+                print("Add formula failed: variables of [{:s}] are not available.".format(field_name))
+                self.remove_field(field_name)
+                formulas.pop(field_name)
+            else:
+                self._pending_formulas.discard(field_name)
+        if not formulas:
+            return
+
+        start_date = self.extended_start_date_d
+        var_list = []
+        for field_name in formulas:
+            var_list.extend([var for var in self._formula_deps[field_name] if var not in var_list])
+        var_df_dic = self._get_formula_inputs(parser, var_list, is_quarterly, start_date)
+        context = self._get_formula_context(within_index, start_date)
+
+        if n_jobs > 1 and len(formulas) > 1 and not self._import_factors:
+            # functions of import factors refer to this DataView, they can not be sent to other processes
+            names = list(formulas.keys())
+            chunk_size = int(np.ceil(len(names) * 1.0 / n_jobs))
+            tasks = []
+            for i in range(0, len(names), chunk_size):
+                chunk = OrderedDict((field_name, formulas[field_name]) for field_name in names[i: i + chunk_size])
+                chunk_vars = set().union(*[self._formula_deps[field_name] for field_name in chunk])
+                values = {var: df for var, df in var_df_dic.items() if var in chunk_vars}
+                tasks.append((chunk, func_name_style, values, context))
+            pool = multiprocessing.Pool(min(n_jobs, len(tasks)))
+            try:
+                res_list = pool.map(_evaluate_formulas_worker, tasks)
+            finally:
+                pool.close()
+                pool.join()
+            results = OrderedDict()
+            for res in res_list:
+                results.update(res)
         else:
-            for var in var_list:
-                if var not in self.fields:
-                    print("Variable [{:s}] is not recognized (it may be wrong)," \
-                          "try to fetch from the server...".format(var))
-                    success = self.add_field(var)
-                    if not success:
-                        return
+            results = parser.compile(formulas).evaluate(var_df_dic, **context)
+
+        for field_name, df_eval in results.items():
+            self.append_df(df_eval, field_name, is_quarterly=is_quarterly)
+            if is_quarterly:
+                df_expanded = self._get_ann_index().align(df_eval)
+                self.append_df(df_expanded, field_name, is_quarterly=False)
+
+    def _get_formula(self, field_name):
+        for item in self.formulas:
+            if item[0] == field_name:
+                return item
+        return None
+
+    def _build_formula_graph(self):
+        """Rebuild formula DAG from self.formulas, formulas without data are marked as pending."""
+        self._formula_deps = dict()
+        self._pending_formulas = set()
+        for field_name, formula, is_quarterly, func_name_style, within_index in self.formulas:
+            parser = self._create_parser(func_name_style)
+            self._formula_deps[field_name] = set(parser.parse(formula).variables())
+            store = self._store_q if is_quarterly else self._store_d
+            if store is None or field_name not in store:
+                self._pending_formulas.add(field_name)
+
+    def _get_dependents(self, field_name):
+        """All formulas depending on field_name, directly or not."""
+        res = set()
+        stack = [field_name]
+        while stack:
+            name = stack.pop()
+            for formula_name, deps in self._formula_deps.items():
+                if name in deps and formula_name not in res:
+                    res.add(formula_name)
+                    stack.append(formula_name)
+        return res
+
+    def _invalidate_dependents(self, field_name):
+        self._pending_formulas.update(self._get_dependents(field_name))
+
+    def _evaluate_pending(self, fields=None):
+        """
+        Evaluate pending formulas among fields (all pending formulas if None).
+        Upstream formulas are evaluated first when their data are fetched.
+
+        """
+        if fields is None:
+            fields = list(self._pending_formulas)
+        for field_name in fields:
+            if field_name in self._pending_formulas:
+                self._evaluate_formula_field(field_name)
+
+    def _evaluate_formula_field(self, field_name):
+        """Evaluate a registered formula and store the result. Return False if some variable is not available."""
+        _, formula, is_quarterly, func_name_style, within_index = self._get_formula(field_name)
+        # remove from pending first, so that a formula referring to itself will not recurse forever
+        self._pending_formulas.discard(field_name)
+        # evaluate upstream formulas before this one, as storing them marks this formula pending again
+        self._evaluate_pending([var for var in self._formula_deps.get(field_name, ()) if var != field_name])
+        self._pending_formulas.discard(field_name)
+
+        parser = self._create_parser(func_name_style)
+        expr = parser.parse(formula)
+        var_list = [var for var in expr.variables() if var not in expr.functions]
+        for var in var_list:
+            if var not in self.fields:
+                print("Variable [{:s}] is not recognized (it may be wrong)," \
+                      "try to fetch from the server...".format(var))
+                success = self.add_field(var)
+                if not success:
+                    return False
+
+        df_eval = self._evaluate_formula(parser, expr, is_quarterly, within_index)
+
+        self.append_df(df_eval, field_name, is_quarterly=is_quarterly)
+
+        if is_quarterly:
+            df_expanded = self._get_ann_index().align(df_eval)
+            self.append_df(df_expanded, field_name, is_quarterly=False)
+        return True
+
+    def _get_formula_inputs(self, parser, var_list, is_quarterly, start_date):
+        """Fetch data of variables used by formulas, import factors without arguments are evaluated."""
+        var_df_dic = dict()
+        factors = [var for var in var_list if var in self._import_factors]
+        var_list = [var for var in var_list if var not in parser.functions]
 
         for var in var_list:
             if self._is_quarter_field(var):
                 df_var = self.get_ts_quarter(var, start_date=self.extended_start_date_q)
             else:
                 # must use extended date. Default is start_date
-                df_var = self.get_ts(var, start_date=self.extended_start_date_d, end_date=self.end_date)
+                df_var = self.get_ts(var, start_date=start_date, end_date=self.end_date)
 
             var_df_dic[var] = df_var
 
         # TODO:
         for factor in factors:
             if factor in self.fields:
-                df_var = self.get_ts(factor, start_date=self.extended_start_date_d, end_date=self.end_date)
+                df_var = self.get_ts(factor, start_date=start_date, end_date=self.end_date)
                 var_df_dic[factor] = df_var
 
             elif not self._import_factors[factor].args:
@@ -1328,24 +1880,37 @@ class DataView(object):
             # else:
             #     raise ValueError("no arguments for factor: " + factor)
 
+        return var_df_dic
+
+    def _get_formula_context(self, within_index, start_date):
+        """Keyword arguments of Parser.evaluate for formulas evaluated from start_date."""
         # TODO: send ann_date into expr.evaluate. We assume that ann_date of all fields of a symbol is the same
-        df_ann = self._get_ann_df()
+        dates = self.dates
+        context = {'ann_dts': self._get_ann_df(),
+                   'trade_dts': dates[dates >= start_date],
+                   'ann_index': self._get_ann_index()}
         if within_index:
-            df_index_member = self.get_ts('index_member', start_date=self.extended_start_date_d, end_date=self.end_date)
-            df_eval = parser.evaluate(var_df_dic, ann_dts=df_ann, trade_dts=self.dates, index_member=df_index_member)
-        else:
-            df_eval = parser.evaluate(var_df_dic, ann_dts=df_ann, trade_dts=self.dates)
+            context['index_member'] = self.get_ts('index_member', start_date=start_date, end_date=self.end_date)
+        return context
 
-        # FIXME: When field_name is factor's id, the factor may be added before!
-        if field_name in self.fields:
-            self.remove_field(field_name)
+    def _evaluate_formula(self, parser, expr, is_quarterly, within_index, start_date=0):
+        """
+        Evaluate a parsed formula using daily data from start_date (self.extended_start_date_d by default)
+        to self.end_date.
 
-        self.append_df(df_eval, field_name, is_quarterly=is_quarterly)
+        Returns
+        -------
+        df_eval : pd.DataFrame
 
-        if is_quarterly:
-            df_ann = self._get_ann_df()
-            df_expanded = align(df_eval, df_ann, self.dates)
-            self.append_df(df_expanded, field_name, is_quarterly=False)
+        """
+        if not start_date:
+            start_date = self.extended_start_date_d
+
+        var_df_dic = self._get_formula_inputs(parser, expr.variables(), is_quarterly, start_date)
+        context = self._get_formula_context(within_index, start_date)
+        df_eval = parser.evaluate(var_df_dic, **context)
+
+        return df_eval
 
     def append_df(self, df, field_name, is_quarterly=False):
         """
@@ -1364,7 +1929,6 @@ class DataView(object):
         then append_df() again.
 
         """
-        df = df.copy()
         if isinstance(df, pd.DataFrame):
             pass
         elif isinstance(df, pd.Series):
@@ -1372,43 +1936,14 @@ class DataView(object):
         else:
             raise ValueError("Data to be appended must be pandas format. But we have {}".format(type(df)))
 
-        if is_quarterly:
-            the_data = self.data_q
-        else:
-            the_data = self.data_d
+        store = self._store_q if is_quarterly else self._store_d
+        # only this field is written: missing symbols / dates are filled with NaN, redundant ones are dropped
+        store.set_field(field_name, df)
 
-        exist_symbols = the_data.columns.levels[0]
-        if len(df.columns) < len(exist_symbols):
-            df2 = pd.DataFrame(index=df.index, columns=exist_symbols, data=np.nan)
-            for col in df.columns:
-                df2.loc[:, col] = df.loc[:, col]
-            # df2.update(df)
-            df = df2
-        elif len(df.columns) > len(exist_symbols):
-            df = df.loc[:, exist_symbols]
-        multi_idx = pd.MultiIndex.from_product([[field_name], exist_symbols])
-        df.columns = multi_idx
-        df = df.sort_index(axis=1)
-        
-        the_data.columns = the_data.columns.swaplevel()
-        the_data = the_data.sort_index(axis=1)
-        
-        new_cols = the_data.columns.append(df.columns)
-        the_data = the_data.reindex(columns=new_cols)
-        the_data[field_name] = df[field_name]
-        the_data.columns = the_data.columns.swaplevel()
-        the_data = the_data.sort_index(axis=1)
-        #the_data = apply_in_subprocess(pd.merge, args=(the_data, df),
-        #                            kwargs={'left_index': True, 'right_index': True, 'how': 'left'})  # runs in *only* one process
-        #the_data = pd.merge(the_data, df, left_index=True, right_index=True, how='left')
-        #the_data = the_data.sort_index(axis=1)
-        #merge = the_data.join(df, how='left')  # left: keep index of existing data unchanged
-        #sort_columns(the_data)
-    
-        if is_quarterly:
-            self.data_q = the_data
-        else:
-            self.data_d = the_data
+        self._invalidate_cache()
+        self._invalidate_dependents(field_name)
+        if is_quarterly and field_name == self.ANN_DATE_FIELD_NAME:
+            self._ann_index = None
         self._add_field(field_name, is_quarterly)
 
     def remove_field(self, field_names):
@@ -1448,12 +1983,17 @@ class DataView(object):
 
             # remove field data
 
-            self.data_d = self.data_d.drop(field_name, axis=1, level=1)
+            self._store_d.remove_field(field_name)
             if is_quarterly:
-                self.data_q = self.data_q.drop(field_name, axis=1, level=1)
+                self._store_q.remove_field(field_name)
+            self._invalidate_cache()
 
             # remove fields name from list
             self.fields.remove(field_name)
+            self.formulas = [item for item in self.formulas if item[0] != field_name]
+            self._formula_deps.pop(field_name, None)
+            self._pending_formulas.discard(field_name)
+            self._invalidate_dependents(field_name)
             if is_quarterly:
                 if field_name in self.custom_quarterly_fields:
                     self.custom_quarterly_fields.remove(field_name)
@@ -1484,26 +2024,33 @@ class DataView(object):
             index is datetimeindex, columns are (symbol, fields) MultiIndex
 
         """
-        sep = ','
-
-        if not fields:
-            fields = slice(None)  # self.fields
-        else:
-            fields = fields.split(sep)
-
-        if not symbol:
-            symbol = slice(None)  # this is 3X faster than symbol = self.symbol
-        else:
-            symbol = symbol.split(sep)
-
         if not start_date:
             start_date = self.start_date
         if not end_date:
             end_date = self.end_date
 
-        res = self.data_d.loc[pd.IndexSlice[start_date: end_date], pd.IndexSlice[symbol, fields]]
+        self._evaluate_pending(fields.split(',') if fields else None)
+        store = self._store_d
+        fields, symbol = self._parse_fields_symbols(store, fields, symbol)
+
+        res = store.to_frame(fields=fields, symbols=symbol, start_date=start_date, end_date=end_date)
         return res
 
+    @staticmethod
+    def _parse_fields_symbols(store, fields, symbol):
+        """Split comma separated fields / symbol and drop those not in store. Empty string means all."""
+        sep = ','
+        if not fields:
+            fields = None
+        else:
+            fields = [f for f in fields.split(sep) if f in store]
+
+        if not symbol:
+            symbol = None
+        else:
+            symbol = sorted(set(symbol.split(sep)) & set(store.symbols))
+        return fields, symbol
+
     def get_snapshot(self, snapshot_date, symbol="", fields=""):
         """
         Get snapshot of given fields and symbol at snapshot_date.
@@ -1524,6 +2071,11 @@ class DataView(object):
 
         """
 
+        has_snapshot = self._snapshot is not None
+        self._evaluate_pending(fields.split(',') if fields else None)
+        if has_snapshot and self._snapshot is None:
+            # pending formulas have just been evaluated, build snapshots again with them
+            self.update_snapshot()
         if self._snapshot is not None:
             if snapshot_date not in self._snapshot:
                 return
@@ -1534,16 +2086,39 @@ class DataView(object):
             else:
                 return df
 
-        res = self.get(symbol=symbol, start_date=snapshot_date, end_date=snapshot_date, fields=fields)
+        store = self._store_d
+        fields_list, symbol_list = self._parse_fields_symbols(store, fields, symbol)
+        if fields_list is not None:
+            fields_list = sorted(fields_list)
+        else:
+            fields_list = sorted(store.fields)
+
+        res = store.get_row(snapshot_date, symbols=symbol_list, fields=fields_list)
         if res is None:
             print("No data. for date={}, fields={}, symbol={}".format(snapshot_date, fields, symbol))
             return
-
-        res = res.stack(level='symbol', dropna=False)
-        res.index = res.index.droplevel(level=self.TRADE_DATE_FIELD_NAME)
+        res.index.name = 'symbol'
+        res.columns.name = 'field'
 
         return res
 
+    def _get_ann_index(self):
+        """
+        Get announcement index of quarterly data on self.dates. It is built once and reused
+        until announcement dates or dates change.
+
+        Returns
+        -------
+        AnnouncementIndex or None
+            None if no quarterly data available.
+
+        """
+        if self._store_q is None or self.ANN_DATE_FIELD_NAME not in self._store_q:
+            return None
+        if self._ann_index is None:
+            self._ann_index = AnnouncementIndex(self._get_ann_df(), self.dates)
+        return self._ann_index
+
     def _get_ann_df(self):
         """
         Query announcement date of financial statements of all securities.
@@ -1555,10 +2130,9 @@ class DataView(object):
             If no quarterly data available, return None.
 
         """
-        if self.data_q is None:
+        if self._store_q is None:
             return None
-        df_ann = self.data_q.loc[:, pd.IndexSlice[:, self.ANN_DATE_FIELD_NAME]]
-        df_ann.columns = df_ann.columns.droplevel(level='field')
+        df_ann = self._store_q.get_frame(self.ANN_DATE_FIELD_NAME)
 
         return df_ann
 
@@ -1574,24 +2148,25 @@ class DataView(object):
 
     def get_ts_quarter(self, fields, symbols="", start_date=0, end_date=0):
         # TODO
-        sep = ','
-        if not symbols:
-            symbols = self.symbol
-        else:
-            symbols = symbols.split(sep)
-
-        if not fields:
-            fields = slice(None)  # self.fields
-        else:
-            fields = fields.split(sep)
+        self._evaluate_pending(fields.split(',') if fields else None)
+        store = self._store_q
+        fields_list, symbols_list = self._parse_fields_symbols(store, fields, symbols)
 
         # if not start_date:
         #     start_date = self.start_date
         # if not end_date:
         #     end_date = self.end_date
 
-        df_ref_quarterly = self.data_q.loc[:, pd.IndexSlice[symbols, fields]]
-        df_ref_quarterly.columns = df_ref_quarterly.columns.droplevel(level='field')
+        if fields_list is not None and len(fields_list) == 1:
+            df_ref_quarterly = store.get_frame(fields_list[0], symbols=symbols_list)
+        elif fields_list is not None and len(fields_list) == 0:
+            symbols_arr = store.symbols if symbols_list is None else symbols_list
+            df_ref_quarterly = pd.DataFrame(index=pd.Index(store.index, name=store.index_name),
+                                            columns=pd.Index(symbols_arr, name='symbol'))
+            df_ref_quarterly = df_ref_quarterly.iloc[:, :0]
+        else:
+            df_ref_quarterly = store.to_frame(fields=fields_list, symbols=symbols_list)
+            df_ref_quarterly.columns = df_ref_quarterly.columns.droplevel(level='field')
 
         return df_ref_quarterly
 
@@ -1616,6 +2191,16 @@ class DataView(object):
             Index is int date, column is symbol.
 
         """
+        self._evaluate_pending(field.split(','))
+        if not keep_level and field in self._store_d:
+            # fast path: single field is a single block
+            if not start_date:
+                start_date = self.start_date
+            if not end_date:
+                end_date = self.end_date
+            _, symbol_list = self._parse_fields_symbols(self._store_d, "", symbol)
+            return self._store_d.get_frame(field, symbols=symbol_list, start_date=start_date, end_date=end_date)
+
         res = self.get(symbol, start_date=start_date, end_date=end_date, fields=field)
         if res is None:
             print("No data. for start_date={}, end_date={}, field={}, symbol={}".format(start_date,
@@ -1672,14 +2257,17 @@ class DataView(object):
             if factor_id not in self._import_factors:
                 print("Can't find factor definitions: " + factor_id)
                 continue
+            if factor_name in self._pending_formulas:
+                continue
+            # factors are registered lazily and only evaluated when used
             if self._import_factors[factor_id].is_quarterly:
                 t = self.get_ts_quarter(factor_name)
                 if t is None or len(t.columns) == 0:
-                    self.add_factor(factor_expr, factor_name, is_quarterly=True)
+                    self.add_factor(factor_expr, factor_name, is_quarterly=True, lazy=True)
             else:
                 t = self.get_ts(factor_name)
                 if t is None or len(t.columns) == 0:
-                    self.add_factor(factor_expr, factor_name, is_quarterly=False)
+                    self.add_factor(factor_expr, factor_name, is_quarterly=False, lazy=True)
 
         t = self.get_ts('_daily_adjust_factor')
         if t is None or len(t.columns) == 0:
@@ -1698,22 +2286,113 @@ class DataView(object):
             limit = np.abs((open - preclose) / preclose)
             self.append_df(limit, "_limit", is_quarterly=False)
 
+        if any(field not in self._store_d for field in self.status_fields.values()):
+            self._prepare_status()
+
         # Snapshot dict may use large memory.
 
         if large_memory:
             self.update_snapshot()
 
+    def _prepare_status(self):
+        """
+        Precompute boolean (dates x symbols) matrices of trading status, so that backtests
+        read one row per rebalance instead of building snapshots and comparing strings:
+
+            _suspended      trade_status is suspended
+            _limit_reached  open price moved more than 9.5% from last close (see _limit)
+            _listed         list_date < date < delist_date
+            _index_member   member of any index of universe (all True if no universe)
+            _tradable       listed, not suspended and limit not reached
+
+        """
+        store = self._store_d
+        dates = store.index
+        shape = (len(dates), len(store.symbols))
+
+        if 'trade_status' in store:
+            suspended = store.get_values('trade_status') == u'停牌'
+        else:
+            suspended = np.zeros(shape, dtype=bool)
+
+        if '_limit' in store:
+            # TODO: 10% is not the absolute value to check limit reach
+            with np.errstate(invalid='ignore'):
+                limit_reached = store.get_values('_limit') > 9.5E-2
+        else:
+            limit_reached = np.zeros(shape, dtype=bool)
+
+        if self._data_inst is not None and 'list_date' in self._data_inst.columns:
+            # symbols without instrument info are never listed
+            df_inst = self._data_inst.reindex(store.symbols)
+            list_date = pd.to_numeric(df_inst['list_date'], errors='coerce').values.astype(float)
+            delist_date = pd.to_numeric(df_inst['delist_date'], errors='coerce').values.astype(float)
+            dates_col = dates.reshape(-1, 1)
+            with np.errstate(invalid='ignore'):
+                listed = (dates_col > list_date) & (dates_col < delist_date)
+        else:
+            listed = np.ones(shape, dtype=bool)
+
+        if self.universe and 'index_member' in store:
+            member = np.asarray(store.get_values('index_member'), dtype=float)
+            index_member = np.nan_to_num(member) != 0
+        else:
+            index_member = np.ones(shape, dtype=bool)
+
+        tradable = listed & ~suspended & ~limit_reached
+
+        values = {'suspended': suspended, 'limit_reached': limit_reached, 'listed': listed,
+                  'index_member': index_member, 'tradable': tradable}
+        for status, field_name in self.status_fields.items():
+            df = pd.DataFrame(data=values[status], index=dates, columns=store.symbols)
+            self.append_df(df, field_name, is_quarterly=False)
+
+    def get_status_symbols(self, date, status):
+        """
+        Get symbols of given trading status on date from the precomputed status matrices.
+
+        Parameters
+        ----------
+        date : int
+        status : str
+            Separated by ',', symbols satisfying all of them are returned.
+            {'suspended', 'limit_reached', 'listed', 'index_member', 'tradable'}
+
+        Returns
+        -------
+        np.ndarray
+            Sorted symbols, empty if date is not in the dataview.
+
+        """
+        store = self._store_d
+        if any(field not in store for field in self.status_fields.values()):
+            self._prepare_status()
+
+        mask = np.ones(len(store.symbols), dtype=bool)
+        pos = store.row_pos(date)
+        if pos < 0:
+            mask[:] = False
+        for name in status.split(','):
+            if name not in self.status_fields:
+                raise ValueError("status must be one of {}, but we have {}".format(list(self.status_fields), name))
+            if pos >= 0:
+                mask &= store.get_values(self.status_fields[name], slice(pos, pos + 1))[0]
+        return store.symbols[mask]
+
     def update_snapshot(self):
-        dates = self.data_d.index.values
-        df = self.data_d.T.unstack()
-        self._snapshot = {}
-        for date in dates:
-            tmp = df[date].copy()
-            del tmp.index.name
-            del tmp.columns.name
-            self._snapshot[date] = tmp
+        """
+        Build snapshots of all dates. Pending (lazy) formulas are left out,
+        they are evaluated and added to snapshots when get_snapshot asks for them.
 
-    def load_dataview(self, folder_path='.', large_memory=True):
+        """
+        store = self._store_d
+        fields = sorted(field for field in store.fields if field not in self._pending_formulas)
+        snapshot = {}
+        for date in store.index:
+            snapshot[date] = store.get_row(date, fields=fields)
+        self._snapshot = snapshot
+
+    def load_dataview(self, folder_path='.', large_memory=None):
         """
         Load data from local file.
 
@@ -1721,18 +2400,39 @@ class DataView(object):
         ----------
         folder_path : str or unicode, optional
             Folder path to store hd5 file and meta data.
+        large_memory : bool, optional
+            Whether to build snapshots of all dates after loading.
+            By default True for 'hd5' format and False for 'npy' format, which keeps fields lazily loaded.
+
+        Notes
+        -----
+        File format ('hd5' or 'npy') is detected automatically. Fields of 'npy' format are memory-mapped
+        and read from disk only when they are used.
 
         """
 
         path_meta_data = os.path.join(folder_path, 'meta_data.json')
         path_data = os.path.join(folder_path, 'data.hd5')
-        if not (os.path.exists(path_meta_data) and os.path.exists(path_data)):
+        path_store_d = os.path.join(folder_path, 'data_d')
+        path_store_q = os.path.join(folder_path, 'data_q')
+        is_npy = FieldStore.is_store_dir(path_store_d)
+        if not (os.path.exists(path_meta_data) and (is_npy or os.path.exists(path_data))):
             raise IOError("There is no data file under directory {}".format(folder_path))
 
+        if large_memory is None:
+            large_memory = not is_npy
+
         meta_data = jutil.read_json(path_meta_data)
-        dic = self._load_h5(path_data)
-        self.data_d = dic.get('/data_d', None)
-        self.data_q = dic.get('/data_q', None)
+        if is_npy:
+            dic = jutil.load_pickle(os.path.join(folder_path, 'data_others.pic'))
+            self._store_d = FieldStore.load(path_store_d)
+            self._store_q = FieldStore.load(path_store_q) if FieldStore.is_store_dir(path_store_q) else None
+            self._ann_index = None
+            self._invalidate_cache()
+        else:
+            dic = self._load_h5(path_data)
+            self.data_d = dic.get('/data_d', None)
+            self.data_q = dic.get('/data_q', None)
         self._data_benchmark = dic.get('/data_benchmark', None)
         self._data_inst = dic.get('/data_inst', None)
         self._factor_df = dic.get('/factor_df', None)
@@ -1749,11 +2449,12 @@ class DataView(object):
 
             self._import_factors[factor_id] = FactorDef(factor_id, factor_args, factor_body, factor_quarterly)
 
+        self._build_formula_graph()
         self._process_data(large_memory)
 
         print("Dataview loaded successfully.")
 
-    def save_dataview(self, folder_path):
+    def save_dataview(self, folder_path, file_format='hd5'):
         """
         Save data and meta_data_to_store to a single hd5 file.
         Store at output/sub_folder
@@ -1762,24 +2463,41 @@ class DataView(object):
         ----------
         folder_path : str or unicode
             Path to store your data.
+        file_format : {'hd5', 'npy'}, optional
+            'hd5': all data in a single data.hd5 file.
+            'npy': one .npy file per field under data_d/ and data_q/, which can be loaded lazily.
 
         """
+        if file_format not in ('hd5', 'npy'):
+            raise ValueError("file_format must be 'hd5' or 'npy', but we have {}".format(file_format))
+
         abs_folder = os.path.abspath(folder_path)
         meta_path = os.path.join(folder_path, 'meta_data.json')
         data_path = os.path.join(folder_path, 'data.hd5')
 
-        data_to_store = {'data_d': self.data_d,
-                         'data_q': self.data_q,
-                         'data_benchmark': self.data_benchmark,
-                         'data_inst': self.data_inst,
-                         'factor_df': self._factor_df
-                         }
-        data_to_store = {k: v for k, v in data_to_store.items() if v is not None}
         meta_data_to_store = {key: self.__dict__[key] for key in self.meta_data_list}
 
         print("\nStore data...")
         jutil.save_json(meta_data_to_store, meta_path)
-        self._save_h5(data_path, data_to_store)
+        if file_format == 'npy':
+            data_to_store = {'/data_benchmark': self.data_benchmark,
+                             '/data_inst': self.data_inst,
+                             '/factor_df': self._factor_df
+                             }
+            jutil.save_pickle(data_to_store, os.path.join(folder_path, 'data_others.pic'))
+            if self._store_d is not None:
+                self._store_d.save(os.path.join(folder_path, 'data_d'))
+            if self._store_q is not None:
+                self._store_q.save(os.path.join(folder_path, 'data_q'))
+        else:
+            data_to_store = {'data_d': self.data_d,
+                             'data_q': self.data_q,
+                             'data_benchmark': self.data_benchmark,
+                             'data_inst': self.data_inst,
+                             'factor_df': self._factor_df
+                             }
+            data_to_store = {k: v for k, v in data_to_store.items() if v is not None}
+            self._save_h5(data_path, data_to_store)
 
         print("Dataview has been successfully saved to:\n"
               + abs_folder + "\n\n"
@@ -1852,12 +2570,19 @@ class DataView(object):
         elif isinstance(symbols, (list, tuple)):
             pass
 
+        def _select(store, field_list):
+            symbol_list = None if symbols == slice(None) else sorted(set(symbols) & set(store.symbols))
+            if field_list is not None:
+                field_list = [f for f in store.fields if f in field_list]
+            # dup is independent of this dataview, data is copied instead of viewed
+            return store.take(extended_start_date_d, end_date, symbols=symbol_list, fields=field_list, copy=True)
+
         dv2 = DataView()
+        if self._store_d is not None:
+            dv2._store_d = _select(self._store_d, None if fields == slice(None) else fields)
+        if self._store_q is not None:
+            dv2._store_q = _select(self._store_q, None)
         dv2.data_benchmark = self.data_benchmark[extended_start_date_d: end_date]
-        if self.data_d is not None:
-            dv2.data_d = self.data_d.loc[pd.IndexSlice[extended_start_date_d: end_date], pd.IndexSlice[symbols, fields]]
-        if self.data_q is not None:
-            dv2.data_q = self.data_q.loc[pd.IndexSlice[extended_start_date_d: end_date], pd.IndexSlice[symbols, slice(None)]]
 
         dv2._data_inst = self.data_inst.copy()
 
@@ -1870,8 +2595,70 @@ class DataView(object):
         if fields != slice(None):
             meta_data['fields'] = fields
         dv2.__dict__.update(meta_data)
+        dv2._import_factors = self._import_factors
+        dv2.formulas = [item for item in self.formulas if item[0] in dv2.fields]
+        dv2._build_formula_graph()
         return dv2
 
+    def slice_dates(self, start_date, end_date):
+        """
+        Get a DataView of dates between start_date and end_date which shares memory with this one.
+
+        Unlike dup, no data is copied: fields are read-only views of this dataview (a field modified
+        in the new dataview is copied first), instrument info is shared, and formulas are evaluated
+        once here instead of in every slice. Lists of fields, symbols, formulas and factor definitions
+        are copied, so fields added to or removed from the new dataview do not affect this one.
+
+        Parameters
+        ----------
+        start_date : int
+        end_date : int
+
+        Returns
+        -------
+        DataView
+            Its start_date / end_date are the given ones. Daily data starts 8 weeks earlier
+            (quarterly data 80 weeks earlier) as in init_from_config, if this dataview has such data.
+
+        """
+        if start_date < self.start_date or end_date > self.end_date:
+            raise ValueError("[{}, {}] is out of range of the dataview [{}, {}]".format(
+                start_date, end_date, self.start_date, self.end_date))
+
+        # evaluate lazy formulas here, so that slices need not evaluate them each
+        self._evaluate_pending()
+
+        extended_start_date_d = max(jutil.shift(start_date, n_weeks=-8), self.extended_start_date_d)
+        extended_start_date_q = max(jutil.shift(start_date, n_weeks=-80), self.extended_start_date_q)
+
+        dv = DataView()
+        meta_data = {key: self.__dict__[key] for key in self.meta_data_list}
+        # containers are copied: fields / formulas added to the slice are not added to this dataview
+        meta_data = {key: copy.copy(value) if isinstance(value, (list, dict, set)) else value
+                     for key, value in meta_data.items()}
+        dv.__dict__.update(meta_data)
+        dv.start_date = start_date
+        dv.end_date = end_date
+        dv.extended_start_date_d = extended_start_date_d
+        dv.extended_start_date_q = extended_start_date_q
+        dv.data_api = self.data_api
+        dv.adjust_mode = self.adjust_mode
+
+        if self._store_d is not None:
+            dv._store_d = self._store_d.take(extended_start_date_d, end_date, readonly=True)
+        if self._store_q is not None:
+            dv._store_q = self._store_q.take(extended_start_date_q, end_date, readonly=True)
+        if self._data_benchmark is not None:
+            dv._data_benchmark = self._data_benchmark.loc[extended_start_date_d: end_date]
+        dv._data_inst = self._data_inst
+        dv._factor_df = self._factor_df
+        dv._import_factors = dict(self._import_factors)
+        if self._snapshot is not None and dv._store_d is not None:
+            dv._snapshot = {date: self._snapshot[date] for date in dv._store_d.index if date in self._snapshot}
+
+        dv._build_formula_graph()
+        return dv
+
 
 class EventDataView(object):
     """
@@ -0,0 +1,565 @@
+# encoding: utf-8
+"""
+FieldStore is the columnar storage used by DataView.
+
+Every field is kept as its own contiguous block of shape (n_dates, n_symbols),
+all blocks share one date axis and one symbol axis. Adding or removing a field
+therefore only touches the memory of that field, instead of re-sorting one
+giant (symbol, field) MultiIndex DataFrame.
+
+"""
+from __future__ import print_function
+from collections import OrderedDict
+import os
+import numbers
+
+import numpy as np
+import pandas as pd
+
+import jaqs.util as jutil
+
+
+class CategoryBlock(object):
+    """
+    Block of non-numeric values (str, object) stored as int32 codes plus categories.
+
+    Attributes
+    ----------
+    codes : np.ndarray
+        dtype = int32, shape = (n_dates, n_symbols). -1 means NaN.
+    categories : np.ndarray
+        dtype = object
+
+    """
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.categories.nbytes
+
+    @classmethod
+    def from_array(cls, arr):
+        arr = np.asarray(arr)
+        codes, categories = pd.factorize(arr.ravel())
+        codes = codes.astype(np.int32).reshape(arr.shape)
+        return cls(codes, np.asarray(categories, dtype=object))
+
+    def take(self, rows=slice(None), cols=slice(None)):
+        return CategoryBlock(self.codes[rows][:, cols], self.categories)
+
+    def decode(self, rows=slice(None), cols=slice(None)):
+        """Return values as an object array of shape (n_rows, n_cols)."""
+        codes = self.codes[rows][:, cols]
+        mask = codes < 0
+        if len(self.categories):
+            res = self.categories.take(np.where(mask, 0, codes))
+        else:
+            res = np.empty(codes.shape, dtype=object)
+        res[mask] = np.nan
+        return res
+
+
+FIELD_FILE_PREFIX = 'field.'
+
+
+class _LazyBlock(object):
+    """Placeholder of a field saved on disk, opened (memory-mapped) when the field is first used."""
+    def __init__(self, path, is_category=False):
+        self.path = path
+        self.is_category = is_category
+
+    def load(self):
+        if self.is_category:
+            codes = np.load(self.path + '.codes.npy', mmap_mode='r')
+            categories = np.load(self.path + '.categories.npy', allow_pickle=True)
+            return CategoryBlock(codes, categories)
+        return np.load(self.path + '.npy', mmap_mode='r')
+
+
+def _to_block(arr):
+    """
+    Convert a 2-D array to the block type used in FieldStore:
+    float64 for float, int32 (int64 when overflow) for integer, bool for bool
+    and CategoryBlock for others.
+    Numeric data is always copied, so the block never shares memory with the caller.
+
+    """
+    arr = np.asarray(arr)
+    kind = arr.dtype.kind
+    if kind == 'f':
+        return np.array(arr, dtype=np.float64, order='C')
+    elif kind == 'b':
+        return np.array(arr, order='C')
+    elif kind in 'iu':
+        if arr.size and (arr.min() < np.iinfo(np.int32).min or arr.max() > np.iinfo(np.int32).max):
+            return np.array(arr, dtype=np.int64, order='C')
+        return np.array(arr, dtype=np.int32, order='C')
+    else:
+        block = CategoryBlock.from_array(arr)
+        # object columns which only contain numbers (e.g. all NaN) are stored as float
+        if all(isinstance(c, numbers.Number) for c in block.categories):
+            return np.ascontiguousarray(block.decode(), dtype=np.float64)
+        return block
+
+
+class FieldStore(object):
+    """
+    Columnar panel data: a field registry of (n_dates, n_symbols) blocks.
+
+    Attributes
+    ----------
+    index : np.ndarray
+        Sorted int dates, shared by all fields.
+    symbols : np.ndarray
+        Sorted symbols, shared by all fields.
+    index_name : str
+        Name of the date axis, 'trade_date' or 'report_date'.
+
+    Notes
+    -----
+    A store opened by FieldStore.load is backed by one .npy file per field. Files are memory-mapped
+    only when the field is first accessed and pages are read by OS on demand.
+
+    """
+    def __init__(self, index, symbols, index_name='trade_date'):
+        self.index = np.asarray(index)
+        self.symbols = np.asarray(symbols, dtype=object)
+        self.index_name = index_name
+
+        self._blocks = OrderedDict()
+        self._symbol_pos = {s: i for i, s in enumerate(self.symbols)}
+
+    # --------------------------------------------------------------------------------------------------------
+    # Properties
+    @property
+    def fields(self):
+        return list(self._blocks.keys())
+
+    @property
+    def shape(self):
+        """(n_dates, n_symbols * n_fields), the same as the equivalent MultiIndex DataFrame."""
+        return len(self.index), len(self.symbols) * len(self._blocks)
+
+    @property
+    def nbytes(self):
+        """Bytes of fields already loaded."""
+        return sum(block.nbytes for block in self._blocks.values() if not isinstance(block, _LazyBlock))
+
+    def _get_block(self, field):
+        block = self._blocks[field]
+        if isinstance(block, _LazyBlock):
+            block = block.load()
+            self._blocks[field] = block
+        return block
+
+    def __contains__(self, field):
+        return field in self._blocks
+
+    def __len__(self):
+        return len(self._blocks)
+
+    # --------------------------------------------------------------------------------------------------------
+    # Indexers
+    def row_slice(self, start_date=0, end_date=0):
+        """Positional slice of dates within [start_date, end_date]. 0 means no limit."""
+        start = np.searchsorted(self.index, start_date, side='left') if start_date else 0
+        end = np.searchsorted(self.index, end_date, side='right') if end_date else len(self.index)
+        return slice(start, end)
+
+    def row_pos(self, date):
+        """Position of date in index, -1 if not found."""
+        pos = np.searchsorted(self.index, date)
+        if pos < len(self.index) and self.index[pos] == date:
+            return pos
+        return -1
+
+    def col_indexer(self, symbols=None):
+        """Positions of symbols. Unknown symbols raise KeyError."""
+        if symbols is None:
+            return slice(None)
+        return np.array([self._symbol_pos[s] for s in symbols], dtype=np.intp)
+
+    def _get_symbols(self, cols):
+        return self.symbols[cols]
+
+    # --------------------------------------------------------------------------------------------------------
+    # Modify
+    def set_field(self, field, values):
+        """
+        Add or overwrite a field.
+
+        Parameters
+        ----------
+        field : str
+        values : pd.DataFrame or pd.Series or np.ndarray
+            DataFrame (index is date, columns are symbols) will be aligned to axes of the store,
+            dates / symbols not in the store are dropped and missing ones are filled with NaN.
+            np.ndarray must be of shape (n_dates, n_symbols).
+
+        """
+        if isinstance(values, pd.Series):
+            values = pd.DataFrame(values)
+
+        if isinstance(values, pd.DataFrame):
+            if not (values.index.equals(pd.Index(self.index)) and values.columns.equals(pd.Index(self.symbols))):
+                values = values.reindex(index=self.index, columns=self.symbols)
+            arr = values.values
+        elif isinstance(values, (np.ndarray, CategoryBlock)):
+            arr = values
+        else:
+            raise ValueError("Data to be stored must be pandas or numpy format. But we have {}".format(type(values)))
+
+        if arr.shape != (len(self.index), len(self.symbols)):
+            raise ValueError("Shape of field [{}] is {}, not consistent with store {}".format(
+                field, arr.shape, (len(self.index), len(self.symbols))))
+
+        self._blocks[field] = arr if isinstance(arr, CategoryBlock) else _to_block(arr)
+
+    def set_values(self, field, values, rows=slice(None)):
+        """
+        Overwrite some rows of an existing field.
+
+        Parameters
+        ----------
+        field : str
+        values : np.ndarray
+            Shape must be consistent with rows.
+        rows : slice or np.ndarray, optional
+
+        """
+        block = self._get_block(field)
+        values = np.asarray(values)
+        if (isinstance(block, np.ndarray) and block.flags.writeable
+                and np.can_cast(values.dtype, block.dtype, casting='same_kind')):
+            block[rows] = values
+        else:
+            arr = self.get_values(field)
+            arr = np.array(arr, dtype=np.result_type(arr.dtype, values.dtype))
+            arr[rows] = values
+            self.set_field(field, arr)
+
+    def remove_field(self, field):
+        self._blocks.pop(field, None)
+
+    def append(self, other):
+        """
+        Append dates of another store after dates of this store.
+
+        Parameters
+        ----------
+        other : FieldStore
+            Its first date must be later than the last date of this store.
+            Symbols not in this store are dropped.
+
+        Returns
+        -------
+        FieldStore
+            Fields missing in one of the two stores are filled with NaN.
+
+        Notes
+        -----
+        All blocks of the new store are in memory, blocks memory-mapped from files are read as a whole.
+
+        """
+        if len(self.index) and len(other.index) and other.index[0] <= self.index[-1]:
+            raise ValueError("Dates to be appended must be later than {}".format(self.index[-1]))
+
+        store = FieldStore(np.concatenate([self.index, other.index]), self.symbols, index_name=self.index_name)
+        fields = self.fields + [f for f in other.fields if f not in self]
+        shape_old = (len(self.index), len(self.symbols))
+        shape_new = (len(other.index), len(self.symbols))
+        for field in fields:
+            if field in self:
+                arr_old = self.get_values(field)
+            else:
+                arr_old = np.full(shape_old, np.nan)
+            if field in other:
+                arr_new = other.get_frame(field, copy=False).reindex(columns=self.symbols).values
+            else:
+                arr_new = np.full(shape_new, np.nan)
+            store.set_field(field, np.concatenate([arr_old, arr_new], axis=0))
+        return store
+
+    def join(self, other):
+        """
+        Add symbols of another store: dates and symbols are unioned.
+
+        Parameters
+        ----------
+        other : FieldStore
+            Values of symbols already in this store are ignored.
+
+        Returns
+        -------
+        FieldStore
+            Values missing in one of the two stores are filled with NaN.
+
+        """
+        symbols_other = [s for s in other.symbols if s not in self._symbol_pos]
+        index = np.union1d(self.index, other.index)
+        symbols = sorted(set(self.symbols) | set(symbols_other))
+        store = FieldStore(index, symbols, index_name=self.index_name)
+        fields = self.fields + [f for f in other.fields if f not in self]
+        for field in fields:
+            frames = []
+            if field in self:
+                frames.append(self.get_frame(field, copy=False))
+            if field in other:
+                frames.append(other.get_frame(field, symbols=symbols_other, copy=False))
+            store.set_field(field, pd.concat(frames, axis=1))
+        return store
+
+    def update(self, other):
+        """
+        Combine with another store of the same symbols: dates are unioned and
+        non-NaN values of other overwrite values of this store.
+
+        Returns
+        -------
+        FieldStore
+
+        """
+        index = np.union1d(self.index, other.index)
+        store = FieldStore(index, self.symbols, index_name=self.index_name)
+        fields = self.fields + [f for f in other.fields if f not in self]
+        for field in fields:
+            if field not in other:
+                store.set_field(field, self.get_frame(field, copy=False))
+            elif field not in self:
+                store.set_field(field, other.get_frame(field, copy=False))
+            else:
+                df_other = other.get_frame(field, copy=False)
+                store.set_field(field, df_other.combine_first(self.get_frame(field, copy=False)))
+        return store
+
+    # --------------------------------------------------------------------------------------------------------
+    # Get
+    def get_values(self, field, rows=slice(None), cols=slice(None)):
+        """
+        Get values of a field as a 2-D np.ndarray.
+        Numeric blocks are returned as views when rows and cols are slices.
+
+        """
+        block = self._get_block(field)
+        if isinstance(block, CategoryBlock):
+            return block.decode(rows, cols)
+        if isinstance(cols, slice):
+            return block[rows, cols]
+        return block[rows][:, cols]
+
+    def get_frame(self, field, symbols=None, start_date=0, end_date=0, copy=True):
+        """
+        Get a single field as DataFrame.
+
+        Returns
+        -------
+        pd.DataFrame
+            Index is date, columns are symbols.
+
+        """
+        rows = self.row_slice(start_date, end_date)
+        cols = self.col_indexer(symbols)
+        arr = self.get_values(field, rows, cols)
+        if copy:
+            arr = arr.copy()
+        df = pd.DataFrame(data=arr, index=pd.Index(self.index[rows], name=self.index_name),
+                          columns=pd.Index(self._get_symbols(cols), name='symbol'))
+        return df
+
+    def get_row(self, date, symbols=None, fields=None):
+        """
+        Get values of fields on one date.
+
+        Returns
+        -------
+        pd.DataFrame or None
+            Index is symbol, columns are fields. None if date not in index.
+
+        """
+        pos = self.row_pos(date)
+        if pos < 0:
+            return None
+        if fields is None:
+            fields = self.fields
+        cols = self.col_indexer(symbols)
+        dic = OrderedDict()
+        for field in fields:
+            dic[field] = self.get_values(field, slice(pos, pos + 1), cols)[0]
+        df = pd.DataFrame(dic, index=self._get_symbols(cols), columns=fields)
+        return df
+
+    def to_frame(self, fields=None, symbols=None, start_date=0, end_date=0):
+        """
+        Materialize fields to a DataFrame with (symbol, field) MultiIndex columns,
+        which is the layout of DataView.data_d / data_q.
+
+        """
+        if fields is None:
+            fields = self.fields
+        fields = sorted(fields)
+        rows = self.row_slice(start_date, end_date)
+        cols = self.col_indexer(symbols)
+        symbols_arr = self._get_symbols(cols)
+        index = pd.Index(self.index[rows], name=self.index_name)
+
+        if not fields:
+            columns = pd.MultiIndex.from_product([[], []], names=['symbol', 'field'])
+            return pd.DataFrame(index=index, columns=columns)
+
+        dic = {field: pd.DataFrame(self.get_values(field, rows, cols), index=index, columns=symbols_arr)
+               for field in fields}
+        df = pd.concat(dic, axis=1, keys=fields, names=['field', 'symbol'])
+        df.columns = df.columns.swaplevel()
+        df = df.sort_index(axis=1)
+        return df
+
+    @classmethod
+    def from_frame(cls, df, symbols=None, index_name=None):
+        """
+        Build a FieldStore from a DataFrame with (symbol, field) MultiIndex columns.
+
+        """
+        if index_name is None:
+            index_name = df.index.name or 'trade_date'
+        if symbols is None:
+            symbols = df.columns.get_level_values(0).unique()
+        symbols = np.sort(np.asarray(symbols, dtype=object))
+        index = np.sort(df.index.values)
+        store = cls(index, symbols, index_name=index_name)
+
+        df = df.sort_index(axis=0)
+        fields = df.columns.get_level_values(1).unique()
+        for field in fields:
+            sub = df.xs(field, axis=1, level=1)
+            sub = sub.loc[:, ~sub.columns.duplicated()]
+            store.set_field(field, sub)
+        return store
+
+    def take(self, start_date=0, end_date=0, symbols=None, fields=None, readonly=False, copy=False):
+        """
+        Return a new FieldStore containing a subset of dates, symbols and fields.
+        Blocks are copied only when symbols are selected; a date range alone gives views.
+
+        Parameters
+        ----------
+        readonly : bool, optional
+            Mark numeric views read-only, so that set_values on the new store copies the field
+            instead of writing to memory shared with this store.
+        copy : bool, optional
+            Always copy blocks, so that the new store never shares memory with this store.
+
+        """
+        rows = self.row_slice(start_date, end_date)
+        cols = self.col_indexer(symbols)
+        if fields is None:
+            fields = self.fields
+        # a slice of symbols gives views, a list of symbols gives copies
+        copy = copy and isinstance(cols, slice)
+        store = FieldStore(self.index[rows], self._get_symbols(cols), index_name=self.index_name)
+        for field in fields:
+            block = self._get_block(field)
+            if isinstance(block, CategoryBlock):
+                block = block.take(rows, cols)
+                if copy:
+                    block = CategoryBlock(block.codes.copy(), block.categories)
+                store._blocks[field] = block
+                continue
+            elif isinstance(cols, slice):
+                block = block[rows, cols]
+                if copy:
+                    block = np.array(block)
+            else:
+                block = block[rows][:, cols]
+            if readonly:
+                block.flags.writeable = False
+            store._blocks[field] = block
+        return store
+
+    def copy(self):
+        store = FieldStore(self.index.copy(), self.symbols.copy(), index_name=self.index_name)
+        for field in self.fields:
+            block = self._get_block(field)
+            if isinstance(block, CategoryBlock):
+                store._blocks[field] = CategoryBlock(block.codes.copy(), block.categories)
+            else:
+                store._blocks[field] = np.array(block)
+        return store
+
+    # --------------------------------------------------------------------------------------------------------
+    # Disk I/O
+    def save(self, folder_path):
+        """
+        Save the store to a directory: axes, one .npy file per field and a JSON file of field list.
+        Field files are named 'field.<name>.npy' so that they never collide with files of axes and meta data.
+
+        Parameters
+        ----------
+        folder_path : str
+
+        """
+        meta_path = os.path.join(folder_path, 'fields.json')
+        jutil.create_dir(meta_path)
+
+        np.save(os.path.join(folder_path, 'index.npy'), self.index)
+        np.save(os.path.join(folder_path, 'symbols.npy'), self.symbols.astype(str))
+
+        category_fields = []
+        for field in self.fields:
+            block = self._get_block(field)
+            path = os.path.join(folder_path, FIELD_FILE_PREFIX + field)
+            if isinstance(block, CategoryBlock):
+                if isinstance(block.codes, np.memmap) and block.codes.filename == os.path.abspath(path + '.codes.npy'):
+                    category_fields.append(field)
+                    continue
+                np.save(path + '.codes.npy', block.codes)
+                np.save(path + '.categories.npy', block.categories, allow_pickle=True)
+                category_fields.append(field)
+            elif not (isinstance(block, np.memmap) and block.filename == os.path.abspath(path + '.npy')):
+                # a field memory-mapped from this very file is unchanged, overwriting it would break the map
+                np.save(path + '.npy', block)
+
+        meta = {'index_name': self.index_name,
+                'fields': self.fields,
+                'category_fields': category_fields,
+                'field_prefix': FIELD_FILE_PREFIX}
+        jutil.save_json(meta, meta_path)
+
+    @staticmethod
+    def is_store_dir(folder_path):
+        return os.path.exists(os.path.join(folder_path, 'fields.json'))
+
+    @classmethod
+    def load(cls, folder_path):
+        """
+        Open a store saved by FieldStore.save. No field data is read until it is accessed.
+
+        Parameters
+        ----------
+        folder_path : str
+
+        Returns
+        -------
+        FieldStore
+
+        """
+        meta = jutil.read_json(os.path.join(folder_path, 'fields.json'))
+        if not meta:
+            raise IOError("There is no field store under directory {}".format(folder_path))
+
+        index = np.load(os.path.join(folder_path, 'index.npy'))
+        symbols = np.load(os.path.join(folder_path, 'symbols.npy')).astype(object)
+        store = cls(index, symbols, index_name=meta['index_name'])
+
+        category_fields = set(meta['category_fields'])
+        # stores saved before field files were prefixed have no 'field_prefix'
+        prefix = meta.get('field_prefix', '')
+        for field in meta['fields']:
+            store._blocks[field] = _LazyBlock(os.path.join(folder_path, prefix + field),
+                                              is_category=field in category_fields)
+        return store
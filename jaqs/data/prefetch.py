@@ -0,0 +1,105 @@
+# encoding: utf-8
+"""
+BarPrefetcher downloads bars of coming trade dates on a thread pool while a backtest
+is processing the current date, and keeps them in memory as one array per column.
+
+"""
+from __future__ import print_function
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import pandas as pd
+
+
+def to_columns(df, sort_by=('date', 'time', 'symbol')):
+    """
+    Convert DataFrame of bars to {column name: np.ndarray} sorted by columns sort_by.
+    Return None if df is empty (or not a DataFrame, e.g. result of a failed query).
+
+    """
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return None
+    sort_by = [col for col in sort_by if col in df.columns]
+    if sort_by:
+        df = df.sort_values(sort_by)
+    return {col: df[col].values for col in df.columns}
+
+
+class BarPrefetcher(object):
+    """
+    Iterate (trade_date, columns) over trade dates, bars of later dates are queried in advance.
+
+    Parameters
+    ----------
+    fetch : callable
+        fetch(trade_date) returns pd.DataFrame of bars of that date (or None).
+        It is called in worker threads.
+    dates : array-like of int
+        Trade dates in simulation order.
+    look_ahead : int
+        Number of dates queried ahead of the current one. 0 queries each date when it is reached.
+    n_workers : int
+        Max number of concurrent queries.
+    sort_by : list of str
+        Columns by which bars of a date are sorted.
+
+    Notes
+    -----
+    columns is a dict {column name: np.ndarray}, or None if there is no bar on that date.
+    Memory holds at most look_ahead + 1 dates.
+
+    """
+    def __init__(self, fetch, dates, look_ahead=5, n_workers=4, sort_by=('date', 'time', 'symbol')):
+        self.fetch = fetch
+        self.dates = list(dates)
+        self.look_ahead = max(int(look_ahead), 0)
+        self.n_workers = max(int(n_workers), 1)
+        self.sort_by = list(sort_by)
+
+    def _load(self, date):
+        return to_columns(self.fetch(date), self.sort_by)
+
+    def __iter__(self):
+        if self.look_ahead == 0:
+            for date in self.dates:
+                yield date, self._load(date)
+            return
+
+        pool = ThreadPool(min(self.n_workers, self.look_ahead + 1))
+        pending = deque()
+        dates_iter = iter(self.dates)
+
+        def submit():
+            for date in dates_iter:
+                pending.append((date, pool.apply_async(self._load, (date,))))
+                return
+
+        try:
+            for _ in range(self.look_ahead + 1):
+                submit()
+            while pending:
+                date, async_result = pending.popleft()
+                submit()
+                yield date, async_result.get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @staticmethod
+    def split_by(columns, key='time'):
+        """
+        Split sorted columns into groups of equal key.
+
+        Returns
+        -------
+        list of tuple
+            (key value, start, end), rows of a group are [start, end).
+
+        """
+        values = columns[key]
+        if len(values) == 0:
+            return []
+        starts = np.concatenate([[0], np.flatnonzero(values[1:] != values[:-1]) + 1])
+        ends = np.append(starts[1:], len(values))
+        return [(values[s], s, e) for s, e in zip(starts, ends)]
@@ -23,11 +23,12 @@ from __future__ import division
 from __future__ import print_function
 
 import math
+from collections import OrderedDict
 
 import numpy as np
 import pandas as pd
 
-from jaqs.data.align import align
+from jaqs.data.align import AnnouncementIndex
 import jaqs.util.numeric as numeric
 from jaqs.util import rank_with_mask
 
@@ -246,6 +247,265 @@ class Token(object):
             return 'Invalid Token'
 
 
+class ExpressionPlan(object):
+    """
+    Optimized evaluation plan of one or many parsed expressions.
+
+    Token lists are compiled into a DAG whose nodes are deduplicated by structure,
+    so a sub-expression like Delta(close, 5) that appears several times, in one formula
+    or across formulas, is evaluated only once.
+    Element-wise operators run on raw np.ndarray when operands share the date / symbol axis
+    of the input data, results are wrapped into DataFrame only when passed to functions or returned.
+
+    Parameters
+    ----------
+    parser : Parser
+        Provides operators, functions and evaluation context (ann_dts, trade_dts, index_member).
+
+    Examples
+    --------
+    >>> parser = Parser()
+    >>> plan = parser.compile({'a': 'Rank(Delta(close, 5))', 'b': 'Delta(close, 5) / Ts_Sum(close, 20)'})
+    >>> res = plan.evaluate({'close': df_close})  # Delta(close, 5) is computed once
+
+    """
+    def __init__(self, parser):
+        self.parser = parser
+
+        self.outputs = OrderedDict()
+        self._nodes = []  # (kind, payload, children)
+        self._node_ids = dict()
+        self._n_consumers = []
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def add(self, name, expr):
+        """
+        Add a parsed expression to the plan.
+
+        Parameters
+        ----------
+        name : str
+            Key of result of this expression in the dict returned by evaluate.
+        expr : Expression or list of Token
+
+        """
+        tokens = expr.tokens if isinstance(expr, Expression) else expr
+        self.outputs[name] = self._compile(tokens)
+
+    def variables(self):
+        """Names of all variables (and functions used as variables) used by the plan."""
+        return [payload for kind, payload, _ in self._nodes if kind == 'var']
+
+    def _add_node(self, kind, payload, children=()):
+        key = (kind, payload, children)
+        node_id = self._node_ids.get(key)
+        if node_id is None:
+            node_id = len(self._nodes)
+            self._nodes.append(key)
+            self._node_ids[key] = node_id
+            self._n_consumers.append(0)
+            for child in children:
+                self._n_consumers[child] += 1
+        return node_id
+
+    def _compile(self, tokens):
+        stack = []
+        for item in tokens:
+            type_ = item.type_
+            if type_ == TNUMBER:
+                if isinstance(item.number_, list):
+                    # empty argument list of a nullary function call
+                    stack.append(self._add_node('list', None))
+                else:
+                    # type is part of the key so that 5 and 5.0 are not merged
+                    stack.append(self._add_node('num', (type(item.number_).__name__, item.number_)))
+            elif type_ == TVAR:
+                stack.append(self._add_node('var', item.index_))
+            elif type_ == TOP1:
+                n1 = stack.pop()
+                stack.append(self._add_node('op1', item.index_, (n1,)))
+            elif type_ == TOP2:
+                n2 = stack.pop()
+                n1 = stack.pop()
+                if item.index_ == ',':
+                    # argument list, flattened the same way as Parser.append
+                    kind, _, children = self._nodes[n1]
+                    args = children if kind == 'list' else (n1,)
+                    stack.append(self._add_node('list', None, args + (n2,)))
+                else:
+                    stack.append(self._add_node('op2', item.index_, (n1, n2)))
+            elif type_ == TFUNCALL:
+                n1 = stack.pop()
+                f = stack.pop()
+                stack.append(self._add_node('call', None, (f, n1)))
+            else:
+                raise Exception('invalid Expression')
+        if len(stack) != 1:
+            raise Exception('invalid Expression (parity)')
+        return stack[0]
+
+    # -----------------------------------------------------
+    # evaluate
+    def evaluate(self, values, ann_dts=None, trade_dts=None, index_member=None, ann_index=None):
+        """
+        Evaluate all expressions of the plan. Parameters are the same as Parser.evaluate.
+
+        Returns
+        -------
+        res : OrderedDict
+            {name: pd.DataFrame}
+
+        """
+        self.parser._set_context(ann_dts, trade_dts, index_member, ann_index)
+        values = values or {}
+        axis = self._get_axis(values, trade_dts)
+
+        output_ids = set(self.outputs.values())
+        n_remain = list(self._n_consumers)
+        results = dict()
+        for node_id, (kind, payload, children) in enumerate(self._nodes):
+            results[node_id] = self._evaluate_node(kind, payload, children, results, values, axis)
+            # release intermediate results as soon as all their consumers are done
+            for child in children:
+                n_remain[child] -= 1
+                if n_remain[child] == 0 and child not in output_ids:
+                    del results[child]
+
+        res = OrderedDict()
+        for name, node_id in self.outputs.items():
+            res[name] = self._to_frame(results[node_id], axis)
+        return res
+
+    @staticmethod
+    def _get_axis(values, trade_dts):
+        """Date / symbol axis shared by the element-wise array operations: the first daily DataFrame input."""
+        frames = [v for v in values.values() if isinstance(v, pd.DataFrame)]
+        if trade_dts is not None:
+            daily = [df for df in frames if len(df.index) == len(trade_dts)]
+            if daily:
+                frames = daily
+        if not frames:
+            return None
+        return frames[0].index, frames[0].columns
+
+    @staticmethod
+    def _to_frame(x, axis):
+        if isinstance(x, np.ndarray) and x.ndim == 2 and axis is not None:
+            return pd.DataFrame(data=x, index=axis[0], columns=axis[1])
+        return x
+
+    @staticmethod
+    def _to_array(x, axis):
+        """Raw numeric values of x if it is on axis, scalar itself if x is a number, otherwise None."""
+        if isinstance(x, np.ndarray):
+            return x
+        elif isinstance(x, (int, float, np.integer, np.floating)) and not isinstance(x, bool):
+            return x
+        elif isinstance(x, pd.DataFrame) and axis is not None:
+            index, columns = axis
+            if (x.shape == (len(index), len(columns))
+                    and (x.index is index or x.index.equals(index))
+                    and (x.columns is columns or x.columns.equals(columns))):
+                arr = x.values
+                if arr.dtype.kind in 'iuf':
+                    return arr
+        return None
+
+    def _evaluate_node(self, kind, payload, children, results, values, axis):
+        parser = self.parser
+        if kind == 'num':
+            return payload[1]
+        elif kind == 'var':
+            if payload in values:
+                return values[payload]
+            elif payload in parser.functions:
+                return parser.functions[payload]
+            else:
+                raise Exception('undefined variable: ' + payload)
+        elif kind == 'list':
+            return [self._to_frame(results[child], axis) for child in children]
+        elif kind == 'call':
+            f = results[children[0]]
+            n1 = results[children[1]]
+            if not callable(f):
+                raise Exception('{} is not a function'.format(f))
+            if self._nodes[children[1]][0] == 'list':
+                return f(*n1)
+            return f(self._to_frame(n1, axis))
+        elif kind == 'op1':
+            f = parser.ops1[payload]
+            n1 = results[children[0]]
+            arr = self._to_array(n1, axis)
+            if isinstance(arr, np.ndarray):
+                res = self._array_op1(f, arr)
+                if res is not None:
+                    return res
+            return f(self._to_frame(n1, axis))
+        elif kind == 'op2':
+            f = parser.ops2[payload]
+            n1, n2 = results[children[0]], results[children[1]]
+            arr1, arr2 = self._to_array(n1, axis), self._to_array(n2, axis)
+            if (arr1 is not None and arr2 is not None
+                    and (isinstance(arr1, np.ndarray) or isinstance(arr2, np.ndarray))):
+                res = self._array_op2(f, arr1, arr2)
+                if res is not None:
+                    return res
+            return f(self._to_frame(n1, axis), self._to_frame(n2, axis))
+        else:
+            raise Exception('invalid Expression')
+
+    def _array_op1(self, f, x):
+        """Array version of unary operators, None if f is not supported."""
+        parser = self.parser
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if f == parser.neg:
+                return -x
+            elif f == parser.logicalNot:
+                res = np.logical_not(x).astype(float)
+                res[np.isnan(x)] = np.nan
+                return res
+            elif isinstance(f, np.ufunc) or f is np.round:
+                return f(x)
+        return None
+
+    def _array_op2(self, f, a, b):
+        """Array version of binary operators, None if f is not supported."""
+        parser = self.parser
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            if f == parser.add:
+                return a + b
+            elif f == parser.sub:
+                return a - b
+            elif f == parser.mul:
+                return a * b
+            elif f == parser.div:
+                res = np.true_divide(a, b)
+                res[np.isinf(res)] = np.nan
+                return res
+            elif f == parser.mod:
+                return a % b
+            elif f is np.power:
+                return np.power(a, b)
+
+            logical_ops = {parser.equal: np.equal,
+                           parser.notEqual: np.not_equal,
+                           parser.greaterThan: np.greater,
+                           parser.lessThan: np.less,
+                           parser.greaterThanEqual: np.greater_equal,
+                           parser.lessThanEqual: np.less_equal,
+                           parser.andOperator: np.logical_and,
+                           parser.orOperator: np.logical_or}
+            func = logical_ops.get(f)
+            if func is not None:
+                mask = np.logical_or(np.isnan(a), np.isnan(b))
+                res = func(a, b).astype(float)
+                res[mask] = np.nan
+                return res
+        return None
+
+
 class Parser(object):
     def __init__(self):
         self.success = False
@@ -320,6 +580,8 @@ class Parser(object):
             'GroupPercentile': self.group_percentile,
             'Quantile': self.to_quantile,
             'GroupQuantile': self.group_quantile,
+            'GroupDemean': self.group_demean,
+            'GroupStandardize': self.group_standardize,
             'Rank': self.rank,
             'GroupRank': self.group_rank,
             'Mask': self.mask,
@@ -401,6 +663,10 @@ class Parser(object):
         
         self.ann_dts = None
         self.trade_dts = None
+        self.index_member = None
+        self.ann_index = None
+        
+        self.plan = None
     
     # -----------------------------------------------------
     # functions
@@ -578,13 +844,13 @@ class Parser(object):
         return r.mean()
     
     def std_dev(self, x, n):
-        return pd.rolling_std(x, n)
+        return x.rolling(n).std()
     
     def ts_sum(self, x, n):
         return x.rolling(n).sum()
     
     def count_nans(self, x, n):
-        return n - pd.rolling_count(x, n)
+        return n - x.rolling(n, min_periods=0).count()
     
     def delay(self, x, n):
         return x.shift(n)
@@ -602,57 +868,44 @@ class Parser(object):
         return res
     
     def ts_mean(self, x, n):
-        return pd.rolling_mean(x, n)
+        return x.rolling(n).mean()
     
     def ts_min(self, x, n):
-        return pd.rolling_min(x, n)
+        return x.rolling(n).min()
     
     def ts_max(self, x, n):
-        return pd.rolling_max(x, n)
+        return x.rolling(n).max()
     
     def ts_kurt(self, x, n):
-        return pd.rolling_kurt(x, n)
+        return x.rolling(n).kurt()
     
     def ts_skew(self, x, n):
-        return pd.rolling_skew(x, n)
+        return x.rolling(n).skew()
     
     def ts_product(self, x, n):
-        return pd.rolling_apply(x, n, np.product)
+        res = numeric.rolling_prod(x.values, n)
+        return pd.DataFrame(index=x.index, columns=x.columns, data=res)
     
     @staticmethod
     def ts_rank(df, window):
-        """Return a DataFrame with values ranging from 0.0 to 1.0"""
-        roll = df.rolling(window=window)
-    
-        def _rank_arr(arr, norm=1.0):
-            norm = norm * 1.0
-            ranks = np.argsort(np.argsort(arr))[-1] + 1
-            return ranks / norm
-    
-        res = roll.apply(_rank_arr)
-        return res
+        """Return a DataFrame with values ranging from 1 to window"""
+        res = numeric.rolling_rank(df.values, window)
+        return pd.DataFrame(index=df.index, columns=df.columns, data=res)
 
     @staticmethod
     def ts_percentile(df, window):
         """Return a DataFrame with values ranging from 0.0 to 1.0"""
-        roll = df.rolling(window=window)
-    
-        def _rank_arr(arr, norm=1.0):
-            norm = norm * 1.0
-            ranks = np.argsort(np.argsort(arr))[-1] + 1
-            return ranks / norm
-    
-        res = roll.apply(_rank_arr, kwargs={'norm': window})
-        return res
+        res = numeric.rolling_rank(df.values, window) / float(window)
+        return pd.DataFrame(index=df.index, columns=df.columns, data=res)
 
     # Time Series Two Parameters
     def corr(self, x, y, n):
         (x, y) = self._align_bivariate(x, y)
-        return pd.rolling_corr(x, y, n)
+        return x.rolling(n).corr(y)
 
     def cov(self, x, y, n):
         (x, y) = self._align_bivariate(x, y)
-        return pd.rolling_cov(x, y, n)
+        return x.rolling(n).cov(y)
 
     # financial statement data
     @staticmethod
@@ -689,10 +942,14 @@ class Parser(object):
         return np.dot(x, step) / np.sum(step)
     
     def decay_linear(self, x, n):
-        return pd.rolling_apply(x, n, self.decay_linear_array)
+        weights = np.arange(1, n + 1, dtype=float)
+        res = numeric.rolling_dot(x.values, weights / weights.sum())
+        return pd.DataFrame(index=x.index, columns=x.columns, data=res)
     
     def decay_exp(self, x, f, n):
-        return pd.rolling_apply(x, n, self.decay_exp_array, args=[f])
+        weights = np.power(f, np.arange(n - 1, -1, -1, dtype=float))
+        res = numeric.rolling_dot(x.values, weights / weights.sum())
+        return pd.DataFrame(index=x.index, columns=x.columns, data=res)
     
     @staticmethod
     def is_nan(df):
@@ -703,6 +960,7 @@ class Parser(object):
     
     @staticmethod
     def mask(df, mask):
+        df = df.copy()
         df[mask] = np.nan
         return df
         
@@ -733,9 +991,11 @@ class Parser(object):
     
     # -----------------------------------------------------
     # cross section functions
+    # Input DataFrames may be shared by several nodes of an ExpressionPlan, so they must not be modified in place.
     def _mask_non_index_member(self, df):
         if self.index_member is not None:
             self.index_member = self.index_member.astype(bool)
+            df = df.copy()
             df[~self.index_member] = np.nan
         return df
     
@@ -743,6 +1003,7 @@ class Parser(object):
     def _mask_df(df, mask):
         if mask is not None:
             mask = mask.astype(bool)
+            df = df.copy()
             df[~mask] = np.nan
         return df
 
@@ -765,44 +1026,43 @@ class Parser(object):
         return rank
     
     # TODO: all cross-section operations support in-group modification: neutral, extreme values, standardize.
-    def group_rank(self, df, group, mask=None):
+    @staticmethod
+    def _group_codes(df, group):
+        """Integer codes of group aligned to df, -1 for NaN."""
+        if not (group.index.equals(df.index) and group.columns.equals(df.columns)):
+            group = group.reindex(index=df.index, columns=df.columns)
+        codes, _ = pd.factorize(group.values.ravel())
+        return codes.reshape(group.shape)
+
+    def _group_apply(self, func, df, group, mask=None, **kwargs):
+        """Apply a jaqs.util.numeric group function on each cross section of df."""
         df = self._align_univariate(df)
         df = self._mask_non_index_member(df)
         df = self._mask_df(df, mask)
         
-        vals = np.unique(pd.Series(group.values.flatten()).dropna())
-        res = None
-        for val in vals:
-            mask = (group == val)
-            rank = rank_with_mask(df, mask=mask, axis=1, normalize=False)
-            if res is None:
-                res = rank
-            else:
-                res = res.fillna(rank)
-        return res
+        res = func(df.values.astype(float), self._group_codes(df, group), **kwargs)
+        return pd.DataFrame(index=df.index, columns=df.columns, data=res)
+
+    def group_rank(self, df, group, mask=None):
+        return self._group_apply(numeric.group_rank, df, group, mask=mask)
     
     def group_percentile(self, df, group, mask=None):
-        df = self._align_univariate(df)
-        df = self._mask_non_index_member(df)
-        df = self._mask_df(df, mask)
-        
-        vals = np.unique(pd.Series(group.values.flatten()).dropna())
-        res = None
-        for val in vals:
-            mask = (group == val)
-            rank = rank_with_mask(df, mask=mask, axis=1, normalize=True)
-            if res is None:
-                res = rank
-            else:
-                res = res.fillna(rank)
-        return res
+        """Return a DataFrame with values ranging from 0.0 to 1.0"""
+        return self._group_apply(numeric.group_rank, df, group, mask=mask, normalize=True)
     
-    def ts_quantile(self, df, window=3, n_quantiles=5):
-        roll = df.rolling(window=window)
+    def group_demean(self, df, group, mask=None):
+        """Subtract group mean on each cross section."""
+        return self._group_apply(numeric.group_demean, df, group, mask=mask)
     
-        func = lambda arr: numeric.quantilize_without_nan(arr, n_quantiles=n_quantiles, axis=0)[-1]
-        res = roll.apply(func)
-        return res
+    def group_standardize(self, df, group, mask=None):
+        """Standardize within group on each cross section."""
+        return self._group_apply(numeric.group_standardize, df, group, mask=mask)
+    
+    def ts_quantile(self, df, window=3, n_quantiles=5):
+        # same as quantilize_without_nan on each window: floor(rank / (window / n_quantiles)) + 1, rank from 0
+        rank = numeric.rolling_rank(df.values, window) - 1
+        res = np.floor(rank / (window * 1. / n_quantiles)) + 1.0
+        return pd.DataFrame(index=df.index, columns=df.columns, data=res)
     
     def to_quantile(self, df, n_quantiles=5, axis=1, mask=None):
         """
@@ -836,20 +1096,7 @@ class Parser(object):
         return res
 
     def group_quantile(self, df, group, n_quantiles=5, mask=None):
-        df = self._align_univariate(df)
-        df = self._mask_non_index_member(df)
-        df = self._mask_df(df, mask)
-
-
-        res = None
-        groups = np.unique(pd.Series(group.values.flatten()).dropna())
-        for val in groups:
-            val_res = self.to_quantile(df[group == val], n_quantiles=n_quantiles)
-            if res is None:
-                res = val_res
-            else:
-                res = res.fillna(val_res)
-        return res
+        return self._group_apply(numeric.group_quantilize, df, group, mask=mask, n_quantiles=n_quantiles)
 
     '''
         def group_apply(self, func, df_arg, *args, **kwargs):
@@ -932,7 +1179,7 @@ class Parser(object):
         df = self._mask_non_index_member(df)
 
         axis = 1
-        x = df.values
+        x = df.values.copy()
         
         median = np.nanmedian(x, axis=axis).reshape(-1, 1)
         diff = x - median
@@ -950,18 +1197,24 @@ class Parser(object):
     
     # -----------------------------------------------------
     # align functions
+    def _align(self, df):
+        """Expand quarterly df to trade_dts, announcement positions are computed only once per evaluation."""
+        if self.ann_index is None:
+            self.ann_index = AnnouncementIndex(self.ann_dts, self.trade_dts)
+        return self.ann_index.align(df)
+
     def _align_bivariate(self, df1, df2, force_align=False):
         if isinstance(df1, pd.DataFrame) and isinstance(df2, pd.DataFrame):
             len1 = len(df1.index)
             len2 = len(df2.index)
             if (self.ann_dts is not None) and (self.trade_dts is not None):
                 if len1 > len2:
-                    df2 = align(df2, self.ann_dts, self.trade_dts)
+                    df2 = self._align(df2)
                 elif len1 < len2:
-                    df1 = align(df1, self.ann_dts, self.trade_dts)
+                    df1 = self._align(df1)
                 elif force_align:
-                    df1 = align(df1, self.ann_dts, self.trade_dts)
-                    df2 = align(df2, self.ann_dts, self.trade_dts)
+                    df1 = self._align(df1)
+                    df2 = self._align(df2)
         return (df1, df2)
 
     def _align_univariate(self, df1):
@@ -970,7 +1223,7 @@ class Parser(object):
                 len1 = len(df1.index)
                 len2 = len(self.trade_dts)
                 if len1 != len2:
-                    return align(df1, self.ann_dts, self.trade_dts)
+                    return self._align(df1)
         return df1
 
     # -----------------------------------------------------
@@ -1161,9 +1414,40 @@ class Parser(object):
         if (noperators + 1) != len(tokenstack):
             self.error_parsing(self.pos, 'parity')
         self.tokens = tokenstack
-        return Expression(tokenstack, self.ops1, self.ops2, self.functions)
+        expr = Expression(tokenstack, self.ops1, self.ops2, self.functions)
+        self.plan = ExpressionPlan(self)
+        self.plan.add(None, expr)
+        return expr
+    
+    def compile(self, formulas):
+        """
+        Parse several formulas into one ExpressionPlan, sub-expressions shared by them are evaluated only once.
+        
+        Parameters
+        ----------
+        formulas : dict
+            {name: formula}. Use OrderedDict to keep order of results.
+
+        Returns
+        -------
+        ExpressionPlan
+
+        """
+        plan = ExpressionPlan(self)
+        for name, formula in formulas.items():
+            plan.add(name, self.parse(formula))
+        return plan
     
-    def evaluate(self, values, ann_dts=None, trade_dts=None, index_member=None):
+    def _set_context(self, ann_dts, trade_dts, index_member, ann_index):
+        self.ann_dts = ann_dts
+        self.trade_dts = trade_dts
+        self.index_member = index_member
+        if ann_index is not None and ann_dts is not None and trade_dts is not None \
+                and not ann_index.matches(ann_dts, trade_dts):
+            ann_index = None
+        self.ann_index = ann_index
+    
+    def evaluate(self, values, ann_dts=None, trade_dts=None, index_member=None, ann_index=None):
         """
         Evaluate the value of expression using. Data of different frequency will be automatically expanded.
         
@@ -1176,56 +1460,19 @@ class Parser(object):
         trade_dts : np.ndarray
             The date index of result.
         index_member : pd.DataFrame
+        ann_index : AnnouncementIndex, optional
+            Pre-computed announcement index of ann_dts and trade_dts. If None, it is built when first needed.
 
         Returns
         -------
         pd.DataFrame
 
         """
-        self.ann_dts = ann_dts
-        self.trade_dts = trade_dts
-        self.index_member = index_member
-        
-        values = values or {}
-        nstack = []
-        L = len(self.tokens)
-        for i in range(0, L):
-            item = self.tokens[i]
-            type_ = item.type_
-            if type_ == TNUMBER:
-                nstack.append(item.number_)
-            elif type_ == TOP2:
-                n2 = nstack.pop()
-                n1 = nstack.pop()
-                f = self.ops2[item.index_]
-                nstack.append(f(n1, n2))
-            elif type_ == TVAR:
-                if item.index_ in values:
-                    nstack.append(values[item.index_])
-                elif item.index_ in self.functions:
-                    nstack.append(self.functions[item.index_])
-                else:
-                    raise Exception('undefined variable: ' + item.index_)
-            elif type_ == TOP1:
-                n1 = nstack.pop()
-                f = self.ops1[item.index_]
-                nstack.append(f(n1))
-            elif type_ == TFUNCALL:
-                n1 = nstack.pop()
-                f = nstack.pop()
-                if callable(f):
-                    # FIXME: Should set value for factor if it is in list.
-                    if type(n1) is list:
-                        nstack.append(f(*n1))
-                    else:
-                        nstack.append(f(n1))  # call(f, n1)
-                else:
-                    raise Exception(f + ' is not a function')
-            else:
-                raise Exception('invalid Expression')
-        if len(nstack) > 1:
-            raise Exception('invalid Expression (parity)')
-        return nstack[0]
+        if self.plan is None:
+            self.plan = ExpressionPlan(self)
+            self.plan.add(None, self.tokens)
+        return self.plan.evaluate(values, ann_dts=ann_dts, trade_dts=trade_dts,
+                                  index_member=index_member, ann_index=ann_index)[None]
 
     # -----------------------------------------------------
     # Other
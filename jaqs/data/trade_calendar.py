@@ -0,0 +1,173 @@
+# encoding: utf-8
+"""
+TradingCalendar holds all trade dates in one sorted array and answers calendar queries
+(is trade date, next / last trade date, trade dates within a range) by binary search,
+so that calendar lookups in per-day loops do not need a query each.
+
+"""
+from __future__ import print_function
+import numpy as np
+
+
+class TradingCalendar(object):
+    """
+    Sorted array of trade dates.
+
+    Parameters
+    ----------
+    dates : array-like of int
+        Trade dates in format YYYYmmdd, need not be sorted or unique.
+
+    Attributes
+    ----------
+    dates : np.ndarray
+        Sorted unique trade dates, dtype = int.
+
+    Notes
+    -----
+    Queries beyond the first or last date of the calendar raise IndexError,
+    the same as querying dates not yet published by the data server.
+
+    """
+    def __init__(self, dates):
+        self.dates = np.unique(np.asarray(dates, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __contains__(self, date):
+        return self.is_trade_date(date)
+
+    def __repr__(self):
+        if len(self.dates) == 0:
+            return "TradingCalendar(empty)"
+        return "TradingCalendar({:d} dates, {:d} - {:d})".format(len(self.dates), self.start_date, self.end_date)
+
+    @property
+    def start_date(self):
+        return int(self.dates[0])
+
+    @property
+    def end_date(self):
+        return int(self.dates[-1])
+
+    # -----------------------------------------------------------------------------------
+    # Queries
+    def is_trade_date(self, date):
+        """
+        Check whether date is a trade date.
+
+        Parameters
+        ----------
+        date : int or array-like of int
+
+        Returns
+        -------
+        bool or np.ndarray of bool
+
+        """
+        idx = np.searchsorted(self.dates, date)
+        if len(self.dates) == 0:
+            found = np.zeros_like(idx, dtype=bool)
+        else:
+            found = self.dates[np.minimum(idx, len(self.dates) - 1)] == date
+        if np.ndim(found) == 0:
+            return bool(found)
+        return found
+
+    def get_trade_dates(self, start_date, end_date):
+        """
+        Get array of trade dates within [start_date, end_date].
+        Return zero size array if no trade dates within range.
+
+        Parameters
+        ----------
+        start_date : int
+        end_date : int
+
+        Returns
+        -------
+        np.ndarray
+            dtype = int
+
+        """
+        i = np.searchsorted(self.dates, start_date, side='left')
+        j = np.searchsorted(self.dates, end_date, side='right')
+        return self.dates[i:j]
+
+    def get_next_trade_date(self, date, n=1):
+        """
+        Get the n'th trade date after date.
+
+        Parameters
+        ----------
+        date : int
+        n : int, optional
+            1 for the next trade date.
+
+        Returns
+        -------
+        int
+
+        """
+        if n < 1:
+            raise ValueError("n must be positive, got {}".format(n))
+        idx = np.searchsorted(self.dates, date, side='right') + n - 1
+        return int(self.dates[idx])
+
+    def get_last_trade_date(self, date, n=1):
+        """
+        Get the n'th trade date before date.
+
+        Parameters
+        ----------
+        date : int
+        n : int, optional
+            1 for the last trade date.
+
+        Returns
+        -------
+        int
+
+        """
+        if n < 1:
+            raise ValueError("n must be positive, got {}".format(n))
+        idx = np.searchsorted(self.dates, date, side='left') - n
+        if idx < 0:
+            raise IndexError("no trade date {:d} days before {}".format(n, date))
+        return int(self.dates[idx])
+
+    def offset(self, date, n):
+        """
+        Move date by n trade dates.
+
+        Parameters
+        ----------
+        date : int
+            Need not be a trade date.
+        n : int
+            Positive for later dates, negative for earlier dates.
+            0 returns date itself if it is a trade date, otherwise the next trade date.
+
+        Returns
+        -------
+        int
+
+        """
+        if n > 0:
+            return self.get_next_trade_date(date, n)
+        elif n < 0:
+            return self.get_last_trade_date(date, -n)
+        else:
+            return int(self.dates[np.searchsorted(self.dates, date, side='left')])
+
+    # -----------------------------------------------------------------------------------
+    # Persistence
+    def save(self, path):
+        """Save trade dates to a .npy file."""
+        np.save(path, self.dates)
+
+    @classmethod
+    def load(cls, path):
+        """Load calendar saved by save."""
+        return cls(np.load(path))
@@ -341,7 +341,7 @@ class BaseAnalyzer(object):
     def portfolio_data(self):
         return self._portfolio_data
 
-    def initialize(self, data_api=None, dataview=None, file_folder='.'):
+    def initialize(self, data_api=None, dataview=None, file_folder='.', trades=None, configs=None):
         """
         Read trading records and configurations from file.
         Initialized various data for analysis, including:
@@ -354,6 +354,11 @@ class BaseAnalyzer(object):
         dataview : DataView
         file_folder : str or list of str
             Directory path where trades and configs are stored.
+        trades : pd.DataFrame or list of pd.DataFrame, optional
+            Trading records in memory, see BacktestInstance.get_trades_df.
+            If provided, file_folder is ignored and configs must be provided as well.
+        configs : dict or list of dict, optional
+            Configurations (props) of each backtest of trades.
 
         """
         if isinstance(file_folder, basestring):
@@ -362,6 +367,27 @@ class BaseAnalyzer(object):
         self.data_api = data_api
         self.dataview = dataview
         
+        if trades is not None:
+            if configs is None:
+                raise ValueError("configs must be provided together with trades.")
+            if isinstance(trades, pd.DataFrame):
+                trades = [trades]
+            if isinstance(configs, dict):
+                configs = [configs]
+            if len(trades) != len(configs):
+                raise ValueError("trades and configs must be of the same length.")
+            self.file_folder = []
+            trades_list = list(trades)
+            configs_list = [dict(c) for c in configs]
+            if any([df.empty for df in trades_list]):
+                raise TradeRecordEmptyError("No trade records found. Analysis stopped.")
+        else:
+            trades_list, configs_list = self._read_folders(file_folder)
+        
+        self._init_from_trades(trades_list, configs_list)
+    
+    def _read_folders(self, file_folder):
+        """Read trades.csv and configs.json under each folder."""
         type_map = {'task_id': str,
                     'entrust_no': str,
                     'entrust_action': str,
@@ -381,12 +407,19 @@ class BaseAnalyzer(object):
         if any([trades.empty for trades in trades_list]):
             raise TradeRecordEmptyError("No trade records found in your 'trades.csv' file. Analysis stopped.")
         
+        configs_list = []
+        for folder in self.file_folder:
+            with codecs.open(os.path.join(folder, 'configs.json'), 'r', encoding='utf-8') as f:
+                configs_list.append(json.load(f))
+        return trades_list, configs_list
+    
+    def _init_from_trades(self, trades_list, configs_list):
         # combine trades
         trades = pd.concat(trades_list, axis=0)
         trades = trades.sort_values(['trade_date', 'fill_time'])
         
         self._init_universe(trades.loc[:, 'symbol'].values)
-        self._init_configs(self.file_folder)
+        self._init_configs(configs_list)
         self._init_trades(trades)
         self._init_symbol_price()
         self._init_inst_data()
@@ -454,22 +487,17 @@ class BaseAnalyzer(object):
         """Return a set of securities."""
         self._universe = set(securities)
     
-    def _init_configs(self, folder_list):
+    def _init_configs(self, configs_list):
         """
-        Read configs from file and get some important items.
+        Combine configs and get some important items.
         
         Parameters
         ----------
-        folder_list : list of str
-            Directory path where configs.json is under.
+        configs_list : list of dict
+            Content of configs.json of each backtest.
 
         """
-        configs_list = []
         # TODO: support weight
-        for folder in folder_list:
-            with codecs.open(os.path.join(folder, 'configs.json'), 'r', encoding='utf-8') as f:
-                configs_list.append(json.load(f))
-                
         self._configs = configs_list[0]
         
         self._configs['start_date'] = min([c['start_date'] for c in configs_list])
@@ -702,7 +730,9 @@ class BaseAnalyzer(object):
         self._build_holding_data()
         self._build_portfolio_data()
 
-        self.save_data()
+        # trades analyzed in memory have no folder to save to
+        if self.file_folder:
+            self.save_data()
 
         print(" finished! ")
 
@@ -1063,9 +1093,9 @@ class EventAnalyzer(BaseAnalyzer):
         self.position_change = None  # OrderedDict
         self.account = None  # OrderedDict
         
-    def initialize(self, data_server_=None, dataview=None, file_folder='.'):
+    def initialize(self, data_server_=None, dataview=None, file_folder='.', trades=None, configs=None):
         super(EventAnalyzer, self).initialize(data_api=data_server_, dataview=dataview,
-                                              file_folder=file_folder)
+                                              file_folder=file_folder, trades=trades, configs=configs)
         if self.dataview is not None and self.dataview.data_benchmark is not None:
             self.data_benchmark = self.dataview.data_benchmark.loc[(self.dataview.data_benchmark.index >= self.start_date)
                                                                    &(self.dataview.data_benchmark.index <= self.end_date)]
@@ -1092,9 +1122,9 @@ class AlphaAnalyzer(BaseAnalyzer):
         
         self.data_benchmark = None
 
-    def initialize(self, data_api=None, dataview=None, file_folder='.'):
+    def initialize(self, data_api=None, dataview=None, file_folder='.', trades=None, configs=None):
         super(AlphaAnalyzer, self).initialize(data_api=data_api, dataview=dataview,
-                                              file_folder=file_folder)
+                                              file_folder=file_folder, trades=trades, configs=configs)
         if self.dataview is not None and self.dataview.data_benchmark is not None:
             self.data_benchmark = self.dataview.data_benchmark.loc[(self.dataview.data_benchmark.index >= self.start_date)
                                                                    &(self.dataview.data_benchmark.index <= self.end_date)]
@@ -18,6 +18,10 @@ import datetime as dt
 from jaqs.trade import common
 from jaqs.data.basic import Bar
 from jaqs.data.basic import Trade
+from jaqs.data.prefetch import BarPrefetcher, to_columns
+from jaqs.data.trade_calendar import TradingCalendar
+from jaqs.trade.corporate_action import CorporateActionLedger, adjustments_to_df
+from jaqs.trade.tradegateway import fills_to_df
 import jaqs.util as jutil
 from functools import reduce
 
@@ -60,6 +64,8 @@ class BacktestInstance(six.with_metaclass(abc.ABCMeta)):
         Running context of the backtest.
     props : dict
         props store configurations (settings) of the backtest. Eg: start_date.
+    ledger : CorporateActionLedger
+        Corporate actions during the backtest.
     
     """
     def __init__(self):
@@ -71,6 +77,7 @@ class BacktestInstance(six.with_metaclass(abc.ABCMeta)):
         self.props = None
         
         self.ctx = None
+        self.ledger = None
 
         self.commission_rate = 20E-4
 
@@ -114,6 +121,76 @@ class BacktestInstance(six.with_metaclass(abc.ABCMeta)):
             if obj is not None:
                 obj.init_from_config(props)
 
+    def get_trades_df(self):
+        """
+        Trading records of the portfolio manager in the format of trades.csv,
+        so that results can be analyzed without being saved.
+        Fills of batch orders and adjustment records of corporate actions are included,
+        sorted by trade_date and fill_time.
+
+        Returns
+        -------
+        pd.DataFrame
+
+        """
+        trades = self.ctx.pm.trades
+
+        type_map = {'task_id': str,
+                    'entrust_no': str,
+                    'entrust_action': str,
+                    'symbol': str,
+                    'fill_price': float,
+                    'fill_size': float,
+                    'fill_date': np.integer,
+                    'fill_time': np.integer,
+                    'fill_no': str,
+                    'commission': float,
+                    'trade_date': np.integer}
+        # keys = trades[0].__dict__.keys()
+        ser_list = dict()
+        for key in type_map.keys():
+            v = [t.__getattribute__(key) for t in trades]
+            ser = pd.Series(data=v, index=None, dtype=type_map[key], name=key)
+            ser_list[key] = ser
+        df_trades = pd.DataFrame(ser_list)
+        
+        pm = self.ctx.pm
+        df_list = [df_trades]
+        if pm.fills:
+            df_list.append(fills_to_df(np.concatenate(pm.fills)))
+        if pm.adjustments:
+            df_list.append(adjustments_to_df(np.concatenate(pm.adjustments)))
+        if len(df_list) > 1:
+            df_trades = pd.concat([df.loc[:, df_trades.columns] for df in df_list], axis=0, ignore_index=True)
+            df_trades = df_trades.sort_values(['trade_date', 'fill_time'], kind='mergesort')
+            df_trades = df_trades.reset_index(drop=True)
+        df_trades.index.name = 'index'
+        return df_trades
+    
+    def apply_corporate_actions(self, start_date, end_date, fill_date=None):
+        """
+        Adjust positions of the portfolio manager for corporate actions in the ledger
+        after start_date and no later than end_date.
+        
+        Parameters
+        ----------
+        start_date : int
+        end_date : int
+        fill_date : int, optional
+            See CorporateActionLedger.get_adjustments.
+
+        Returns
+        -------
+        np.ndarray
+            Adjustment records applied.
+
+        """
+        pm = self.ctx.pm
+        positions = {symbol: pm.get_pos(symbol) for symbol in pm.holding_securities}
+        records = self.ledger.get_adjustments(start_date, end_date, positions, fill_date=fill_date)
+        pm.apply_adjustments(records)
+        return records
+
 
 
 '''
@@ -251,10 +328,16 @@ class AlphaBacktestInstance(BacktestInstance):
 
         self.univ_price_dic = {}
         self.tmp_univ_price_dic_map = {}
+        # trade dates of the dataview, see _get_calendar
+        self._calendar = None
 
     def init_from_config(self, props):
         super(AlphaBacktestInstance, self).init_from_config(props)
         strategy = self.ctx.strategy
+        
+        self.ledger = CorporateActionLedger.from_dataview(self.ctx.dataview, self.start_date, self.end_date,
+                                                          split_time=self.POSITION_ADJUST_TIME,
+                                                          delist_time=self.DELIST_ADJUST_TIME)
 
         # universe = props.get('universe', "")
         # symbol = props.get('symbol', "")
@@ -266,85 +349,18 @@ class AlphaBacktestInstance(BacktestInstance):
     def position_adjust(self):
         """
         adjust happens after market close
-        Before each re-balance day, adjust for all dividend and cash paid actions during the last period.
+        Before each re-balance day, adjust for all dividend, cash paid and de-list actions during the last period.
         We assume all cash will be re-invested.
         Since we adjust our position at next re-balance day, PnL before that may be incorrect.
+        De-listed positions are closed at close price of their last trade date, and the cash is added to strategy.
 
         """
         start = self.last_rebalance_date  # start will be one day later
         end = self.current_rebalance_date  # end is the same to ensure position adjusted for dividend on rebalance day
-        df_adj = self.ctx.dataview.get_ts('_daily_adjust_factor', start_date=start, end_date=end)
-
-        # FIXME: the first day should have been balanced before?
-        df_adj = df_adj[1:]
+        records = self.apply_corporate_actions(start, end)
 
-        pm = self.ctx.pm
-
-        # Find symbols which has adj_factor not equaling 1
-        tmp = df_adj[df_adj!=1].fillna(0.0).sum()
-        adj_symbols = set(tmp[tmp!=0].index).intersection(pm.holding_securities)
-
-        #for symbol in pm.holding_securities:
-
-        for symbol in adj_symbols:
-            ser = df_adj.loc[:, symbol]
-            ser_adj = ser.dropna()
-            for date, ratio in ser_adj.iteritems():
-                pos_old = pm.get_position(symbol).current_size
-                # TODO pos will become float, original: int
-                pos_new = pos_old * ratio
-                pos_diff = pos_new - pos_old  # must be positive
-                if pos_diff <= 0:
-                    # TODO this is possible
-                    # raise ValueError("pos_diff <= 0")
-                    continue
-                
-                trade_ind = Trade()
-                trade_ind.symbol = symbol
-                trade_ind.task_id = self.POSITION_ADJUST_NO
-                trade_ind.entrust_no = self.POSITION_ADJUST_NO
-                trade_ind.entrust_action = common.ORDER_ACTION.BUY  # for now only BUY
-                trade_ind.set_fill_info(price=0.0, size=pos_diff,
-                                        date=date, time=200000,
-                                        no=self.POSITION_ADJUST_NO,
-                                        trade_date=date)
-                
-                self.ctx.strategy.on_trade(trade_ind)
-
-    def delist_adjust(self):
-        df_inst = self.ctx.dataview.data_inst
-
-        start = self.last_rebalance_date  # start will be one day later
-        end = self.current_rebalance_date  # end is the same to ensure position adjusted for dividend on rebalance day
-        
-        mask = np.logical_and(df_inst['delist_date'] >= start, df_inst['delist_date'] <= end)
-        dic_inst = df_inst.loc[mask, :].to_dict(orient='index')
-        
-        if not dic_inst:
-            return
-        pm = self.ctx.pm
-        for symbol in pm.holding_securities.copy():
-            value_dic = dic_inst.get(symbol, None)
-            if value_dic is None:
-                continue
-            pos = pm.get_position(symbol).current_size
-            last_trade_date = self._get_last_trade_date(value_dic['delist_date'])
-            last_close_price = self.ctx.dataview.get_snapshot(last_trade_date, symbol=symbol, fields='close')
-            last_close_price = last_close_price.at[symbol, 'close']
-            
-            trade_ind = Trade()
-            trade_ind.symbol = symbol
-            trade_ind.task_id = self.DELIST_ADJUST_NO
-            trade_ind.entrust_no = self.DELIST_ADJUST_NO
-            trade_ind.entrust_action = common.ORDER_ACTION.SELL  # for now only BUY
-            trade_ind.set_fill_info(price=last_close_price, size=pos,
-                                    date=last_trade_date, time=150000,
-                                    no=self.DELIST_ADJUST_NO,
-                                    trade_date=last_trade_date)
-
-            self.ctx.strategy.cash += trade_ind.fill_price * trade_ind.fill_size
-            #self.ctx.pm.cash += trade_ind.fill_price * trade_ind.fill_size
-            self.ctx.strategy.on_trade(trade_ind)
+        mask = records['fill_no'] == self.DELIST_ADJUST_NO
+        self.ctx.strategy.cash += np.sum(records['fill_price'][mask] * records['fill_size'][mask])
 
     def re_balance_plan_before_open(self):
         """
@@ -357,18 +373,14 @@ class AlphaBacktestInstance(BacktestInstance):
         """
         # Step.1 set weights of those non-index-members to zero
         # only filter index members when universe is defined
-        universe_list = self.ctx.universe
-        if self.ctx.dataview.universe:
-            df_is_member = self.ctx.dataview.get_snapshot(self.ctx.trade_date, fields='index_member')
-            df_is_member = df_is_member.fillna(0).astype(bool)
-            universe_list = df_is_member[df_is_member['index_member']].index.values
-
         # Step.2 filter out those not listed or already de-listed
-        df_inst = self.ctx.dataview.data_inst
-        mask = np.logical_and(self.ctx.trade_date > df_inst['list_date'],
-                              self.ctx.trade_date < df_inst['delist_date'])
-        listing_symbols = df_inst.loc[mask, :].index.values
-        universe_list = np.intersect1d(universe_list, listing_symbols)
+        # both are read from status matrices precomputed by DataView
+        dataview = self.ctx.dataview
+        if dataview.universe:
+            universe_list = dataview.get_status_symbols(self.ctx.trade_date, 'index_member,listed')
+        else:
+            listing_symbols = dataview.get_status_symbols(self.ctx.trade_date, 'listed')
+            universe_list = np.intersect1d(self.ctx.universe, listing_symbols)
         
         # step.3 construct portfolio using models
         self.ctx.strategy.portfolio_construction(universe_list)
@@ -433,9 +445,7 @@ class AlphaBacktestInstance(BacktestInstance):
             if tapi.match_finished:
                 # Step1.
                 # position adjust according to dividend, cash paid, de-list actions during the last period
-                # two adjust must in order
                 self.position_adjust()
-                self.delist_adjust()
 
                 # Step2.
                 # plan re-balance before market open of the re-balance day:
@@ -464,6 +474,9 @@ class AlphaBacktestInstance(BacktestInstance):
             for trade_ind, order_status_ind in results:
                 self.ctx.strategy.cash -= trade_ind.commission
                 #self.ctx.pm.cash -= trade_ind.commission
+            if tapi.batch_fill:
+                fills = tapi.match_batch(self.ctx.snapshot)
+                self.ctx.strategy.cash -= np.sum(fills['commission'])
                 
             self.on_after_market_close()
 
@@ -473,8 +486,9 @@ class AlphaBacktestInstance(BacktestInstance):
                 break
 
         used_time = (dt.datetime.now() - begin_time).total_seconds()
+        n_trades = len(self.ctx.pm.trades) + sum([len(fills) for fills in self.ctx.pm.fills])
         print("Backtest done. {0:d} days, {1:.2e} trades in total. used time: {2}s".
-              format(len(self.ctx.dataview.dates), len(self.ctx.pm.trades), used_time))
+              format(len(self.ctx.dataview.dates), n_trades, used_time))
 
         jutil.prof_print()
     
@@ -511,6 +525,15 @@ class AlphaBacktestInstance(BacktestInstance):
         else:
             return self.ctx.data_api.query_last_trade_date(date)
     
+    def _get_calendar(self):
+        """TradingCalendar of the same trade dates as _is_trade_date and _get_next_trade_date."""
+        if self.ctx.dataview is not None:
+            if self._calendar is None:
+                self._calendar = TradingCalendar(self.ctx.dataview.dates)
+            return self._calendar
+        else:
+            return self.ctx.data_api.calendar
+    
     def go_next_rebalance_day(self):
         """
         update self.ctx.trade_date and last_date.
@@ -530,10 +553,14 @@ class AlphaBacktestInstance(BacktestInstance):
                 except IndexError:
                     return True
             else:
-                # use natural week/month
-                next_period_day = jutil.get_next_period_day(current_date, self.ctx.strategy.period,
-                                                            n=self.ctx.strategy.n_periods,
-                                                            extra_offset=self.ctx.strategy.days_delay)
+                # use natural week/month, days_delay is counted in trade dates
+                try:
+                    next_period_day = jutil.get_next_period_day(current_date, self.ctx.strategy.period,
+                                                                n=self.ctx.strategy.n_periods,
+                                                                extra_offset=self.ctx.strategy.days_delay,
+                                                                calendar=self._get_calendar())
+                except IndexError:
+                    return True
                 # update current_date: next_period_day is a workday, but not necessarily a trade date
                 if self._is_trade_date(next_period_day):
                     current_date = next_period_day
@@ -564,17 +591,12 @@ class AlphaBacktestInstance(BacktestInstance):
         return False
     
     def get_suspensions(self):
-        trade_status = self.ctx.dataview.get_snapshot(self.ctx.trade_date, fields='trade_status')
-        trade_status = trade_status.loc[:, 'trade_status']
         # trade_status: {'N', 'XD', 'XR', 'DR', 'JiaoYi', 'TingPai', NUll (before 2003)}
-        mask_sus = trade_status == '停牌'
-        return list(trade_status.loc[mask_sus].index.values)
+        return list(self.ctx.dataview.get_status_symbols(self.ctx.trade_date, 'suspended'))
 
     def get_limit_reaches(self):
         # TODO: 10% is not the absolute value to check limit reach
-        df = self.ctx.dataview.get_snapshot(self.ctx.trade_date, fields="_limit")
-        df = df[df > 9.5E-2].dropna()
-        return df.index.values
+        return self.ctx.dataview.get_status_symbols(self.ctx.trade_date, 'limit_reached')
     
     def on_new_day(self, date):
         # self.ctx.strategy.on_new_day(date)
@@ -593,30 +615,9 @@ class AlphaBacktestInstance(BacktestInstance):
 
     def save_results(self, folder_path='.'):
         import os
-        import pandas as pd
         folder_path = os.path.abspath(folder_path)
     
-        trades = self.ctx.pm.trades
-    
-        type_map = {'task_id': str,
-                    'entrust_no': str,
-                    'entrust_action': str,
-                    'symbol': str,
-                    'fill_price': float,
-                    'fill_size': float,
-                    'fill_date': np.integer,
-                    'fill_time': np.integer,
-                    'fill_no': str,
-                    'commission': float,
-                    'trade_date': np.integer}
-        # keys = trades[0].__dict__.keys()
-        ser_list = dict()
-        for key in type_map.keys():
-            v = [t.__getattribute__(key) for t in trades]
-            ser = pd.Series(data=v, index=None, dtype=type_map[key], name=key)
-            ser_list[key] = ser
-        df_trades = pd.DataFrame(ser_list)
-        df_trades.index.name = 'index'
+        df_trades = self.get_trades_df()
     
         trades_fn = os.path.join(folder_path, 'trades.csv')
         configs_fn = os.path.join(folder_path, 'configs.json')
@@ -647,6 +648,10 @@ class EventBacktestInstance(BacktestInstance):
     ----------
     bar_type : str
         {'1d', '1M', '5M', etc.}
+    bar_look_ahead : int
+        Number of trade dates whose bars are queried ahead of the simulation (minute bars only).
+    bar_query_concurrency : int
+        Max number of concurrent bar queries.
     
     """
     def __init__(self):
@@ -654,11 +659,15 @@ class EventBacktestInstance(BacktestInstance):
         
         self.bar_type = ""
         self.df_dividend = None
+        self.bar_look_ahead = 5
+        self.bar_query_concurrency = 4
         
     def init_from_config(self, props):
         super(EventBacktestInstance, self).init_from_config(props)
         
         self.bar_type = props.get("bar_type", "1d")
+        self.bar_look_ahead = props.get("bar_look_ahead", self.bar_look_ahead)
+        self.bar_query_concurrency = props.get("bar_query_concurrency", self.bar_query_concurrency)
     
     def _get_dividend_info(self):
         """
@@ -671,48 +680,16 @@ class EventBacktestInstance(BacktestInstance):
             df.loc[:, 'shares'] = (df['share_ratio'] + df['share_trans_ratio']) # / 10.0
             df.loc[:, 'cash_tax'] = df['cash_tax'] # / 10.0
             self.df_dividend = df
+            self.ledger = CorporateActionLedger.from_dividend(df, time=60000)
         else:
             # TODO
             pass
         
     def settle_for_stocks(self, last_date, date):
-        if self.df_dividend is None:
+        """Adjust positions for dividends with exdiv_date after last_date and no later than date."""
+        if self.ledger is None:
             return
-        
-        df = self.df_dividend.loc[(self.df_dividend['exdiv_date'] > last_date) & (self.df_dividend['exdiv_date'] <= date)]
-        if df.empty:
-            return
-        df2 = df.set_index('symbol')
-        for symbol in df2.index:
-            if symbol in self.ctx.pm.holding_securities:
-                df_symbol = df2.loc[symbol]
-                shares_ratio = df_symbol['shares']
-                cash_ratio = df_symbol['cash_tax']
-                pos = self.ctx.pm.get_position(symbol).current_size
-                
-                if cash_ratio > 0:
-                    cash_added = cash_ratio * pos
-                    #self.ctx.pm.cash += cash_added
-                    trade_ind1, trade_ind2 = generate_cash_trade_ind(symbol, cash_added, date, 60000)
-                    self.ctx.strategy.on_trade(trade_ind1)
-                    self.ctx.strategy.on_trade(trade_ind2)
-                    
-                if shares_ratio > 0:
-                    pos_diff = abs(pos * shares_ratio)
-                    trade_ind = Trade()
-                    trade_ind.symbol = symbol
-                    trade_ind.task_id = self.POSITION_ADJUST_NO
-                    trade_ind.entrust_no = self.POSITION_ADJUST_NO
-                    if pos > 0:
-                        trade_ind.entrust_action = common.ORDER_ACTION.BUY
-                    else:
-                        trade_ind.entrust_action = common.ORDER_ACTION.SELL
-                    trade_ind.set_fill_info(price=0.0, size=pos_diff,
-                                            date=date, time=60000,
-                                            no=self.POSITION_ADJUST_NO,
-                                            trade_date=date)
-                    
-                    self.ctx.strategy.on_trade(trade_ind)
+        self.apply_corporate_actions(last_date, date, fill_date=date)
             
     def on_new_day(self, date):
         self.ctx.trade_date = date
@@ -755,7 +732,7 @@ class EventBacktestInstance(BacktestInstance):
         
         return df_quotes
             
-    def _create_time_symbol_bars(self, date):
+    def _create_time_symbol_bars(self, date, columns=None):
         """
         Given a trade date, query bars of all symbols on that day and return a nested dict.
         
@@ -763,6 +740,8 @@ class EventBacktestInstance(BacktestInstance):
         ----------
         date : int
             Trade date.
+        columns : dict, optional
+            Bars of that day already queried, {column name: np.ndarray} sorted by date, time and symbol.
 
         Returns
         -------
@@ -770,17 +749,17 @@ class EventBacktestInstance(BacktestInstance):
             Three-element tuple: (trade_date, time, dict of quote)
 
         """
-        # query quotes data
-        symbols_str = ','.join(self.ctx.universe)
-        df_quotes = self._get_df_bar(symbols_str, date)
-        if df_quotes is None or df_quotes.empty:
+        if columns is None:
+            # query quotes data
+            symbols_str = ','.join(self.ctx.universe)
+            columns = to_columns(self._get_df_bar(symbols_str, date))
+        if columns is None:
             return dict()
     
         # create nested dict
-        df_quotes = df_quotes.sort_values(['date', 'time', 'symbol'])
         res = []
-        for time, df in df_quotes.groupby(by=['time'], sort=False):
-            quotes_list = Bar.create_from_df(df)
+        for time, start, end in BarPrefetcher.split_by(columns, 'time'):
+            quotes_list = Bar.create_from_columns(columns, start, end)
             dic = {quote.symbol: quote for quote in quotes_list}
             res.append((time, dic))
         return res
@@ -788,13 +767,19 @@ class EventBacktestInstance(BacktestInstance):
     def _run_bar(self):
         """Quotes of different symbols will be aligned into one dictionary."""
         trade_dates_arr = self.ctx.data_api.query_trade_dates(self.start_date, self.end_date)
+        
+        symbols_str = ','.join(self.ctx.universe)
+        # bars are read from dataview in the main thread, queried from data_api ahead of the simulation
+        look_ahead = 0 if self.ctx.dataview is not None else self.bar_look_ahead
+        prefetcher = BarPrefetcher(lambda date: self._get_df_bar(symbols_str, date), trade_dates_arr,
+                                   look_ahead=look_ahead, n_workers=self.bar_query_concurrency)
 
         last_trade_date = trade_dates_arr[0]
-        for trade_date in trade_dates_arr:
+        for trade_date, columns in prefetcher:
             self.settle_for_stocks(last_trade_date, trade_date)
             self.on_new_day(trade_date)
             
-            list_of_quotes_tuples = self._create_time_symbol_bars(trade_date)
+            list_of_quotes_tuples = self._create_time_symbol_bars(trade_date, columns)
             for time, quotes_dic in list_of_quotes_tuples:
                 self._process_quote_bar(quotes_dic)
             
@@ -911,30 +896,9 @@ class EventBacktestInstance(BacktestInstance):
         
     def save_results(self, folder_path='.'):
         import os
-        import pandas as pd
         folder_path = os.path.abspath(folder_path)
     
-        trades = self.ctx.pm.trades
-    
-        type_map = {'task_id': str,
-                    'entrust_no': str,
-                    'entrust_action': str,
-                    'symbol': str,
-                    'fill_price': float,
-                    'fill_size': float,
-                    'fill_date': np.integer,
-                    'fill_time': np.integer,
-                    'fill_no': str,
-                    'commission': float,
-                    'trade_date': np.integer}
-        # keys = trades[0].__dict__.keys()
-        ser_list = dict()
-        for key in type_map.keys():
-            v = [t.__getattribute__(key) for t in trades]
-            ser = pd.Series(data=v, index=None, dtype=type_map[key], name=key)
-            ser_list[key] = ser
-        df_trades = pd.DataFrame(ser_list)
-        df_trades.index.name = 'index'
+        df_trades = self.get_trades_df()
     
         trades_fn = os.path.join(folder_path, 'trades.csv')
         configs_fn = os.path.join(folder_path, 'configs.json')
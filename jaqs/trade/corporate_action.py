@@ -0,0 +1,289 @@
+# encoding: utf-8
+"""
+CorporateActionLedger holds the corporate actions of a backtest window (share dividends
+and splits, cash dividends, delistings) as arrays sorted by date. All actions between
+two dates are found by binary search and turned into adjustment records of held
+positions in one step.
+
+Adjustment records are rows of a numpy structured array (see ADJUSTMENT_DTYPE) instead
+of Trade objects. PortfolioManager.apply_adjustments updates positions and cash from
+them, BacktestInstance.get_trades_df lists them among trades with the same task_id,
+entrust_no and fill_no as before, so analysis of trades is not changed.
+
+"""
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+from jaqs.trade import common
+
+
+POSITION_ADJUST_NO = 101010
+DELIST_ADJUST_NO = 202020
+CASH_ADJUST_NO = 0
+
+ADJUSTMENT_DTYPE = np.dtype([(str('symbol'), object),
+                             (str('entrust_action'), object),
+                             (str('fill_price'), np.float64),
+                             (str('fill_size'), np.float64),
+                             (str('fill_date'), np.int64),
+                             (str('fill_time'), np.int64),
+                             (str('fill_no'), np.int64)])
+
+
+def adjustments_to_df(records):
+    """
+    Adjustment records in the format of trades.csv.
+
+    Parameters
+    ----------
+    records : np.ndarray of ADJUSTMENT_DTYPE
+
+    Returns
+    -------
+    pd.DataFrame
+        task_id, entrust_no and fill_no are all the adjustment number, commission is 0.
+
+    """
+    no = records['fill_no'].astype(str)
+    return pd.DataFrame({'task_id': no,
+                         'entrust_no': no,
+                         'entrust_action': records['entrust_action'],
+                         'symbol': records['symbol'].astype(str),
+                         'fill_price': records['fill_price'],
+                         'fill_size': records['fill_size'],
+                         'fill_date': records['fill_date'],
+                         'fill_time': records['fill_time'],
+                         'fill_no': no,
+                         'commission': np.zeros(len(records)),
+                         'trade_date': records['fill_date']})
+
+
+class CorporateActionLedger(object):
+    """
+    Corporate actions sorted by date, then by kind (CASH, SPLIT, DELIST) on the same date.
+
+    Parameters
+    ----------
+    dates : array-like of int
+        Dates when actions take effect.
+    symbols : array-like of str
+    kinds : array-like of int
+        CASH, SPLIT or DELIST.
+    values : array-like of float
+        Cash per share for CASH, position ratio after / before for SPLIT,
+        price at which position is closed for DELIST.
+    fill_dates : array-like of int, optional
+        Dates of adjustment records, dates by default.
+    fill_times : array-like of int, optional
+        Times of adjustment records, 0 by default.
+
+    Attributes
+    ----------
+    dates, symbols, kinds, values, fill_dates, fill_times : np.ndarray
+
+    """
+    CASH = 0
+    SPLIT = 1
+    DELIST = 2
+
+    def __init__(self, dates, symbols, kinds, values, fill_dates=None, fill_times=None):
+        dates = np.asarray(dates, dtype=np.int64)
+        kinds = np.asarray(kinds, dtype=np.int64)
+        if fill_dates is None:
+            fill_dates = dates
+        if fill_times is None:
+            fill_times = np.zeros_like(dates)
+
+        order = np.lexsort((kinds, dates))
+        self.dates = dates[order]
+        self.symbols = np.asarray(symbols, dtype=object)[order]
+        self.kinds = kinds[order]
+        self.values = np.asarray(values, dtype=np.float64)[order]
+        self.fill_dates = np.asarray(fill_dates, dtype=np.int64)[order]
+        self.fill_times = np.broadcast_to(np.asarray(fill_times, dtype=np.int64), dates.shape)[order]
+
+    def __len__(self):
+        return len(self.dates)
+
+    @classmethod
+    def from_dataview(cls, dataview, start_date, end_date, split_time=200000, delist_time=150000):
+        """
+        Share dividends / splits from _daily_adjust_factor and delistings from instrument
+        information of a DataView.
+
+        Parameters
+        ----------
+        dataview : DataView
+        start_date : int
+        end_date : int
+        split_time : int
+            Time of adjustment records of splits.
+        delist_time : int
+            Time of adjustment records of delistings.
+
+        Returns
+        -------
+        CorporateActionLedger
+
+        Notes
+        -----
+        Only ratios larger than 1 are kept: position is not decreased by adjust factors.
+        A delisted position is closed at close price of the last trade date before delist_date.
+
+        """
+        df_adj = dataview.get_ts('_daily_adjust_factor', start_date=start_date, end_date=end_date)
+        arr = df_adj.values.astype(np.float64)
+        with np.errstate(invalid='ignore'):
+            rows, cols = np.nonzero(arr > 1.0)
+        split_dates = df_adj.index.values[rows]
+        split_symbols = df_adj.columns.values[cols]
+        split_values = arr[rows, cols]
+
+        delist_dates = np.array([], dtype=np.int64)
+        delist_symbols = np.array([], dtype=object)
+        delist_values = np.array([], dtype=np.float64)
+        delist_fill_dates = np.array([], dtype=np.int64)
+        df_inst = dataview.data_inst
+        if df_inst is not None and 'delist_date' in df_inst.columns:
+            ser = df_inst['delist_date']
+            ser = ser[(ser > start_date) & (ser <= end_date)]
+            ser = ser[ser.index.isin(dataview.symbol)]
+
+            dates = np.asarray(dataview.dates)
+            idx = np.searchsorted(dates, ser.values.astype(np.int64), side='left') - 1
+            ser, idx = ser[idx >= 0], idx[idx >= 0]
+            if len(ser):
+                df_close = dataview.get_ts('close', start_date=dates[idx.min()], end_date=dates[idx.max()])
+                rows = df_close.index.get_indexer(dates[idx])
+                cols = df_close.columns.get_indexer(ser.index)
+                delist_dates = ser.values.astype(np.int64)
+                delist_symbols = ser.index.values.astype(object)
+                delist_values = df_close.values.astype(np.float64)[rows, cols]
+                delist_fill_dates = dates[idx]
+
+        n_split, n_delist = len(split_dates), len(delist_dates)
+        return cls(dates=np.concatenate([split_dates.astype(np.int64), delist_dates]),
+                   symbols=np.concatenate([split_symbols.astype(object), delist_symbols]),
+                   kinds=np.repeat([cls.SPLIT, cls.DELIST], [n_split, n_delist]),
+                   values=np.concatenate([split_values, delist_values]),
+                   fill_dates=np.concatenate([split_dates.astype(np.int64), delist_fill_dates]),
+                   fill_times=np.repeat([split_time, delist_time], [n_split, n_delist]))
+
+    @classmethod
+    def from_dividend(cls, df_dividend, time=60000):
+        """
+        Cash and share dividends queried by DataService.query_dividend.
+
+        Parameters
+        ----------
+        df_dividend : pd.DataFrame
+            Columns symbol, exdiv_date, cash_tax (cash per share) and shares (new shares per share).
+        time : int
+            Time of adjustment records.
+
+        Returns
+        -------
+        CorporateActionLedger
+
+        """
+        df_cash = df_dividend.loc[df_dividend['cash_tax'] > 0]
+        df_shares = df_dividend.loc[df_dividend['shares'] > 0]
+        return cls(dates=np.concatenate([df_cash['exdiv_date'].values, df_shares['exdiv_date'].values]),
+                   symbols=np.concatenate([df_cash['symbol'].values, df_shares['symbol'].values]),
+                   kinds=np.repeat([cls.CASH, cls.SPLIT], [len(df_cash), len(df_shares)]),
+                   values=np.concatenate([df_cash['cash_tax'].values, 1.0 + df_shares['shares'].values]),
+                   fill_times=time)
+
+    def get_events(self, start_date, end_date):
+        """
+        Slice of actions taking effect after start_date and no later than end_date.
+
+        Returns
+        -------
+        slice
+
+        """
+        start = np.searchsorted(self.dates, start_date, side='right')
+        end = np.searchsorted(self.dates, end_date, side='right')
+        return slice(start, end)
+
+    def get_adjustments(self, start_date, end_date, positions, fill_date=None):
+        """
+        Adjustment records of positions for all actions after start_date and no later than end_date.
+
+        Actions of the same symbol are applied in order of date: a split changes the position
+        cash dividends and delistings after it are computed from, nothing follows a delisting.
+
+        Parameters
+        ----------
+        start_date : int
+        end_date : int
+        positions : dict
+            {symbol: size} of positions held at start_date.
+        fill_date : int, optional
+            If given, date of all records (e.g. date of settlement), otherwise fill dates of actions.
+
+        Returns
+        -------
+        np.ndarray of ADJUSTMENT_DTYPE
+            In order of actions. A split gives one record, price 0;
+            a cash dividend gives two records: size of cash at price 0 and at price 1;
+            a delisting gives one record closing the position.
+
+        """
+        sl = self.get_events(start_date, end_date)
+        held = pd.Index(list(positions.keys()))
+        codes = held.get_indexer(self.symbols[sl])
+        mask = codes >= 0
+        if not mask.any():
+            return np.zeros(0, dtype=ADJUSTMENT_DTYPE)
+
+        event_idx = np.arange(sl.start, sl.stop)[mask]
+        codes = codes[mask]
+        # group actions by symbol, lexsort is stable so actions of a symbol stay in order of date
+        order = np.lexsort((event_idx, codes))
+        event_idx, codes = event_idx[order], codes[order]
+        kinds, values = self.kinds[event_idx], self.values[event_idx]
+
+        is_split = kinds == self.SPLIT
+        is_delist = kinds == self.DELIST
+        ratio = np.where(is_split, values, 1.0)
+        sizes = np.array([positions[s] for s in held], dtype=np.float64)
+        pos_after = sizes[codes] * pd.Series(ratio).groupby(codes).cumprod().values
+        pos_before = pos_after / ratio
+        n_delist_before = pd.Series(is_delist.astype(np.int64)).groupby(codes).cumsum().values - is_delist
+        alive = n_delist_before == 0
+
+        # size of each action: new shares / cash / closed position
+        amount = np.where(is_split, pos_before * (ratio - 1.0),
+                          np.where(is_delist, -pos_before, values * pos_before))
+        keep = alive & (amount != 0)
+        event_idx, kinds, values, amount = event_idx[keep], kinds[keep], values[keep], amount[keep]
+
+        is_cash = kinds == self.CASH
+        cash_idx = np.nonzero(is_cash)[0]
+        # cash dividends are followed by a second record of the cash at price 1
+        rec_idx = np.concatenate([np.arange(len(kinds)), cash_idx])
+        sub = np.concatenate([np.zeros(len(kinds), dtype=np.int64), np.ones(len(cash_idx), dtype=np.int64)])
+        order = np.lexsort((sub, event_idx[rec_idx]))
+        rec_idx, sub = rec_idx[order], sub[order]
+
+        ev = event_idx[rec_idx]
+        kinds, amount = kinds[rec_idx], amount[rec_idx]
+        positive = (amount > 0) != (sub == 1)
+
+        records = np.zeros(len(rec_idx), dtype=ADJUSTMENT_DTYPE)
+        records['symbol'] = self.symbols[ev]
+        # np.where would convert enum members to fixed-width strings, keep them as objects
+        actions = np.empty(len(rec_idx), dtype=object)
+        actions[:] = common.ORDER_ACTION.SELL
+        actions[positive] = common.ORDER_ACTION.BUY
+        records['entrust_action'] = actions
+        records['fill_price'] = np.where(kinds == self.DELIST, values[rec_idx], sub.astype(np.float64))
+        records['fill_size'] = np.abs(amount)
+        records['fill_date'] = self.fill_dates[ev] if fill_date is None else fill_date
+        records['fill_time'] = self.fill_times[ev]
+        records['fill_no'] = np.choose(kinds, [CASH_ADJUST_NO, POSITION_ADJUST_NO, DELIST_ADJUST_NO])
+        return records
@@ -11,9 +11,13 @@ from __future__ import print_function
 
 import copy
 
+import numpy as np
+import pandas as pd
+
 import jaqs.trade
 from jaqs.data.basic import OrderStatusInd, Trade, Task, Order, Position, TradeStat
 from jaqs.trade import common
+from jaqs.trade.tradegateway import fills_to_trades
 import jaqs.util as jutil
 
 class PortfolioManager(object):
@@ -24,6 +28,10 @@ class PortfolioManager(object):
     ----------
     orders : list of jaqs.data.basic.Order objects
     trades : list of jaqs.data.basic.Trade objects
+    fills : list of np.ndarray
+        Fills of batch orders, see apply_fills.
+    adjustments : list of np.ndarray
+        Adjustment records of corporate actions, see apply_adjustments.
     positions : dict of {symbol + trade_date : jaqs.data.basic.Position}
     strategy : Strategy
     holding_securities : set of securities
@@ -46,6 +54,8 @@ class PortfolioManager(object):
         self.orders = dict()
         self.tasks = dict()
         self.trades = []
+        self.fills = []
+        self.adjustments = []
         self._cum_net_turnover = 0.0
         self.cash = 0.0
         self.init_balance = 0.0
@@ -633,6 +643,87 @@ class PortfolioManager(object):
         else:
             self.holding_securities.add(ind.symbol)
     
+    def apply_adjustments(self, records):
+        """
+        Update positions and cash by adjustment records of corporate actions,
+        instead of calling on_trade with one Trade per record.
+        
+        Parameters
+        ----------
+        records : np.ndarray
+            See jaqs.trade.corporate_action.ADJUSTMENT_DTYPE, entrust_action is BUY or SELL.
+
+        Notes
+        -----
+        Records are kept in adjustments, they do not change TradeStat or tasks
+        and are not passed to on_trade of the strategy.
+
+        """
+        if len(records) == 0:
+            return
+        self.adjustments.append(records)
+        self._update_by_records(records)
+    
+    def apply_fills(self, fills, materialize=False):
+        """
+        Update positions, cash and tasks by fills of batch orders in bulk.
+        
+        Parameters
+        ----------
+        fills : np.ndarray
+            See jaqs.trade.tradegateway.FILL_DTYPE, entrust_action is BUY or SELL.
+            All orders of their tasks are filled.
+        materialize : bool
+            If True, one Trade is created for each fill, stored in trades and passed to on_trade
+            of the strategy. Otherwise fills are kept in fills as they are.
+
+        Notes
+        -----
+        Fills do not change TradeStat or orders.
+
+        """
+        if len(fills) == 0:
+            return
+        self._update_by_records(fills)
+        
+        for task_id in np.unique(fills['task_id']):
+            task = self.get_task(task_id)
+            if task is not None:
+                task.task_status = common.TASK_STATUS.DONE
+        
+        if materialize:
+            trades = fills_to_trades(fills)
+            self.trades.extend(trades)
+            for ind in trades:
+                self.original_on_trade(ind)
+        else:
+            self.fills.append(fills)
+    
+    def _update_by_records(self, records):
+        """Update positions and cash by records of trades, which are arrays of fields of Trade."""
+        is_positive = np.frompyfunc(common.ORDER_ACTION.is_positive, 1, 1)(records['entrust_action']).astype(bool)
+        sign = np.where(is_positive, 1.0, -1.0)
+        size_diff = pd.Series(sign * records['fill_size']).groupby(records['symbol']).sum()
+        for symbol, diff in zip(size_diff.index, size_diff.values):
+            pos_key = self._make_position_key(symbol)
+            pos = self.positions.get(pos_key, None)
+            if pos is None:
+                pos = Position(symbol=symbol)
+            pos.current_size += diff
+            
+            # several records of a symbol are summed, rounding error must not leave a position
+            if abs(pos.current_size) < 1e-6:
+                self.positions.pop(pos_key, None)
+                self.holding_securities.discard(symbol)
+            else:
+                self.positions[pos_key] = pos
+                self.holding_securities.add(symbol)
+        
+        # same as _update_cash_from_trade_ind applied to records one by one
+        self._cum_net_turnover += np.sum(sign * records['fill_price'] * records['fill_size'])
+        last = records[-1]
+        self.cash = self.init_balance - (self._cum_net_turnover - self.get_pos(last['symbol']) * last['fill_price'])
+    
     # ----------------------------------------------------------------------------
     # For Alpha Strategy
     
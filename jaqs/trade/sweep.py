@@ -0,0 +1,279 @@
+# encoding: utf-8
+"""
+ParameterSweep runs one alpha backtest per combination of a parameter grid and
+collects performance and risk metrics into one table.
+
+The DataView is loaded once in the parent process. Worker processes are forked
+after that, so each of them reads the same DataView (copy-on-write memory)
+instead of loading or pickling it. Results are analyzed in memory, no trades.csv
+is written for any combination.
+
+Usage:
+    def build(props):
+        selector = model.StockSelector()
+        selector.add_filter(name='top', func=my_selector)
+        return AlphaStrategy(stock_selector=selector, pc_method='equal_weight')
+
+    sweep = ParameterSweep(dataview=dv, build=build, props=props,
+                           grid={'n_periods': [1, 2, 3], 'position_ratio': [0.5, 1.0]})
+    df_metrics = sweep.run()
+
+"""
+from __future__ import print_function
+import itertools
+import multiprocessing
+import sys
+
+import pandas as pd
+
+from jaqs.trade import model
+from jaqs.trade.backtest import AlphaBacktestInstance
+from jaqs.trade.portfoliomanager import PortfolioManager
+from jaqs.trade.tradegateway import AlphaTradeApi
+from jaqs.trade.analyze.analyze import AlphaAnalyzer, TradeRecordEmptyError
+
+
+# Objects shared with forked worker processes, set by ParameterSweep.run.
+# Workers inherit them from the parent, so they need not be picklable.
+_SHARED = dict()
+
+
+def expand_grid(grid):
+    """
+    Cartesian product of parameter values.
+
+    Parameters
+    ----------
+    grid : dict
+        {parameter name: list of values}.
+
+    Returns
+    -------
+    list of dict
+        One dict {parameter name: value} per combination, in the order of itertools.product
+        over sorted parameter names.
+
+    """
+    names = sorted(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def run_alpha_backtest(dataview, strategy, props, data_api=None):
+    """
+    Run one alpha backtest without saving its results.
+
+    Parameters
+    ----------
+    dataview : DataView
+    strategy : AlphaStrategy
+        A new strategy, its stock selector / signal model / cost model / risk model
+        are registered to the backtest context.
+    props : dict
+        Configurations of the backtest.
+    data_api : RemoteDataService, optional
+
+    Returns
+    -------
+    AlphaBacktestInstance
+        Trades are available by get_trades_df.
+
+    """
+    pm = PortfolioManager()
+    bt = AlphaBacktestInstance()
+    trade_api = AlphaTradeApi()
+    context = model.Context(dataview=dataview, instance=bt, strategy=strategy, trade_api=trade_api, pm=pm,
+                            data_api=data_api)
+    for obj in [strategy.stock_selector, strategy.signal_model, strategy.cost_model, strategy.risk_model]:
+        if obj is not None:
+            obj.register_context(context)
+
+    bt.init_from_config(props)
+    bt.run_alpha()
+    return bt
+
+
+def analyze_in_memory(dataview, trades, props, compound_return=False):
+    """
+    Analyze trades of a backtest without reading or writing files.
+
+    Parameters
+    ----------
+    dataview : DataView
+    trades : pd.DataFrame
+        See BacktestInstance.get_trades_df.
+    props : dict
+        Configurations of the backtest.
+    compound_return : bool
+        Passed to AlphaAnalyzer.get_returns.
+
+    Returns
+    -------
+    AlphaAnalyzer
+        Analyzer after get_returns, see attributes performance_metrics, risk_metrics and returns.
+
+    """
+    ta = AlphaAnalyzer()
+    ta.initialize(dataview=dataview, trades=trades, configs=props)
+    ta.process_trades()
+    ta.get_daily()
+    ta.get_returns(compound_return=compound_return, consider_commission=True)
+    return ta
+
+
+def run_alpha_in_memory(dataview, strategy, props, data_api=None, compound_return=False):
+    """
+    Run one alpha backtest and analyze its trades without saving them.
+    See run_alpha_backtest and analyze_in_memory for parameters.
+
+    Returns
+    -------
+    AlphaAnalyzer
+
+    """
+    bt = run_alpha_backtest(dataview, strategy, props, data_api=data_api)
+    return analyze_in_memory(dataview, bt.get_trades_df(), props, compound_return=compound_return)
+
+
+def create_pool(n_workers, n_tasks):
+    """
+    Create a pool of forked worker processes, which inherit objects of this process
+    (e.g. a loaded DataView) without pickling them.
+
+    Parameters
+    ----------
+    n_workers : int or None
+        Number of processes, number of CPUs if None.
+    n_tasks : int
+        No more processes than tasks are created.
+
+    Returns
+    -------
+    multiprocessing.pool.Pool or None
+        None if tasks should run in this process: one worker only, or fork not available (Windows).
+
+    """
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_workers = min(n_workers, n_tasks)
+    if n_workers <= 1 or sys.platform.startswith('win'):
+        return None
+    try:
+        ctx = multiprocessing.get_context('fork')
+    except AttributeError:
+        # Python 2 always forks on POSIX
+        ctx = multiprocessing
+    return ctx.Pool(n_workers)
+
+
+def _run_one(i):
+    """Run the i'th combination, return (i, metrics, returns)."""
+    props = _SHARED['props_list'][i]
+    strategy = _SHARED['build'](props)
+    try:
+        ta = run_alpha_in_memory(_SHARED['dataview'], strategy, props, data_api=_SHARED['data_api'],
+                                 compound_return=_SHARED['compound_return'])
+    except TradeRecordEmptyError:
+        return i, dict(), None
+
+    metrics = dict(ta.performance_metrics)
+    metrics.update(ta.risk_metrics)
+    returns = ta.returns if _SHARED['keep_returns'] else None
+    return i, metrics, returns
+
+
+class ParameterSweep(object):
+    """
+    Run alpha backtests over a grid of parameters sharing one loaded DataView.
+
+    Parameters
+    ----------
+    dataview : DataView
+        Loaded DataView, it is read by all backtests and must not be modified by them.
+    build : callable
+        build(props) returns a new AlphaStrategy for the props of a combination.
+        Parameters used by the strategy itself (e.g. weights of signals) are read from props here.
+    props : dict
+        Configurations shared by all combinations.
+    grid : dict
+        {name in props: list of values}, e.g. n_periods, position_ratio, single_symbol_weight_limit
+        or any key read by build.
+    n_workers : int, optional
+        Number of worker processes, number of CPUs by default. 1 runs all combinations in this process.
+    data_api : RemoteDataService, optional
+    compound_return : bool
+        Passed to AlphaAnalyzer.get_returns.
+    keep_returns : bool
+        Whether to keep daily returns of each combination, see attribute returns.
+
+    Attributes
+    ----------
+    combinations : list of dict
+        Parameters of each combination.
+    returns : list of pd.DataFrame
+        AlphaAnalyzer.returns of each combination (None if it has no trades), only if keep_returns is True.
+
+    Notes
+    -----
+    Worker processes are forked so that they share the DataView. Where fork is not
+    available (Windows), combinations are run one by one in this process.
+
+    """
+    def __init__(self, dataview, build, props, grid, n_workers=None, data_api=None,
+                 compound_return=False, keep_returns=False):
+        self.dataview = dataview
+        self.build = build
+        self.props = props
+        self.grid = grid
+        self.n_workers = n_workers
+        self.data_api = data_api
+        self.compound_return = compound_return
+        self.keep_returns = keep_returns
+
+        self.combinations = expand_grid(grid)
+        self.returns = []
+
+    def _get_props_list(self):
+        props_list = []
+        for params in self.combinations:
+            props = dict(self.props)
+            props.update(params)
+            props_list.append(props)
+        return props_list
+
+    def run(self):
+        """
+        Run all combinations.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per combination: parameters of the grid, then performance and risk metrics.
+            Metrics are NaN for combinations without any trade.
+
+        """
+        props_list = self._get_props_list()
+        _SHARED.update({'dataview': self.dataview,
+                        'build': self.build,
+                        'data_api': self.data_api,
+                        'props_list': props_list,
+                        'compound_return': self.compound_return,
+                        'keep_returns': self.keep_returns})
+        try:
+            pool = create_pool(self.n_workers, len(props_list))
+            if pool is None:
+                results = [_run_one(i) for i in range(len(props_list))]
+            else:
+                try:
+                    results = pool.map(_run_one, range(len(props_list)), chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            _SHARED.clear()
+
+        results = sorted(results, key=lambda r: r[0])
+        self.returns = [returns for _, _, returns in results] if self.keep_returns else []
+
+        df_params = pd.DataFrame(self.combinations, columns=sorted(self.grid.keys()))
+        df_metrics = pd.DataFrame([metrics for _, metrics, _ in results], index=df_params.index)
+        return pd.concat([df_params, df_metrics], axis=1)
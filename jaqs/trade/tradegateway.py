@@ -6,6 +6,7 @@ import copy
 import time
 
 import numpy as np
+import pandas as pd
 
 from jaqs.data.basic import *
 from jaqs.data.basic import OrderStatusInd, Trade, TaskInd, Task
@@ -37,6 +38,67 @@ def calc_commission(trade_ind, commission_rate):
     return res
 
 
+# Fills of batch orders, one row per order, see DailyStockSimulator.match_batch.
+FILL_DTYPE = np.dtype([(str('task_id'), np.int64),
+                       (str('entrust_no'), object),
+                       (str('entrust_action'), object),
+                       (str('symbol'), object),
+                       (str('fill_price'), np.float64),
+                       (str('fill_size'), np.float64),
+                       (str('fill_date'), np.int64),
+                       (str('fill_time'), np.int64),
+                       (str('fill_no'), object),
+                       (str('commission'), np.float64)])
+
+
+def fills_to_df(fills):
+    """
+    Fills in the format of trades.csv.
+
+    Parameters
+    ----------
+    fills : np.ndarray of FILL_DTYPE
+
+    Returns
+    -------
+    pd.DataFrame
+
+    """
+    return pd.DataFrame({'task_id': fills['task_id'].astype(str),
+                         'entrust_no': fills['entrust_no'].astype(str),
+                         'entrust_action': fills['entrust_action'],
+                         'symbol': fills['symbol'].astype(str),
+                         'fill_price': fills['fill_price'],
+                         'fill_size': fills['fill_size'],
+                         'fill_date': fills['fill_date'],
+                         'fill_time': fills['fill_time'],
+                         'fill_no': fills['fill_no'].astype(str),
+                         'commission': fills['commission'],
+                         'trade_date': fills['fill_date']})
+
+
+def fills_to_trades(fills):
+    """
+    Create one Trade for each fill.
+
+    Parameters
+    ----------
+    fills : np.ndarray of FILL_DTYPE
+
+    Returns
+    -------
+    list of Trade
+
+    """
+    names = fills.dtype.names
+    trades = []
+    for values in fills.tolist():
+        trade_ind = Trade.create_from_dict(dict(zip(names, values)))
+        trade_ind.trade_date = trade_ind.fill_date
+        trades.append(trade_ind)
+    return trades
+
+
 class BaseTradeApi(object):
     def __init__(self):
         super(BaseTradeApi, self).__init__()
@@ -633,6 +695,20 @@ class RealTimeTradeApi(TradeApi):
 # For Alpha Strategy
 
 class AlphaTradeApi(BaseTradeApi):
+    """
+    Trade API of alpha backtest, orders are matched by DailyStockSimulator.
+    
+    Attributes
+    ----------
+    commission_rate : float
+    batch_fill : bool
+        If True, goal_portfolio sends all orders to the simulator as one batch, they are matched by
+        match_batch and applied to PortfolioManager in bulk, without Order / Trade / OrderStatusInd objects.
+    materialize_trades : bool
+        Only used if batch_fill is True. Whether to create Trade objects of fills, which are stored in
+        PortfolioManager.trades and passed to on_trade of the strategy as in normal mode.
+
+    """
     def __init__(self):
         super(AlphaTradeApi, self).__init__()
         self.ctx = None
@@ -642,6 +718,8 @@ class AlphaTradeApi(BaseTradeApi):
         self.seq_gen = SequenceGenerator()
 
         self.commission_rate = 0.0
+        self.batch_fill = False
+        self.materialize_trades = False
         
         self.MATCH_TIME = 143000
 
@@ -656,6 +734,8 @@ class AlphaTradeApi(BaseTradeApi):
 
     def init_from_config(self, props):
         self.commission_rate = props.get('commission_rate', 0.0)
+        self.batch_fill = props.get('batch_fill', False)
+        self.materialize_trades = props.get('materialize_trades', False)
         
         self.set_order_status_callback(lambda ind: self.ctx.strategy.on_order_status(ind))
         self.set_trade_callback(lambda ind: self.ctx.strategy.on_trade(ind))
@@ -713,7 +793,19 @@ class AlphaTradeApi(BaseTradeApi):
         else:
             raise NotImplementedError("cancel task with function_name = {}".format(task.function_name))
 
+    @staticmethod
+    def _get_price_target(algo):
+        if algo == 'vwap' or algo == '':
+            return 'vwap'  # TODO
+        elif algo.startswith('limit:'):
+            return algo.split(':')[1].strip()
+        else:
+            raise NotImplementedError("goal_portfolio algo = {}".format(algo))
+
     def goal_portfolio(self, positions, algo="", algo_param={}, userdata=""):
+        if self.batch_fill:
+            return self._goal_portfolio_batch(positions, algo=algo, algo_param=algo_param)
+        
         # Generate Orders
         task_id = self._get_next_task_id()
 
@@ -729,14 +821,7 @@ class AlphaTradeApi(BaseTradeApi):
                 action = common.ORDER_ACTION.BUY if diff_size > 0 else common.ORDER_ACTION.SELL
         
                 order = FixedPriceTypeOrder.new_order(sec, action, 0.0, abs(diff_size), self.ctx.trade_date, 0)
-                if algo == 'vwap':
-                    order.price_target = 'vwap'  # TODO
-                elif algo.startswith('limit:'):
-                    order.price_target = algo.split(':')[1].strip()
-                elif algo == '':
-                    order.price_target = 'vwap'
-                else:
-                    raise NotImplementedError("goal_portfolio algo = {}".format(algo))
+                order.price_target = self._get_price_target(algo)
 
                 order.task_id = task_id
                 order.entrust_no = self._simulator.add_order(order)
@@ -759,6 +844,30 @@ class AlphaTradeApi(BaseTradeApi):
 
             self._order_status_callback(order_status_ind)
     
+    def _goal_portfolio_batch(self, positions, algo="", algo_param={}):
+        """Send orders of all positions different from goals to the simulator as one batch."""
+        task_id = self._get_next_task_id()
+        price_target = self._get_price_target(algo)
+        
+        pm = self.ctx.pm
+        symbols = np.array([goal['symbol'] for goal in positions], dtype=object)
+        goal_sizes = np.array([goal['size'] for goal in positions], dtype=np.float64)
+        current_sizes = np.array([pm.get_pos(sec) for sec in symbols], dtype=np.float64)
+        diff_sizes = goal_sizes - current_sizes
+        mask = diff_sizes != 0
+        
+        # np.where would convert enum members to fixed-width strings, keep them as objects
+        actions = np.empty(mask.sum(), dtype=object)
+        actions[:] = common.ORDER_ACTION.SELL
+        actions[diff_sizes[mask] > 0] = common.ORDER_ACTION.BUY
+        self._simulator.add_batch_order(task_id, symbols[mask], actions, np.abs(diff_sizes[mask]), price_target)
+
+        # orders are not stored in the task, it is done once the batch is matched
+        task = Task(task_id,
+                    algo=algo, algo_param=algo_param, data=dict(),
+                    function_name='goal_portfolio', trade_date=self.ctx.trade_date)
+        pm.add_task(task)
+    
     def goal_portfolio_by_batch_order(self, goals):
         assert len(goals) == len(self.ctx.universe)
     
@@ -829,6 +938,36 @@ class AlphaTradeApi(BaseTradeApi):
                 self._task_status_callback(task_ind)
 
         return results
+    
+    def match_batch(self, prices):
+        """
+        Match all batch orders and apply their fills to PortfolioManager in bulk.
+        
+        Parameters
+        ----------
+        prices : pd.DataFrame or dict
+            See DailyStockSimulator.match_batch.
+
+        Returns
+        -------
+        np.ndarray of FILL_DTYPE
+            Fills with commission.
+
+        """
+        fills = self._simulator.match_batch(prices, date=self.ctx.trade_date, time=self.MATCH_TIME)
+        if len(fills) == 0:
+            return fills
+        fills['commission'] = np.abs(fills['fill_price'] * fills['fill_size']) * self.commission_rate
+        
+        pm = self.ctx.pm
+        pm.apply_fills(fills, materialize=self.materialize_trades)
+        for task_id in np.unique(fills['task_id']):
+            task = pm.get_task(task_id)
+            if task is not None and task.is_finished:
+                task_ind = TaskInd(task_id, task_status=task.task_status,
+                                   task_algo='', task_msg="")
+                self._task_status_callback(task_ind)
+        return fills
 
 
 class DailyStockSimulator(object):
@@ -838,12 +977,15 @@ class DailyStockSimulator(object):
     ----------
     __orders : list of Order
         Store orders that have not been filled.
+    __batch_orders : list of tuple
+        (np.ndarray of FILL_DTYPE, price_target) of batch orders that have not been filled.
 
     """
     
     def __init__(self):
         # TODO heap is better for insertion and deletion. We only need implement search of heapq module.
         self.__orders = dict()
+        self.__batch_orders = []
         self.seq_gen = SequenceGenerator()
         
         self.date = 0
@@ -858,13 +1000,14 @@ class DailyStockSimulator(object):
     
     def _refresh_orders(self):
         self.__orders.clear()
+        del self.__batch_orders[:]
     
     def _next_fill_no(self):
         return str(np.int64(self.date) * 10000 + self.seq_gen.get_next('fill_no'))
     
     @property
     def match_finished(self):
-        return len(self.__orders) == 0
+        return len(self.__orders) == 0 and len(self.__batch_orders) == 0
     
     @staticmethod
     def _validate_order(order):
@@ -903,6 +1046,38 @@ class DailyStockSimulator(object):
         self.__orders[entrust_no] = neworder
         return entrust_no
     
+    def add_batch_order(self, task_id, symbols, actions, sizes, price_target):
+        """
+        Add orders of one task to the simulator at once, instead of one Order object each.
+
+        Parameters
+        ----------
+        task_id : int
+        symbols : np.ndarray of str
+        actions : np.ndarray of ORDER_ACTION
+            Object array.
+        sizes : np.ndarray of float
+            Entrust sizes, positive.
+        price_target : str
+            The type of price all orders are matched at, see FixedPriceTypeOrder.
+
+        Returns
+        -------
+        np.ndarray of str
+            entrust_no of orders.
+
+        """
+        n = len(symbols)
+        orders = np.zeros(n, dtype=FILL_DTYPE)
+        orders['task_id'] = task_id
+        orders['entrust_no'] = [str(no) for no in self.seq_gen.get_next_batch('entrust_no', n)]
+        orders['entrust_action'] = actions
+        orders['symbol'] = symbols
+        orders['fill_size'] = sizes
+        if n > 0:
+            self.__batch_orders.append((orders, price_target))
+        return orders['entrust_no']
+    
     def cancel_order(self, entrust_no):
         """
         Cancel an order.
@@ -976,6 +1151,46 @@ class DailyStockSimulator(object):
         # self.cancel_order(order.entrust_no)  # TODO DEBUG
         
         return results
+    
+    def match_batch(self, prices, date=19700101, time=150000):
+        """
+        Fill all batch orders in whole.
+
+        Parameters
+        ----------
+        prices : pd.DataFrame or dict
+            DataFrame of price fields (columns) of symbols (index), e.g. snapshot of DataView,
+            or {symbol: {field: price}} as in match.
+        date : int
+        time : int
+
+        Returns
+        -------
+        np.ndarray of FILL_DTYPE
+            One row per order, in the order they were added. Commission is 0.
+
+        """
+        self._validate_price(prices)
+        
+        fills_list = []
+        for orders, price_target in self.__batch_orders:
+            fills = orders.copy()
+            if isinstance(prices, pd.DataFrame):
+                fills['fill_price'] = prices[price_target].reindex(fills['symbol']).values
+            else:
+                fills['fill_price'] = [prices[symbol][price_target] for symbol in fills['symbol']]
+            fills_list.append(fills)
+        del self.__batch_orders[:]
+        
+        if not fills_list:
+            return np.zeros(0, dtype=FILL_DTYPE)
+        fills = np.concatenate(fills_list)
+        fills['fill_date'] = date
+        fills['fill_time'] = time
+        fill_no = np.int64(date) * 10000 + np.array(self.seq_gen.get_next_batch('fill_no', len(fills)),
+                                                    dtype=np.int64)
+        fills['fill_no'] = [str(no) for no in fill_no]
+        return fills
 
 
 # ---------------------------------------------
@@ -0,0 +1,213 @@
+# encoding: utf-8
+"""
+WalkForward runs an alpha strategy over rolling windows of one DataView and stitches
+the out-of-sample segments into one PnL series.
+
+Each window is made of an in-sample (train) period followed by an out-of-sample (test)
+period, windows are stepped by the length of the test period:
+
+    | train 36 months                     | test 1 month |
+                 | train 36 months                     | test 1 month |
+
+The DataView is loaded once. Every window reads a date slice of it (DataView.slice_dates,
+no data copied) in a forked worker process, so formulas, snapshots and derived fields are
+computed once and reused by all windows instead of being rebuilt from start_date.
+
+Usage:
+    def build(props, dataview):
+        # fit on dataview between props['train_start_date'] and props['train_end_date'] if needed
+        return AlphaStrategy(stock_selector=..., pc_method='equal_weight')
+
+    wf = WalkForward(dataview=dv, build=build, props=props, train_months=36, test_months=1)
+    ta = wf.run()
+    ta.plot_pnl(output_folder)
+
+"""
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+from jaqs.trade.sweep import run_alpha_backtest, analyze_in_memory, create_pool
+from jaqs.trade.analyze.analyze import AlphaAnalyzer
+
+
+# Objects shared with forked worker processes, set by WalkForward.run.
+_SHARED = dict()
+
+
+def get_windows(dates, train_months, test_months):
+    """
+    Split trade dates into rolling windows of whole months.
+
+    Parameters
+    ----------
+    dates : array-like of int
+        Sorted trade dates.
+    train_months : int
+        Number of months of the in-sample period.
+    test_months : int
+        Number of months of the out-of-sample period, also the step between windows.
+
+    Returns
+    -------
+    list of tuple
+        (train_start, train_end, test_start, test_end) trade dates of each window.
+        Test periods do not overlap and cover all months after the first train period,
+        the last one may be shorter than test_months.
+
+    """
+    if train_months < 1 or test_months < 1:
+        raise ValueError("train_months and test_months must be positive.")
+    dates = np.asarray(dates)
+    months = dates // 100
+    month_list = np.unique(months)
+    # first / last date of each month
+    first = dates[np.searchsorted(months, month_list, side='left')]
+    last = dates[np.searchsorted(months, month_list, side='right') - 1]
+
+    windows = []
+    for i in range(train_months, len(month_list), test_months):
+        j = min(i + test_months, len(month_list)) - 1
+        windows.append((int(first[i - train_months]), int(last[i - 1]), int(first[i]), int(last[j])))
+    return windows
+
+
+def _run_window(i):
+    """Backtest the test period of the i'th window, return (i, trades, daily, daily_position, metrics)."""
+    train_start, train_end, test_start, test_end = _SHARED['windows'][i]
+    dv = _SHARED['slices'][i]
+
+    props = dict(_SHARED['props'])
+    props.update({'start_date': test_start, 'end_date': test_end,
+                  'train_start_date': train_start, 'train_end_date': train_end})
+    strategy = _SHARED['build'](props, dv)
+    bt = run_alpha_backtest(dv, strategy, props, data_api=_SHARED['data_api'])
+
+    trades = bt.get_trades_df()
+    if trades.empty:
+        return i, trades, None, None, dict()
+    ta = analyze_in_memory(dv, trades, props)
+    metrics = dict(ta.performance_metrics)
+    metrics.update(ta.risk_metrics)
+    return i, trades, ta.daily, ta.daily_position, metrics
+
+
+class WalkForward(object):
+    """
+    Walk-forward backtest of an alpha strategy on one DataView.
+
+    Parameters
+    ----------
+    dataview : DataView
+        Loaded DataView covering all windows.
+    build : callable
+        build(props, dataview) returns a new AlphaStrategy for a window.
+        dataview is the slice of the window, props contains train_start_date and train_end_date
+        (in-sample period) besides start_date and end_date (out-of-sample period).
+    props : dict
+        Configurations shared by all windows, start_date and end_date are set for each window.
+    train_months : int
+        Length of the in-sample period of each window.
+    test_months : int
+        Length of the out-of-sample period of each window, also the step between windows.
+    n_workers : int, optional
+        Number of worker processes, number of CPUs by default. 1 runs all windows in this process.
+    data_api : RemoteDataService, optional
+
+    Attributes
+    ----------
+    windows : list of tuple
+        (train_start, train_end, test_start, test_end) of each window.
+    window_metrics : pd.DataFrame
+        Performance and risk metrics of each out-of-sample segment, available after run.
+
+    Notes
+    -----
+    Each out-of-sample segment starts from cash of init_balance and its positions are
+    valued at close of its last date, so the stitched PnL is the sum of segment PnL
+    (non-compound) and includes the cost of rebuilding the portfolio at each segment start.
+
+    """
+    def __init__(self, dataview, build, props, train_months=36, test_months=1, n_workers=None, data_api=None):
+        self.dataview = dataview
+        self.build = build
+        self.props = props
+        self.train_months = train_months
+        self.test_months = test_months
+        self.n_workers = n_workers
+        self.data_api = data_api
+
+        dates = np.asarray(dataview.dates)
+        dates = dates[(dates >= dataview.start_date) & (dates <= dataview.end_date)]
+        self.windows = get_windows(dates, train_months, test_months)
+        self.window_metrics = None
+
+    def run(self, compound_return=False):
+        """
+        Run all windows and stitch their out-of-sample segments.
+
+        Parameters
+        ----------
+        compound_return : bool
+            Passed to AlphaAnalyzer.get_returns.
+
+        Returns
+        -------
+        AlphaAnalyzer
+            Analyzer of all out-of-sample trades after get_returns: returns, df_pnl,
+            performance_metrics and risk_metrics are those of the stitched PnL series.
+
+        """
+        if not self.windows:
+            raise ValueError("No window of {:d} + {:d} months between {} and {}".format(
+                self.train_months, self.test_months, self.dataview.start_date, self.dataview.end_date))
+
+        # slices are views, they are created before forking so that lazy formulas
+        # are evaluated once here instead of once in each worker
+        slices = [self.dataview.slice_dates(train_start, test_end)
+                  for train_start, _, _, test_end in self.windows]
+        _SHARED.update({'slices': slices,
+                        'build': self.build,
+                        'data_api': self.data_api,
+                        'props': self.props,
+                        'windows': self.windows})
+        try:
+            pool = create_pool(self.n_workers, len(self.windows))
+            if pool is None:
+                results = [_run_window(i) for i in range(len(self.windows))]
+            else:
+                try:
+                    results = pool.map(_run_window, range(len(self.windows)), chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            _SHARED.clear()
+        results = sorted(results, key=lambda r: r[0])
+
+        df_windows = pd.DataFrame(self.windows,
+                                  columns=['train_start_date', 'train_end_date', 'start_date', 'end_date'])
+        self.window_metrics = pd.concat([df_windows, pd.DataFrame([r[4] for r in results])], axis=1)
+
+        return self._stitch(results, compound_return)
+
+    def _stitch(self, results, compound_return):
+        trades_list = [trades for _, trades, daily, _, _ in results if daily is not None]
+        if not trades_list:
+            raise ValueError("No trade in any out-of-sample segment.")
+
+        configs = dict(self.props)
+        configs['start_date'] = self.windows[0][2]
+        configs['end_date'] = self.windows[-1][3]
+
+        ta = AlphaAnalyzer()
+        ta.initialize(dataview=self.dataview, trades=pd.concat(trades_list, axis=0, ignore_index=True),
+                      configs=configs)
+        # daily statistics of each segment are computed from its own trades,
+        # positions are not carried from one segment to the next
+        ta.daily = pd.concat([daily for _, _, daily, _, _ in results if daily is not None], axis=0).sort_index()
+        positions = [pos for _, _, daily, pos, _ in results if daily is not None]
+        ta.daily_position = pd.concat(positions, axis=0).sort_index().fillna(0.0)
+        ta.get_returns(compound_return=compound_return, consider_commission=True)
+        return ta
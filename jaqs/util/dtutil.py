@@ -4,7 +4,7 @@ import numpy as np
 import pandas as pd
 
 
-def get_next_period_day(current, period, n=1, extra_offset=0):
+def get_next_period_day(current, period, n=1, extra_offset=0, calendar=None):
     """
     Get the n'th day in next period from current day.
 
@@ -18,12 +18,24 @@ def get_next_period_day(current, period, n=1, extra_offset=0):
         n times period.
     extra_offset : int
         n'th business day after next period.
+    calendar : TradingCalendar, optional
+        If provided, days are counted in trade dates instead of business days,
+        so the result is always a trade date.
 
     Returns
     -------
     nxt : int
 
     """
+    if calendar is not None:
+        if period == 'day':
+            nxt = calendar.get_next_trade_date(current, n)
+        else:
+            nxt = calendar.offset(get_next_period_day(current, period, n=n), 0)
+        if extra_offset:
+            nxt = calendar.offset(nxt, extra_offset)
+        return nxt
+    
     current_dt = convert_int_to_datetime(current)
     if period == 'day':
         offset = pd.tseries.offsets.BDay()  # move to next business day
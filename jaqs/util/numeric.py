@@ -19,6 +19,222 @@ def quantilize_without_nan(mat, n_quantiles=5, axis=-1):
     return res
 
 
+def rolling_invalid_mask(mat, window):
+    """
+    Mask of rolling windows (along axis 0) which can not be calculated:
+    incomplete windows at the beginning and windows containing NaN.
+    Same as pandas rolling with min_periods = window.
+
+    """
+    is_nan = np.isnan(mat)
+    n_nan = np.cumsum(is_nan, axis=0)
+    n_nan[window:] = n_nan[window:] - n_nan[:-window]
+    mask = n_nan > 0
+    mask[:window - 1] = True
+    return mask
+
+
+def rolling_rank(mat, window):
+    """
+    Rank (from 1 to window) of the last value within each rolling window along axis 0.
+    Ties are ranked by order of appearance, i.e. rank = number of values <= the last one.
+
+    Parameters
+    ----------
+    mat : np.ndarray
+        2-D float array.
+    window : int
+
+    Returns
+    -------
+    np.ndarray
+        NaN where the window is incomplete or contains NaN.
+
+    Notes
+    -----
+    Instead of sorting every window, values are compared with the last one lag by lag,
+    which needs window vectorized passes and no extra memory of size window.
+
+    """
+    window = int(window)
+    mat = np.asarray(mat, dtype=float)
+    res = np.ones(mat.shape)
+    for lag in range(1, window):
+        res[lag:] += mat[:-lag] <= mat[lag:]
+    res[rolling_invalid_mask(mat, window)] = np.nan
+    return res
+
+
+def rolling_dot(mat, weights):
+    """
+    Weighted sum of each rolling window along axis 0. weights[-1] is applied to the last value.
+
+    Parameters
+    ----------
+    mat : np.ndarray
+        2-D float array.
+    weights : np.ndarray
+        1-D array, its length is the window size.
+
+    Returns
+    -------
+    np.ndarray
+        NaN where the window is incomplete or contains NaN.
+
+    """
+    weights = np.asarray(weights, dtype=float)
+    window = len(weights)
+    mat = np.asarray(mat, dtype=float)
+    res = mat * weights[-1]
+    for lag in range(1, window):
+        res[lag:] += mat[:-lag] * weights[-1 - lag]
+    res[:window - 1] = np.nan
+    return res
+
+
+def rolling_prod(mat, window):
+    """
+    Product of each rolling window along axis 0.
+
+    Returns
+    -------
+    np.ndarray
+        NaN where the window is incomplete or contains NaN.
+
+    """
+    window = int(window)
+    mat = np.asarray(mat, dtype=float)
+    res = mat.copy()
+    for lag in range(1, window):
+        res[lag:] *= mat[:-lag]
+    res[rolling_invalid_mask(mat, window)] = np.nan
+    return res
+
+
+def group_sort(mat, group_codes):
+    """
+    Sort valid cells of a 2-D array by (row, group, value) in one pass.
+    Each (row, group) pair forms a segment of consecutive sorted cells.
+
+    Parameters
+    ----------
+    mat : np.ndarray
+        2-D float array.
+    group_codes : np.ndarray
+        Integer group codes of the same shape as mat, negative means no group.
+
+    Returns
+    -------
+    rows, cols : np.ndarray
+        Positions of sorted cells. Cells with NaN value or no group are dropped.
+    values : np.ndarray
+        Sorted values. Equal values keep their column order.
+    seg_id : np.ndarray
+        Segment of each sorted cell.
+    seg_start, seg_size : np.ndarray
+        Position of the first cell and number of cells of each segment.
+
+    """
+    mat = np.asarray(mat, dtype=float)
+    rows, cols = np.nonzero(~np.isnan(mat) & (group_codes >= 0))
+    values = mat[rows, cols]
+    codes = group_codes[rows, cols]
+
+    order = np.lexsort((values, codes, rows))
+    rows, cols, values, codes = rows[order], cols[order], values[order], codes[order]
+
+    n = len(values)
+    is_start = np.ones(n, dtype=bool)
+    is_start[1:] = (rows[1:] != rows[:-1]) | (codes[1:] != codes[:-1])
+    seg_id = np.cumsum(is_start) - 1
+    seg_start = np.nonzero(is_start)[0]
+    seg_size = np.diff(np.append(seg_start, n))
+    return rows, cols, values, seg_id, seg_start, seg_size
+
+
+def _fill_cells(shape, rows, cols, values):
+    res = np.full(shape, np.nan)
+    res[rows, cols] = values
+    return res
+
+
+def group_rank(mat, group_codes, normalize=False):
+    """
+    Rank values within each (row, group), using 'min' method for ties.
+    Same as rank_with_mask(df, mask=(group == g), axis=1) for every group g.
+
+    Parameters
+    ----------
+    mat : np.ndarray
+    group_codes : np.ndarray
+    normalize : bool
+        If True, result will range in [0.0, 1.0]
+
+    Returns
+    -------
+    np.ndarray
+
+    """
+    rows, cols, values, seg_id, seg_start, seg_size = group_sort(mat, group_codes)
+    pos = np.arange(len(values))
+    is_new_value = np.ones(len(values), dtype=bool)
+    is_new_value[1:] = values[1:] != values[:-1]
+    is_new_value[seg_start] = True
+    first_pos = np.maximum.accumulate(np.where(is_new_value, pos, 0))
+    rank = (first_pos - seg_start[seg_id] + 1).astype(float)
+
+    if normalize:
+        max_rank = rank[seg_start + seg_size - 1][seg_id]
+        # for max_rank = 1, do not subtract 1, otherwise there will be NaN
+        rank = (rank - 1) / np.where(max_rank > 1, max_rank - 1, max_rank)
+    return _fill_cells(np.shape(mat), rows, cols, rank)
+
+
+def group_quantilize(mat, group_codes, n_quantiles=5):
+    """
+    Quantile number (from 1 to n_quantiles) of values within each (row, group).
+    Same as quantilize_without_nan on values of every group.
+
+    """
+    rows, cols, values, seg_id, seg_start, seg_size = group_sort(mat, group_codes)
+    rank = np.arange(len(values)) - seg_start[seg_id]
+    divisor = seg_size[seg_id] * 1. / n_quantiles
+    res = np.floor(rank / divisor) + 1.0
+    return _fill_cells(np.shape(mat), rows, cols, res)
+
+
+def _group_mean(values, seg_id, seg_start, seg_size):
+    if not len(values):
+        return values
+    mean = np.add.reduceat(values, seg_start) / seg_size
+    # values are sorted within segment: mean of equal values is exactly the value, without rounding error
+    first, last = values[seg_start], values[seg_start + seg_size - 1]
+    mean = np.where(first == last, first, mean)
+    return mean[seg_id]
+
+
+def group_demean(mat, group_codes):
+    """Subtract mean of each (row, group) from values."""
+    rows, cols, values, seg_id, seg_start, seg_size = group_sort(mat, group_codes)
+    res = values - _group_mean(values, seg_id, seg_start, seg_size)
+    return _fill_cells(np.shape(mat), rows, cols, res)
+
+
+def group_standardize(mat, group_codes):
+    """
+    Subtract mean of each (row, group) from values, then divide by its standard deviation (ddof = 1).
+    Groups of a single value or equal values get NaN.
+
+    """
+    rows, cols, values, seg_id, seg_start, seg_size = group_sort(mat, group_codes)
+    demeaned = values - _group_mean(values, seg_id, seg_start, seg_size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if len(values):
+            var = np.add.reduceat(demeaned ** 2, seg_start) / (seg_size - 1)
+            demeaned = demeaned / np.sqrt(var)[seg_id]
+    return _fill_cells(np.shape(mat), rows, cols, demeaned)
+
+
 # Boolean, unsigned integer, signed integer, float, complex.
 _NUMERIC_KINDS = set('buifc')
 
@@ -10,3 +10,9 @@ class SequenceGenerator(object):
     def get_next(self, key):
         self.__d[key] += 1
         return self.__d[key]
+    
+    def get_next_batch(self, key, n):
+        """Get the next n numbers of key at once, as a range."""
+        start = self.__d[key] + 1
+        self.__d[key] += n
+        return range(start, start + n)
@@ -0,0 +1,72 @@
+# encoding: utf-8
+"""
+Benchmark of jaqs.data.align.align against the previous implementation,
+which loops over every date and every security.
+
+Run: python benchmark_align.py
+
+"""
+from __future__ import print_function
+import time
+
+import numpy as np
+import pandas as pd
+
+from jaqs.data.align import align
+
+
+def _get_neareast_loop(ann, value, date):
+    mask = date[0] >= ann
+    n = value.shape[1]
+    res = np.empty(n, dtype=value.dtype)
+    for i in range(n):
+        r = value[:, i][mask[:, i]]
+        res[i] = r[-1] if len(r) else np.nan
+    return res
+
+
+def align_loop(df_value, df_ann, date_arr):
+    """The previous implementation of align, used as reference."""
+    df_ann = df_ann.fillna(99999999).astype(int)
+    date_arr = np.asarray(date_arr, dtype=int)
+    value = df_value.values.astype(float)
+    res = np.apply_along_axis(lambda date: _get_neareast_loop(df_ann.values, value, date), 1,
+                              date_arr.reshape(-1, 1))
+    return pd.DataFrame(index=date_arr, columns=df_value.columns, data=res)
+
+
+def make_data(n_securities, n_years, seed=0):
+    rs = np.random.RandomState(seed)
+    report_dates = [y * 10000 + md for y in range(2017 - n_years, 2017) for md in (331, 630, 930, 1231)]
+    trade_dates = pd.bdate_range(str(2017 - n_years) + '0101', '20170601').strftime('%Y%m%d').astype(int).values
+
+    # announced 20 ~ 120 days after report date, some never announced
+    lag = rs.randint(20, 120, size=(len(report_dates), n_securities))
+    ann = pd.to_datetime(np.repeat(np.array(report_dates).reshape(-1, 1), n_securities, axis=1).ravel().astype(str))
+    ann = (ann + pd.to_timedelta(lag.ravel(), unit='D')).strftime('%Y%m%d').astype(int).values
+    ann = ann.reshape(len(report_dates), n_securities).astype(float)
+    ann[rs.rand(*ann.shape) < 0.05] = np.nan
+
+    columns = ['{:06d}.SZ'.format(i) for i in range(n_securities)]
+    df_ann = pd.DataFrame(index=report_dates, columns=columns, data=ann)
+    df_value = pd.DataFrame(index=report_dates, columns=columns, data=rs.randn(*ann.shape))
+    return df_value, df_ann, trade_dates
+
+
+def run(n_securities=500, n_years=5):
+    df_value, df_ann, dates = make_data(n_securities, n_years)
+
+    t0 = time.time()
+    res_loop = align_loop(df_value, df_ann, dates)
+    t1 = time.time()
+    res = align(df_value, df_ann, dates)
+    t2 = time.time()
+
+    assert np.allclose(res.values, res_loop.values, equal_nan=True)
+    print("{:5d} securities x {:5d} dates: loop {:8.3f}s, searchsorted {:8.4f}s, speed up {:7.1f}x".format(
+        n_securities, len(dates), t1 - t0, t2 - t1, (t1 - t0) / (t2 - t1)))
+
+
+if __name__ == "__main__":
+    for n in [100, 500, 3000]:
+        run(n_securities=n)
@@ -0,0 +1,58 @@
+# encoding: utf-8
+"""
+Benchmark of DataApi throughput against LocalDataServer with injected latency:
+sequential queries of one session against concurrent queries over several sessions (call_async).
+
+Run: python benchmark_data_api.py
+
+"""
+from __future__ import print_function
+import time
+
+import numpy as np
+import pandas as pd
+
+from jaqs.data import DataApi
+from jaqs.data.dataapi.local_server import LocalDataServer
+
+
+def make_daily(n_symbols=500, n_dates=250, seed=0):
+    rs = np.random.RandomState(seed)
+    symbols = ['{:06d}.SZ'.format(i) for i in range(n_symbols)]
+    dates = pd.bdate_range('20170101', periods=n_dates).strftime('%Y%m%d').astype(int)
+    n = n_symbols * n_dates
+    return pd.DataFrame({'symbol': np.repeat(symbols, n_dates), 'trade_date': np.tile(dates, n_symbols),
+                         'open': rs.rand(n), 'high': rs.rand(n), 'low': rs.rand(n), 'close': rs.rand(n),
+                         'volume': rs.randint(0, 10 ** 8, size=n)}), symbols
+
+
+def run(latency=0.05, n_sessions=4):
+    df_daily, symbols = make_daily()
+    server = LocalDataServer(tables={'daily': df_daily}, latency=latency).start()
+    api = DataApi(server.addr, n_sessions=n_sessions)
+    api.login('user', 'password')
+    time.sleep(0.5)
+    try:
+        queries = [symbols[i:i + 10] for i in range(0, 200, 10)]
+
+        t0 = time.time()
+        for q in queries:
+            df, msg = api.daily(','.join(q), start_date=20170101, end_date=20171231)
+        t1 = time.time()
+        futures = [api.call_async('daily', ','.join(q), start_date=20170101, end_date=20171231) for q in queries]
+        results = [future.result() for future in futures]
+        t2 = time.time()
+
+        assert all(msg == '0,' for _, msg in results)
+        n_rows = sum(len(df) for df, _ in results)
+        print("{:d} queries, {:d} rows, latency {:.3f}s: sequential {:7.3f}s, concurrent ({:d} sessions) {:7.3f}s, "
+              "speed up {:5.1f}x".format(len(queries), n_rows, latency, t1 - t0, n_sessions, t2 - t1,
+                                         (t1 - t0) / (t2 - t1)))
+    finally:
+        api.close()
+        server.close()
+
+
+if __name__ == "__main__":
+    for latency in [0.0, 0.05]:
+        run(latency=latency)
@@ -0,0 +1,68 @@
+# encoding: utf-8
+"""
+Benchmark of decoding a large daily result (1M rows) into DataFrame:
+unpacking the msgpack / snappy message, then utils.extract_result against the previous
+implementation, which converts long_nan of integer columns element by element.
+
+Run: python benchmark_decode.py
+
+"""
+from __future__ import print_function
+import time
+
+import numpy as np
+import pandas as pd
+
+from jaqs.data.dataapi import jrpc_py
+from jaqs.data.dataapi import utils
+
+
+def _to_dataframe_loop(cloumset):
+    """The previous implementation of utils._to_dataframe, used as reference."""
+    df = pd.DataFrame(cloumset)
+    for col in df.columns:
+        if df.dtypes.loc[col] == np.int64:
+            df.loc[:, col] = df.loc[:, col].apply(utils.to_nan)
+    return df
+
+
+def make_message(n_rows, seed=0):
+    rs = np.random.RandomState(seed)
+    n_symbols = 1000
+    symbols = ['{:06d}.SZ'.format(i) for i in range(n_symbols)]
+    volume = rs.randint(0, 10 ** 8, size=n_rows)
+    volume[rs.rand(n_rows) < 0.01] = utils.long_nan
+    result = {'symbol': [symbols[i % n_symbols] for i in range(n_rows)],
+              'trade_date': (20100101 + np.arange(n_rows) // n_symbols).tolist(),
+              'open': rs.rand(n_rows).tolist(),
+              'high': rs.rand(n_rows).tolist(),
+              'low': rs.rand(n_rows).tolist(),
+              'close': rs.rand(n_rows).tolist(),
+              'volume': volume.tolist(),
+              'turnover': rs.rand(n_rows).tolist(),
+              'oi': np.full(n_rows, utils.long_nan).tolist()}
+    msg = {'jsonrpc': '2.0', 'id': '1', 'result': result, 'error': {'error': 0}}
+    return jrpc_py._pack_msgpack_snappy(msg)
+
+
+def run(n_rows=1000000):
+    data = make_message(n_rows)
+
+    t0 = time.time()
+    cr = jrpc_py._unpack_msgpack_snappy(data)
+    t1 = time.time()
+    df_loop = _to_dataframe_loop(cr['result'])
+    t2 = time.time()
+    df, msg = utils.extract_result(cr, data_format='pandas')
+    t3 = time.time()
+
+    assert msg == '0,'
+    assert np.allclose(df['volume'].values, df_loop['volume'].values.astype(float), equal_nan=True)
+    assert df['symbol'].equals(df_loop['symbol'])
+    print("{:8d} rows ({:.1f} MB): unpack {:7.3f}s, to DataFrame: loop {:7.3f}s, columnar {:7.3f}s, "
+          "speed up {:5.1f}x".format(n_rows, len(data) / 1e6, t1 - t0, t2 - t1, t3 - t2, (t2 - t1) / (t3 - t2)))
+
+
+if __name__ == "__main__":
+    for n in [10000, 100000, 1000000]:
+        run(n_rows=n)
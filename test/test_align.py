@@ -1,5 +1,6 @@
 # encoding: utf-8
 from __future__ import print_function
+import numpy as np
 import pandas as pd
 from jaqs.data import RemoteDataService
 from jaqs.data import Parser
@@ -61,6 +62,52 @@ def test_align():
     assert abs(df_res.loc[20170427, sec] - 42360000000) < 1
 
 
+def test_align_point_in_time():
+    from jaqs.data.align import align
+    report_dates = [20160331, 20160630, 20160930, 20161231]
+    # the second column announces 20160630 later than 20160930, and never announces 20161231
+    df_ann = pd.DataFrame(index=report_dates, columns=['a', 'b'],
+                          data=[[20160420, 20160425], [20160820, 20161030], [20161025, 20161020], [20170410, np.nan]])
+    df_value = pd.DataFrame(index=report_dates, columns=['a', 'b'], data=[[1., 10.], [2., 20.], [3., 30.], [4., 40.]])
+    dates = [20160401, 20160420, 20160424, 20160425, 20160901, 20161021, 20161031, 20170501]
+
+    res = align(df_value, df_ann, dates)
+    expected = [[np.nan, np.nan], [1., np.nan], [1., np.nan], [1., 10.], [2., 10.], [2., 30.], [3., 30.], [4., 30.]]
+    assert np.allclose(res.values, np.array(expected), equal_nan=True)
+    assert list(res.index) == dates
+
+    df_code = df_value.astype(int).astype(str)
+    res = align(df_code, df_ann, dates)
+    assert res.loc[20161021, 'b'] == '30'
+    assert res.loc[20160401, 'a'] != res.loc[20160401, 'a']  # NaN
+
+
+def test_announcement_index():
+    from jaqs.data.align import align, AnnouncementIndex
+    report_dates = [20160331, 20160630, 20160930]
+    df_ann = pd.DataFrame(index=report_dates, columns=['a', 'b', 'c'],
+                          data=[[20160420, 20160425, np.nan], [20160820, 20161030, 20160801], [20161025, 20161020, np.nan]])
+    df_value = pd.DataFrame(index=report_dates, columns=['a', 'b', 'c'], data=np.arange(9.).reshape(3, 3))
+    dates = [20160401, 20160425, 20160901, 20161021, 20161031]
+
+    ann_index = AnnouncementIndex(df_ann, dates)
+    assert ann_index.matches(df_ann.copy(), np.array(dates))
+    assert not ann_index.matches(df_ann, dates[1:])
+    assert ann_index.align(df_value).equals(align(df_value, df_ann, dates))
+
+    sub = df_value.loc[:, ['c', 'a']]
+    assert ann_index.align(sub).equals(align(sub, df_ann.loc[:, ['c', 'a']], dates))
+
+    # parser expands quarterly variables with the shared index
+    parser = Parser()
+    parser.parse('q / d')
+    df_daily = pd.DataFrame(index=dates, columns=['a', 'b', 'c'], data=2.0)
+    res = parser.evaluate({'q': df_value, 'd': df_daily}, ann_dts=df_ann, trade_dts=np.array(dates),
+                          ann_index=ann_index)
+    assert parser.ann_index is ann_index
+    assert np.allclose(res.values, ann_index.align(df_value).values / 2.0, equal_nan=True)
+
+
 if __name__ == "__main__":
     import time
     t_start = time.time()
@@ -0,0 +1,51 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import asyncio
+
+from jaqs.data.dataapi import AsyncDataApi
+
+from test_jrpc import EchoServer
+
+
+def test_async_data_api():
+    server = EchoServer(n_quotes=5)
+
+    async def main():
+        api = AsyncDataApi(server.addr)
+        try:
+            r, msg = await api.login('user', 'password')
+            assert r and msg == '0,'
+
+            # concurrent queries on one socket
+            filters = ['symbol=S{}'.format(i) for i in range(20)]
+            results = await asyncio.gather(*[api.query('lb.secIndustry', filter=f) for f in filters])
+            assert [df['filter'].iloc[0] for df, msg in results] == filters
+            df, msg = await api.call_async('daily', 'S1', start_date=20170103, end_date=20170301)
+            assert msg == '0,' and df['begin_date'].iloc[0] == 20170103
+            df, msg = await api.daily('S1', start_date=None, end_date=20170301)
+            assert df == -1 and msg == "Begin date format error"
+
+            quotes = api.quotes()
+            slow_quotes = api.quotes(max_size=2)
+            symbols, msg = await api.subscribe('S1,S2')
+            assert symbols == 'S1,S2'
+            received = []
+            async for quote in quotes:
+                received.append(quote)
+                if len(received) == 5:
+                    break
+            assert [quote['last'] for quote in received] == list(range(5))
+            assert received[0]['symbol'] == 'S1'
+            # the slow consumer only keeps the latest quotes
+            assert slow_quotes.n_dropped == 3
+            assert (await slow_quotes.__anext__())['last'] == 3
+        finally:
+            api.close()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(asyncio.wait_for(main(), 30))
+    finally:
+        loop.close()
+        server.close()
@@ -0,0 +1,172 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import numpy as np
+import pandas as pd
+
+from jaqs.data import DataView
+from jaqs.trade import common, model, AlphaStrategy, PortfolioManager, AlphaTradeApi
+from jaqs.trade.tradegateway import DailyStockSimulator, fills_to_df, fills_to_trades
+from jaqs.trade.sweep import run_alpha_backtest
+
+# saved by test_backtest_alpha.test_save_dataview
+dataview_dir_path = '../output/wine_industry_momentum/dataview'
+
+BENCHMARK = '399997.SZ'
+
+
+def _actions(*actions):
+    res = np.empty(len(actions), dtype=object)
+    res[:] = actions
+    return res
+
+
+def test_simulator_match_batch():
+    sim = DailyStockSimulator()
+    sim.on_new_day(20170104)
+    entrust_no = sim.add_batch_order(20170104001, np.array(['A', 'B'], dtype=object),
+                                     _actions(common.ORDER_ACTION.BUY, common.ORDER_ACTION.SELL),
+                                     np.array([100.0, 50.0]), 'vwap')
+    assert list(entrust_no) == ['1', '2']
+    assert not sim.match_finished
+
+    prices = pd.DataFrame(index=['B', 'A', 'C'], data={'vwap': [2.0, 1.0, 3.0], 'close': [0.0, 0.0, 0.0]})
+    fills = sim.match_batch(prices, date=20170104, time=143000)
+    assert sim.match_finished
+    assert list(fills['symbol']) == ['A', 'B']
+    assert list(fills['fill_price']) == [1.0, 2.0]
+    assert list(fills['fill_size']) == [100.0, 50.0]
+    assert list(fills['fill_no']) == ['201701040001', '201701040002']
+    assert len(sim.match_batch(prices, date=20170105)) == 0
+
+    # same as dict of prices
+    sim.add_batch_order(1, np.array(['C'], dtype=object), _actions(common.ORDER_ACTION.BUY), np.array([1.0]), 'close')
+    fills2 = sim.match_batch({'C': {'vwap': 3.0, 'close': 4.0}}, date=20170105)
+    assert fills2['fill_price'][0] == 4.0 and fills2['entrust_no'][0] == '3'
+
+    df = fills_to_df(fills)
+    assert list(df['task_id']) == ['20170104001'] * 2
+    assert list(df['trade_date']) == [20170104] * 2
+
+    trades = fills_to_trades(fills)
+    assert trades[1].symbol == 'B' and trades[1].fill_size == 50.0 and trades[1].trade_date == 20170104
+    assert common.ORDER_ACTION.is_negative(trades[1].entrust_action)
+
+
+def test_apply_fills():
+    sim = DailyStockSimulator()
+    sim.add_batch_order(1, np.array(['A', 'B'], dtype=object),
+                        _actions(common.ORDER_ACTION.BUY, common.ORDER_ACTION.BUY), np.array([100.0, 50.0]), 'vwap')
+    fills = sim.match_batch({'A': {'vwap': 1.0}, 'B': {'vwap': 2.0}}, date=20170104)
+
+    pm = PortfolioManager()
+    pm.init_balance = pm.cash = 1000.0
+    pm.apply_fills(fills)
+    assert pm.get_pos('A') == 100.0 and pm.get_pos('B') == 50.0
+    assert pm.holding_securities == {'A', 'B'}
+    assert np.isclose(pm._cum_net_turnover, 200.0)
+    assert len(pm.fills) == 1 and len(pm.trades) == 0
+
+    sim.add_batch_order(2, np.array(['A'], dtype=object), _actions(common.ORDER_ACTION.SELL), np.array([100.0]),
+                        'vwap')
+    pm.original_on_trade = lambda ind: None
+    pm.apply_fills(sim.match_batch({'A': {'vwap': 1.5}}, date=20170105), materialize=True)
+    assert pm.get_pos('A') == 0 and 'A' not in pm.holding_securities
+    assert len(pm.fills) == 1 and len(pm.trades) == 1
+    assert np.isclose(pm.cash, 1000.0 - 200.0 + 150.0)
+
+
+def test_goal_portfolio_batch():
+    tapi, pm = AlphaTradeApi(), PortfolioManager()
+    context = model.Context(trade_api=tapi, pm=pm, strategy=AlphaStrategy())
+    props = {'init_balance': 1000.0, 'batch_fill': True, 'commission_rate': 1E-3}
+    pm.init_from_config(props)
+    tapi.init_from_config(props)
+    prices = pd.DataFrame(index=['A', 'B'], data={'vwap': [2.0, 5.0]})
+
+    context.trade_date = 20170104
+    tapi.goal_portfolio([{'symbol': 'A', 'size': 100.0}, {'symbol': 'B', 'size': 0.0}])
+    assert not tapi.match_finished
+    fills = tapi.match_batch(prices)
+    assert tapi.match_finished
+    assert len(fills) == 1 and fills['entrust_action'][0] is common.ORDER_ACTION.BUY
+    assert np.isclose(fills['commission'][0], 0.2)
+    # a buy increases the position and spends cash
+    assert pm.get_pos('A') == 100.0 and pm.holding_securities == {'A'}
+    assert np.isclose(pm._cum_net_turnover, 200.0)
+
+    context.trade_date = 20170105
+    tapi.goal_portfolio([{'symbol': 'A', 'size': 40.0}, {'symbol': 'B', 'size': 10.0}])
+    fills2 = tapi.match_batch(prices)
+    assert list(fills2['symbol']) == ['A', 'B']
+    assert pm.get_pos('A') == 40.0 and pm.get_pos('B') == 10.0
+    assert np.isclose(pm._cum_net_turnover, 200.0 - 120.0 + 50.0)
+    assert all(task.is_finished for task in pm.tasks.values())
+
+    # same positions and cash as trades passed to on_trade one by one
+    legacy = PortfolioManager()
+    model.Context(pm=legacy, strategy=AlphaStrategy())
+    legacy.init_from_config(props)
+    for ind in fills_to_trades(np.concatenate([fills, fills2])):
+        legacy.ctx.strategy.on_trade(ind)
+    assert legacy.holding_securities == pm.holding_securities
+    assert legacy.get_pos('A') == 40.0 and legacy.get_pos('B') == 10.0
+    assert np.isclose(legacy.cash, pm.cash)
+
+
+def build():
+    stock_selector = model.StockSelector()
+    stock_selector.add_filter(name='rank_ret_top10', func=lambda context, user_options=None:
+                              context.snapshot['rank_ret'] >= 0.9)
+    return AlphaStrategy(stock_selector=stock_selector, pc_method='equal_weight')
+
+
+def test_backtest_batch_fill():
+    dv = DataView()
+    dv.load_dataview(folder_path=dataview_dir_path)
+    props = {"benchmark": BENCHMARK,
+             "universe": ','.join(dv.symbol),
+             "start_date": dv.start_date,
+             "end_date": dv.end_date,
+             "period": "week",
+             "days_delay": 0,
+             "init_balance": 1e8,
+             "position_ratio": 1.0,
+             "commission_rate": 1E-3,
+             }
+
+    df_legacy = run_alpha_backtest(dv, build(), props).get_trades_df()
+
+    props_batch = dict(props, batch_fill=True)
+    bt = run_alpha_backtest(dv, build(), props_batch)
+    assert len(bt.ctx.pm.trades) == 0
+    df_batch = bt.get_trades_df()
+
+    props_batch['materialize_trades'] = True
+    bt = run_alpha_backtest(dv, build(), props_batch)
+    assert len(bt.ctx.pm.fills) == 0
+    df_materialized = bt.get_trades_df()
+
+    for df in [df_batch, df_materialized]:
+        assert df.shape == df_legacy.shape
+        for col in ['symbol', 'fill_no', 'task_id']:
+            assert (df[col].values == df_legacy[col].values).all()
+        is_buy = df['entrust_action'].apply(common.ORDER_ACTION.is_positive)
+        assert (is_buy.values == df_legacy['entrust_action'].apply(common.ORDER_ACTION.is_positive).values).all()
+        for col in ['fill_price', 'fill_size', 'commission']:
+            assert np.allclose(df[col].values, df_legacy[col].values)
+
+
+if __name__ == "__main__":
+    import time
+    t_start = time.time()
+
+    g = globals()
+    g = {k: v for k, v in g.items() if k.startswith('test_') and callable(v)}
+    for test_name, test_func in g.items():
+        print("\n==========\nTesting {:s}...".format(test_name))
+        test_func()
+    print("Test Complete.")
+
+    t3 = time.time() - t_start
+    print("\n\n\nTime lapsed in total: {:.1f}".format(t3))
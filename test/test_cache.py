@@ -0,0 +1,138 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from jaqs.data import RemoteDataService
+from jaqs.data.cache import QueryCache
+from jaqs.data.dataservice import QueryDataError
+
+CACHE_DIR = os.path.abspath('../output/tests/test_cache')
+
+
+class FakeDataApi(object):
+    """Logged-in stand-in of DataApi, counts calls."""
+    _loggined = True
+    _connected = True
+
+    def __init__(self):
+        self.n_calls = 0
+
+    def daily(self, symbol, start_date, end_date, fields="", adjust_mode=None, data_format=""):
+        self.n_calls += 1
+        df = pd.DataFrame({'symbol': symbol, 'trade_date': [start_date, end_date], 'close': [1.0, 2.0]})
+        return df, '0,'
+
+    def query(self, view, filter="", fields="", **kwargs):
+        self.n_calls += 1
+        return pd.DataFrame({'trade_date': [20170103, 20170104]}), '0,'
+
+
+@pytest.fixture
+def cache_dir():
+    if os.path.exists(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
+    yield CACHE_DIR
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+def test_cache_put_get(cache_dir):
+    cache = QueryCache(cache_dir)
+    df = pd.DataFrame({'symbol': [u'000001.SZ', u'600030.SH'], 'close': [1.5, np.nan],
+                       'volume': [100, 200], 'mixed': [u'a', np.nan]})
+    key = cache.make_key('daily', symbol='000001.SZ', start_date=20170101, end_date=20170201)
+    assert key == cache.make_key('daily', end_date=20170201, start_date=20170101, symbol='000001.SZ')
+    cache.put(key, df)
+
+    # entries survive re-opening the cache
+    df2 = QueryCache(cache_dir).get(key)
+    assert df2.equals(df)
+    assert df2['symbol'].dtype == object
+
+    # expired entries are dropped, unless offline
+    cache.put('expired', df, expire=time.time() - 1)
+    assert QueryCache(cache_dir, offline=True).get('expired') is not None
+    assert cache.get('expired') is None
+    assert 'expired' not in cache
+
+
+def test_cache_lru(cache_dir):
+    df = pd.DataFrame({'x': np.random.rand(1000)})
+    cache = QueryCache(cache_dir)
+    for key in ['a', 'b', 'c']:
+        cache.put(key, df)
+        time.sleep(0.01)
+    cache.get('a')
+    cache.max_size = cache.size - 1
+    cache.put('d', df)
+    assert 'b' not in cache and 'c' not in cache
+    assert 'a' in cache and 'd' in cache
+    assert not os.path.exists(os.path.join(cache_dir, 'b.npz'))
+
+
+def test_cache_index_written_on_put_and_flush(cache_dir):
+    df = pd.DataFrame({'x': np.arange(3.0)})
+    cache = QueryCache(cache_dir)
+    cache.put('a', df)
+    index_path = os.path.join(cache_dir, QueryCache.INDEX_FILE_NAME)
+    with open(index_path) as f:
+        index_orig = f.read()
+    last_access = cache._entries['a']['last_access']
+
+    # a hit only updates access time in memory
+    time.sleep(0.01)
+    assert cache.get('a').equals(df)
+    with open(index_path) as f:
+        assert f.read() == index_orig
+    assert cache._entries['a']['last_access'] > last_access
+
+    cache.flush()
+    assert QueryCache(cache_dir)._entries['a']['last_access'] == cache._entries['a']['last_access']
+    assert not [name for name in os.listdir(cache_dir) if name.endswith('.tmp')]
+
+
+def test_cache_expire_policy(cache_dir):
+    cache = QueryCache(cache_dir, ttl={'lb.secIndustry': 3600})
+    now = time.mktime((2017, 9, 1, 10, 0, 0, 0, 0, -1))
+    # trade calendar is queried up to a future date, so dates published later are queried again
+    cal_filter = {'view': 'jz.secTradeCal', 'filter': 'start_date=19900101&end_date=20991231'}
+    assert cache.get_expire_time('query', cal_filter, now) == time.mktime((2017, 9, 1, 16, 0, 0, 0, 0, -1))
+    assert cache.get_expire_time('daily', {'end_date': 20170831}, now) is None
+    expire = cache.get_expire_time('daily', {'end_date': 20170901}, now)
+    assert expire == time.mktime((2017, 9, 1, 16, 0, 0, 0, 0, -1))
+    assert cache.get_expire_time('daily', {'end_date': 20170831, 'adjust_mode': 'pre'}, now) == now + 24 * 3600
+    fin_filter = {'view': 'lb.income', 'filter': 'symbol=600030.SH&start_date=20170101&end_date=20170630'}
+    assert cache.get_expire_time('query', fin_filter, now) is None
+    assert cache.get_expire_time('query', {'view': 'lb.secIndustry', 'filter': ''}, now) == now + 3600
+
+
+def test_remote_data_service_cache(cache_dir):
+    ds = RemoteDataService()
+    data_api_orig, cache_orig = ds.data_api, ds.cache
+    api = FakeDataApi()
+    ds.data_api = api
+    try:
+        ds.set_cache(QueryCache(cache_dir))
+        df, msg = ds.daily('000001.SZ', 20170103, 20170104)
+        df2, msg2 = ds.daily('000001.SZ', 20170103, 20170104)
+        assert api.n_calls == 1
+        assert df.equals(df2) and msg2 == '0,'
+        dates = ds.query_trade_dates(20170101, 20170110)
+        assert list(ds.query_trade_dates(20170101, 20170110)) == list(dates)
+        assert api.n_calls == 2
+
+        # offline mode needs no data api
+        ds.data_api = None
+        ds.set_cache(QueryCache(cache_dir, offline=True))
+        df3, _ = ds.daily('000001.SZ', 20170103, 20170104)
+        assert df3.equals(df)
+        with pytest.raises(QueryDataError):
+            ds.daily('600030.SH', 20170103, 20170104)
+    finally:
+        ds.data_api, ds.cache = data_api_orig, cache_orig
@@ -0,0 +1,115 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import numpy as np
+import pandas as pd
+
+from jaqs.data import DataView
+from jaqs.data.basic import Position
+from jaqs.trade import common, PortfolioManager
+from jaqs.trade.corporate_action import (CorporateActionLedger, adjustments_to_df,
+                                         POSITION_ADJUST_NO, DELIST_ADJUST_NO, CASH_ADJUST_NO)
+
+
+def _make_ledger():
+    L = CorporateActionLedger
+    return L(dates=[20170105, 20170104, 20170104, 20170106, 20170104],
+             symbols=['A', 'A', 'A', 'B', 'C'],
+             kinds=[L.DELIST, L.SPLIT, L.CASH, L.SPLIT, L.SPLIT],
+             values=[9.5, 1.5, 0.2, 2.0, 1.1],
+             fill_dates=[20170104, 20170104, 20170104, 20170106, 20170104],
+             fill_times=[150000, 200000, 200000, 200000, 200000])
+
+
+def test_ledger_adjustments():
+    ledger = _make_ledger()
+    # sorted by date, cash before split on the same date
+    assert list(ledger.dates) == [20170104, 20170104, 20170104, 20170105, 20170106]
+    assert list(ledger.kinds[:2]) == [CorporateActionLedger.CASH, CorporateActionLedger.SPLIT]
+    assert ledger.get_events(20170104, 20170106) == slice(3, 5)
+
+    records = ledger.get_adjustments(20170103, 20170106, {'A': 100.0, 'B': -10.0})
+    assert list(records['symbol']) == ['A', 'A', 'A', 'A', 'B']
+    assert list(records['fill_no']) == [CASH_ADJUST_NO, CASH_ADJUST_NO, POSITION_ADJUST_NO, DELIST_ADJUST_NO,
+                                        POSITION_ADJUST_NO]
+    # cash dividend of 100 shares
+    assert list(records['fill_price'][:2]) == [0.0, 1.0]
+    assert np.allclose(records['fill_size'][:2], 20.0)
+    assert list(records['entrust_action'][:2]) == [common.ORDER_ACTION.BUY, common.ORDER_ACTION.SELL]
+    # split, then the enlarged position is closed
+    assert np.isclose(records['fill_size'][2], 50.0)
+    assert records['entrust_action'][3] == common.ORDER_ACTION.SELL
+    assert np.isclose(records['fill_size'][3], 150.0) and records['fill_price'][3] == 9.5
+    # short position grows by a split
+    assert records['entrust_action'][4] == common.ORDER_ACTION.SELL and records['fill_size'][4] == 10.0
+
+    records = ledger.get_adjustments(20170104, 20170106, {'A': 100.0, 'C': 10.0}, fill_date=20170107)
+    assert len(records) == 1 and records['fill_date'][0] == 20170107
+    assert len(ledger.get_adjustments(20170103, 20170106, {'D': 1.0})) == 0
+
+
+def test_apply_adjustments():
+    pm = PortfolioManager()
+    pm.init_balance = pm.cash = 1000.0
+
+    records = _make_ledger().get_adjustments(20170103, 20170104, {'A': 100.0})
+    pm.positions['A'] = Position(symbol='A')
+    pm.positions['A'].current_size = 100.0
+    pm.holding_securities.add('A')
+    pm.apply_adjustments(records)
+    assert pm.get_pos('A') == 150.0
+    assert np.isclose(pm._cum_net_turnover, -20.0)
+
+    assert pm.holding_securities == {'A'} and np.isclose(pm.cash, 1000.0 + 20.0)
+
+    records = _make_ledger().get_adjustments(20170104, 20170105, {'A': 150.0})
+    assert records['entrust_action'][0] is common.ORDER_ACTION.SELL
+    pm.apply_adjustments(records)
+    assert pm.get_pos('A') == 0 and 'A' not in pm.holding_securities
+    assert np.isclose(pm.cash, 1000.0 + 20.0 + 150 * 9.5)
+
+    df = adjustments_to_df(np.concatenate(pm.adjustments))
+    assert len(df) == 4
+    assert list(df['fill_no']) == ['0', '0', '101010', '202020']
+    assert list(df['trade_date']) == [20170104] * 4
+    assert list(df['entrust_action'].apply(common.ORDER_ACTION.is_positive)) == [True, False, True, False]
+
+
+def test_ledger_from_dataview():
+    dates = [20170103, 20170104, 20170105, 20170106]
+    symbols = ['000001.SZ', '600030.SH']
+    cols = pd.MultiIndex.from_product([symbols, ['close', '_daily_adjust_factor']], names=['symbol', 'field'])
+    df = pd.DataFrame(index=pd.Index(dates, name='trade_date'), columns=cols)
+    df.loc[:, pd.IndexSlice[:, 'close']] = np.arange(8, dtype=float).reshape(4, 2)
+    df.loc[:, pd.IndexSlice[:, '_daily_adjust_factor']] = [[1.0, 1.0], [1.2, 0.9], [1.0, np.nan], [1.0, 2.0]]
+
+    dv = DataView()
+    dv.data_d = df
+    dv.fields = ['close', '_daily_adjust_factor']
+    dv.symbol = symbols
+    dv.start_date, dv.end_date = 20170103, 20170106
+    dv._data_inst = pd.DataFrame(index=pd.Index(symbols + ['000002.SZ'], name='symbol'),
+                                 data={'delist_date': [99999999, 20170106, 20170105]})
+
+    ledger = CorporateActionLedger.from_dataview(dv, 20170103, 20170106)
+    L = CorporateActionLedger
+    assert list(ledger.dates) == [20170104, 20170106, 20170106]
+    assert list(ledger.symbols) == ['000001.SZ', '600030.SH', '600030.SH']
+    assert list(ledger.kinds) == [L.SPLIT, L.SPLIT, L.DELIST]
+    # de-listed at close of the last trade date before delist_date
+    assert ledger.values[2] == 5.0 and ledger.fill_dates[2] == 20170105 and ledger.fill_times[2] == 150000
+
+
+if __name__ == "__main__":
+    import time
+    t_start = time.time()
+
+    g = globals()
+    g = {k: v for k, v in g.items() if k.startswith('test_') and callable(v)}
+    for test_name, test_func in g.items():
+        print("\n==========\nTesting {:s}...".format(test_name))
+        test_func()
+    print("Test Complete.")
+
+    t3 = time.time() - t_start
+    print("\n\n\nTime lapsed in total: {:.1f}".format(t3))
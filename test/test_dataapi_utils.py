@@ -0,0 +1,49 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import numpy as np
+import pandas as pd
+
+from jaqs.data.dataapi import utils
+
+
+def _to_dataframe_reference(cloumset):
+    """The previous implementation: convert long_nan element by element."""
+    df = pd.DataFrame(cloumset)
+    for col in df.columns:
+        if df.dtypes.loc[col] == np.int64:
+            df[col] = df[col].apply(utils.to_nan)
+    return df
+
+
+def test_extract_result_pandas():
+    result = {'symbol': [u'600030.SH', u'000001.SZ', u'000002.SZ'],
+              'trade_date': [20170103, 20170103, 20170104],
+              'close': [1.5, 2.0, 3.25],
+              'volume': [100, utils.long_nan, 300],
+              'suspended': [True, False, False],
+              'name': [u'a', None, u'c'],
+              'oi': [1, None, 2.0]}
+    df, msg = utils.extract_result({'result': result, 'error': {'error': 0}}, data_format='pandas')
+    assert msg == '0,'
+    expected = _to_dataframe_reference(result)
+    assert list(df.columns) == list(result.keys())
+    assert list(df.dtypes) == list(expected.dtypes)
+    assert df['trade_date'].dtype == np.int64 and df['symbol'].dtype == object
+    assert np.isnan(df['volume'].iloc[1]) and np.isnan(df['oi'].iloc[1])
+    assert df.equals(expected)
+
+    df, msg = utils.extract_result({'result': result, 'error': {'error': 0}}, data_format='pandas',
+                                   index_column='symbol')
+    assert list(df.index) == result['symbol'] and df.index.name is None
+
+    # empty result
+    df, msg = utils.extract_result({'result': {'symbol': [], 'close': []}}, data_format='pandas')
+    assert df.shape == (0, 2)
+
+
+def test_extract_result_obj():
+    rows = [{'symbol': '600030.SH', 'close': 1.0}, {'symbol': '000001.SZ', 'close': 2.0}]
+    res, msg = utils.extract_result({'result': rows, 'error': {'error': 0}}, data_format='obj', class_name='Quote')
+    assert [r.symbol for r in res] == ['600030.SH', '000001.SZ']
+    assert type(res[0]) is type(res[1])
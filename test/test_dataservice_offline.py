@@ -0,0 +1,127 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from jaqs.data import RemoteDataService
+from jaqs.data import align
+from jaqs.data.cache import QueryCache
+
+DATES = pd.bdate_range('20161201', '20170331').strftime('%Y%m%d').astype(int).values
+
+
+class FakeDataApi(object):
+    """Logged-in stand-in of DataApi answering trade calendar, index components and industry."""
+    _loggined = True
+    _connected = True
+
+    def __init__(self):
+        self.n_calls = 0
+
+    def query(self, view, filter="", fields="", **kwargs):
+        self.n_calls += 1
+        if view == 'jz.secTradeCal':
+            return pd.DataFrame({'trade_date': DATES}), '0,'
+        elif view == 'lb.indexCons':
+            df = pd.DataFrame({'symbol': ['A', 'A', 'B', 'C', 'D', 'D'],
+                               'in_date': ['20161215', '20170110', '20161101', '20170301', '20170105', '20170201'],
+                               'out_date': ['20170105', '', '20170120', '20170301', '20170301', '20170215']})
+            return df, '0,'
+        elif view == 'lb.secIndustry':
+            df = pd.DataFrame({'symbol': ['A', 'A', 'B', 'B', 'B'],
+                               'in_date': [20170110, 20161101, 20170201, 20161205, 20170201],
+                               'industry1_code': ['a2', 'a1', 'b2', 'b1', 'b2'],
+                               'industry1_name': ['', '', '', '', '']})
+            return df, '0,'
+        raise ValueError(view)
+
+
+def _index_member_daily_loop(df_io, dates):
+    """The previous implementation of query_index_member_daily, used as reference."""
+    df_io = df_io.copy()
+    for col in ['in_date', 'out_date']:
+        df_io[col] = df_io[col].apply(lambda s: int(s) if s else 99999999)
+    dic = dict()
+    for sec, df in df_io.groupby(by='symbol'):
+        mask = np.zeros_like(dates, dtype=np.int64)
+        for idx, row in df.iterrows():
+            mask[np.logical_and(dates > row['in_date'], dates < row['out_date'])] = 1
+        dic[sec] = mask
+    res = pd.DataFrame(index=dates, data=dic)
+    res.index.name = 'trade_date'
+    return res
+
+
+def _industry_daily_loop(df_raw, symbol, dates, level=1):
+    """The previous implementation of query_industry_daily, used as reference."""
+    dic_sec = {sec: df.sort_values(by='in_date', axis=0).reset_index() for sec, df in df_raw.groupby('symbol')}
+    df_ann_tmp = pd.concat({sec: df.loc[:, 'in_date'] for sec, df in dic_sec.items()}, axis=1)
+    df_value_tmp = pd.concat({sec: df.loc[:, 'industry{:d}_code'.format(level)] for sec, df in dic_sec.items()},
+                             axis=1)
+    idx = np.unique(np.concatenate([df.index.values for df in dic_sec.values()]))
+    symbol_arr = np.sort(symbol.split(','))
+    df_ann = pd.DataFrame(index=idx, columns=symbol_arr, data=np.nan)
+    df_ann.loc[df_ann_tmp.index, df_ann_tmp.columns] = df_ann_tmp
+    df_value = pd.DataFrame(index=idx, columns=symbol_arr, data=np.nan)
+    df_value.loc[df_value_tmp.index, df_value_tmp.columns] = df_value_tmp
+    df_industry = align.align(df_value, df_ann, dates)
+    return df_industry.fillna(method='bfill').astype(str)
+
+
+def test_index_member_and_industry_daily():
+    ds = RemoteDataService()
+    data_api_orig, cache_orig = ds.data_api, ds.cache
+    api = FakeDataApi()
+    ds.data_api = api
+    ds.set_cache(None)
+    try:
+        start, end = 20161201, 20170331
+        dates = ds.query_trade_dates(start, end)
+
+        res = ds.query_index_member_daily('000300.SH', start, end)
+        df_io, _ = api.query('lb.indexCons')
+        expected = _index_member_daily_loop(df_io, dates)
+        assert res.equals(expected)
+        assert res.loc[20170301, 'C'] == 0 and res.loc[20170210, 'D'] == 1
+
+        # memorized per arguments, returned as copies
+        n_calls = api.n_calls
+        res2 = ds.query_index_member_daily('000300.SH', start, end)
+        assert api.n_calls == n_calls and res2.equals(res)
+        res2.iloc[0, 0] = -1
+        assert ds.query_index_member_daily('000300.SH', start, end).equals(res)
+
+        # least recently used results are dropped beyond MEMO_SIZE
+        ds.MEMO_SIZE = 2
+        try:
+            ds.query_index_member_daily('000300.SH', start, 20170228)
+            ds.query_index_member_daily('000300.SH', start, end)
+            ds.query_index_member_daily('000300.SH', start, 20170131)
+            assert len(ds._memo) == 2
+            assert ('index_member', '000300.SH', start, end) in ds._memo
+            assert ('index_member', '000300.SH', start, 20170228) not in ds._memo
+        finally:
+            del ds.MEMO_SIZE
+
+        # memo is dropped when cache changes
+        cache_dir = tempfile.mkdtemp()
+        try:
+            ds.set_cache(QueryCache(cache_dir))
+            n_calls = api.n_calls
+            res3 = ds.query_index_member_daily('000300.SH', start, end)
+            assert api.n_calls > n_calls and res3.equals(res)
+        finally:
+            ds.set_cache(None)
+            shutil.rmtree(cache_dir)
+
+        res = ds.query_industry_daily('A,B,E', start, end, type_='SW', level=1)
+        df_raw, _ = api.query('lb.secIndustry')
+        expected = _industry_daily_loop(df_raw.drop_duplicates(), 'A,B,E', dates)
+        assert res.equals(expected)
+        assert res.loc[20161201, 'A'] == 'a1' and res.loc[20170201, 'B'] == 'b2' and res.loc[20170201, 'E'] == 'nan'
+    finally:
+        ds.data_api, ds.cache = data_api_orig, cache_orig
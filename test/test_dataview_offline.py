@@ -0,0 +1,233 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import numpy as np
+import pandas as pd
+import pytest
+
+from jaqs.data import DataView
+from jaqs.data.dataservice import QueryDataError
+
+
+class FakeDataService(object):
+    """Deterministic in-memory stand-in of RemoteDataService, only supports daily market data."""
+    def __init__(self):
+        self.dates = pd.bdate_range('20161201', '20170331').strftime('%Y%m%d').astype(int).values
+        self.n_query_daily = 0
+
+    def query_trade_dates(self, start_date, end_date):
+        return self.dates[(self.dates >= start_date) & (self.dates <= end_date)]
+
+    def _price(self, symbol, dates):
+        base = 10.0 + sum(ord(c) for c in symbol) % 10
+        return base + np.sin(np.arange(len(self.dates)) / 3.0)[np.searchsorted(self.dates, dates)]
+
+    def daily(self, symbol, start_date, end_date, fields="", adjust_mode=None):
+        self.n_query_daily += 1
+        dates = self.query_trade_dates(start_date, end_date)
+        df_list = []
+        for sec in symbol.split(','):
+            close = self._price(sec, dates)
+            df = pd.DataFrame({'symbol': sec, 'trade_date': dates,
+                               'open': close - 0.1, 'high': close + 0.2, 'low': close - 0.2, 'close': close,
+                               'vwap': close, 'volume': 1e6, 'turnover': 1e7, 'trade_status': u'交易'})
+            df_list.append(df)
+        return pd.concat(df_list, axis=0, ignore_index=True), "0,"
+
+    def query_inst_info(self, symbol, inst_type="", fields=""):
+        symbols = symbol.split(',')
+        df = pd.DataFrame({'symbol': symbols, 'inst_type': 1, 'name': symbols,
+                           'list_date': 19900101, 'delist_date': 99999999,
+                           'buylot': 100, 'setlot': 100, 'pricetick': 0.01, 'multiplier': 1})
+        return df.set_index('symbol')
+
+    def query_adj_factor_daily(self, symbol, start_date, end_date, div=False):
+        dates = self.query_trade_dates(start_date, end_date)
+        return pd.DataFrame(index=dates, columns=sorted(symbol.split(',')), data=1.0)
+
+    # members of any index: {symbol: date of joining}
+    members = {'000001.SZ': 0, '600030.SH': 0, 'NEW.SH': 20170301}
+
+    def query_index_member(self, index, start_date, end_date):
+        return sorted(s for s, in_date in self.members.items() if in_date <= end_date)
+
+    def query_index_member_daily(self, index, start_date, end_date):
+        dates = self.query_trade_dates(start_date, end_date)
+        symbols = sorted(self.members)
+        data = (dates.reshape(-1, 1) >= np.array([self.members[s] for s in symbols])).astype(float)
+        return pd.DataFrame(index=pd.Index(dates, name='trade_date'), columns=symbols, data=data)
+
+    def query_index_weights_daily(self, index, start_date, end_date):
+        df = self.query_index_member_daily(index, start_date, end_date)
+        return df.div(df.sum(axis=1), axis=0)
+
+
+def _prepare(end_date):
+    ds = FakeDataService()
+    dv = DataView()
+    props = {'start_date': 20170103, 'end_date': end_date, 'symbol': '600030.SH,000001.SZ',
+             'fields': 'close,volume', 'freq': 1}
+    dv.init_from_config(props, ds)
+    dv.prepare_data()
+    dv.add_formula('ma5', 'Ts_Sum(close, 5) / 5', is_quarterly=False, within_index=False)
+    return dv, ds
+
+
+def test_update_to():
+    formulas = [('lead2', 'Delay(close, -2)'),
+                ('lead_ma', 'Ts_Mean(lead2, 3)'),
+                ('ewm', 'Ewma(close, 10)')]
+    dv_full, _ = _prepare(20170310)
+    dv, ds = _prepare(20170228)
+    for d in [dv_full, dv]:
+        for name, formula in formulas:
+            d.add_formula(name, formula, is_quarterly=False, within_index=False)
+    n_query = ds.n_query_daily
+
+    dv.update_to(20170310)
+    assert dv.end_date == 20170310
+    # one query for raw prices and one for adjusted prices
+    assert ds.n_query_daily - n_query == 2
+    assert dv.dates[-1] == dv_full.dates[-1]
+
+    # formulas looking forward are re-calculated on old dates, Ewma on all dates
+    for field in ['close', 'close_adj', 'adjust_factor', 'ma5', '_limit', 'lead2', 'lead_ma', 'ewm']:
+        df, df_full = dv.get_ts(field), dv_full.get_ts(field)
+        assert df.shape == df_full.shape
+        assert np.allclose(df.values, df_full.values, equal_nan=True)
+    assert dv.get_ts('lead2', start_date=20170227, end_date=20170227).notnull().all().all()
+    assert dv.formulas[0] == ['ma5', 'Ts_Sum(close, 5) / 5', False, 'camel', False]
+    assert [item[0] for item in dv.formulas] == ['ma5', 'lead2', 'lead_ma', 'ewm']
+
+
+def _prepare_universe(end_date):
+    dv = DataView()
+    props = {'start_date': 20170103, 'end_date': end_date, 'universe': '000300.SH',
+             'fields': 'close,volume', 'freq': 1}
+    dv.init_from_config(props, FakeDataService())
+    dv.prepare_data()
+    dv.add_formula('ma5', 'Ts_Sum(close, 5) / 5', is_quarterly=False, within_index=False)
+    return dv
+
+
+def test_update_to_universe():
+    dv_full = _prepare_universe(20170310)
+    dv = _prepare_universe(20170228)
+    # NEW.SH joins the index on 20170301, after end_date of dv
+    assert 'NEW.SH' in dv_full.symbol and 'NEW.SH' not in dv.symbol
+
+    dv.update_to(20170310)
+    assert dv.symbol == dv_full.symbol
+    assert 'NEW.SH' in dv.data_inst.index
+    for field in ['close', 'close_adj', 'index_member', 'index_weight', 'ma5', '_limit']:
+        df, df_full = dv.get_ts(field), dv_full.get_ts(field)
+        assert df.columns.equals(df_full.columns) and df.index.equals(df_full.index)
+        assert np.allclose(df.values.astype(float), df_full.values.astype(float), equal_nan=True)
+    # history before joining is queried as well
+    assert dv.get_ts('close').loc[20170103, 'NEW.SH'] == dv_full.get_ts('close').loc[20170103, 'NEW.SH']
+    assert dv.get_ts('index_member').loc[20170228, 'NEW.SH'] == 0
+    assert dv.get_ts('index_member').loc[20170301, 'NEW.SH'] == 1
+
+
+def test_lazy_formula():
+    dv, _ = _prepare(20170228)
+    dv.add_formula('ret', 'close / Delay(close, 1) - 1', is_quarterly=False, within_index=False, lazy=True)
+    dv.add_formula('ret2', 'ret * 2', is_quarterly=False, within_index=False, lazy=True)
+    assert 'ret2' in dv.fields
+    assert 'ret' not in dv._store_d and 'ret2' not in dv._store_d
+
+    # evaluate ret2 and its upstream ret on first use
+    ret2 = dv.get_ts('ret2')
+    assert 'ret' in dv._store_d
+    assert np.allclose(ret2.values, 2 * dv.get_ts('ret').values, equal_nan=True)
+    assert not dv._pending_formulas
+
+    # overwriting an upstream field invalidates downstream formulas transitively
+    dv.add_formula('ret', 'close / Delay(close, 2) - 1', is_quarterly=False, within_index=False)
+    assert dv._pending_formulas == {'ret2'}
+    close = dv.get_ts('close', start_date=dv.extended_start_date_d)
+    expected = (2 * (close / close.shift(2) - 1)).loc[dv.start_date:]
+    assert np.allclose(dv.get_ts('ret2').values, expected.values, equal_nan=True)
+
+    dv.remove_field('ret2')
+    assert 'ret2' not in dv.fields
+    assert [item[0] for item in dv.formulas] == ['ma5', 'ret']
+
+
+def test_lazy_formula_snapshot():
+    dv, _ = _prepare(20170228)
+    dv.add_formula('ret', 'close / Delay(close, 1) - 1', is_quarterly=False, within_index=False, lazy=True)
+    dv.update_snapshot()
+    # building snapshots does not evaluate lazy formulas
+    assert dv._pending_formulas == {'ret'} and 'ret' not in dv._store_d
+
+    dv.get_snapshot(20170228, fields='close')
+    assert dv._pending_formulas == {'ret'} and dv._snapshot is not None
+
+    # evaluated on first use, snapshots are kept
+    snap = dv.get_snapshot(20170228, fields='close,ret')
+    assert not dv._pending_formulas and dv._snapshot is not None
+    assert np.isclose(snap.loc['600030.SH', 'ret'], dv.get_ts('ret').loc[20170228, '600030.SH'])
+
+
+def test_add_formulas():
+    dv, _ = _prepare(20170228)
+    formulas = {'ret': 'close / Delay(close, 1) - 1',
+                'ret_rank': 'Rank(close / Delay(close, 1) - 1)',
+                'ret2': 'ret * 2 + volume / volume',
+                'ma5': 'Ts_Sum(close, 10) / 10'}
+    dv.add_formulas(formulas, within_index=False)
+    assert not dv._pending_formulas
+    assert [item[0] for item in dv.formulas] == ['ret', 'ret_rank', 'ret2', 'ma5']
+
+    dv2, _ = _prepare(20170228)
+    for name in ['ret', 'ret_rank', 'ret2', 'ma5']:
+        dv2.add_formula(name, formulas[name], is_quarterly=False, within_index=False)
+    for name in formulas:
+        assert np.allclose(dv.get_ts(name).values, dv2.get_ts(name).values, equal_nan=True)
+
+    dv3, _ = _prepare(20170228)
+    dv3.add_formulas(formulas, within_index=False, n_jobs=2)
+    for name in formulas:
+        assert np.allclose(dv3.get_ts(name).values, dv2.get_ts(name).values, equal_nan=True)
+
+
+class TimeoutDataService(FakeDataService):
+    """Every second query times out at the first try."""
+    def __init__(self):
+        super(TimeoutDataService, self).__init__()
+        self.queries = []
+
+    def daily(self, symbol, start_date, end_date, fields="", adjust_mode=None):
+        key = (symbol, start_date, end_date)
+        self.queries.append(key)
+        if self.queries.count(key) == 1 and len(self.queries) % 2 == 0:
+            raise QueryDataError("-1,timeout")
+        return super(TimeoutDataService, self).daily(symbol, start_date, end_date, fields, adjust_mode)
+
+
+def test_distributed_query():
+    ds = TimeoutDataService()
+    dv = DataView()
+    dv.data_api = ds
+    symbol = ','.join(['{:06d}.SZ'.format(i) for i in range(7)])
+    df_all, _ = ds.daily(symbol, 20170103, 20170228)
+    sort_cols = ['symbol', 'trade_date']
+    df_all = df_all.sort_values(sort_cols).reset_index(drop=True)
+
+    # chunks of trade days, and chunks of symbols when there are more symbols than limit
+    for limit, n_chunks in [(30, 11), (5, 2 * 41)]:
+        ds.queries = []
+        df, msg = dv.distributed_query('daily', symbol, 20170103, 20170228, limit=limit)
+        assert msg == '0,'
+        assert len(set(ds.queries)) == n_chunks
+        assert len(ds.queries) > n_chunks
+        assert all(len(sec.split(',')) * len(ds.query_trade_dates(start, end)) <= limit
+                   for sec, start, end in ds.queries)
+        df = df.sort_values(sort_cols).reset_index(drop=True)
+        assert df.equals(df_all)
+
+    # timeouts are raised after retries are used up
+    dv.query_retries = 0
+    with pytest.raises(QueryDataError):
+        dv.distributed_query('daily', symbol, 20170103, 20170228, limit=30)
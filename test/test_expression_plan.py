@@ -0,0 +1,72 @@
+# encoding: utf-8
+
+from __future__ import print_function
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from jaqs.data import Parser
+
+
+def _make_data(n_dates=40, n_symbols=6):
+    np.random.seed(0)
+    index = pd.Index(np.arange(n_dates) + 20170101, name='trade_date')
+    columns = pd.Index(['S{}'.format(i) for i in range(n_symbols)], name='symbol')
+    close = pd.DataFrame(np.random.rand(n_dates, n_symbols) + 10, index=index, columns=columns)
+    volume = pd.DataFrame(np.random.rand(n_dates, n_symbols) * 1e6, index=index, columns=columns)
+    return close, volume
+
+
+def test_plan_dedup_subexpression():
+    close, volume = _make_data()
+    parser = Parser()
+    parser.parse('Rank(Delta(close, 5)) - Rank(Delta(close, 5) / Ts_Sum(close, 20))')
+    n_delta = sum(1 for kind, payload, _ in parser.plan._nodes if kind == 'var' and payload == 'Delta')
+    assert n_delta == 1
+    n_calls = sum(1 for kind, _, _ in parser.plan._nodes if kind == 'call')
+    assert n_calls == 4
+
+    res = parser.evaluate({'close': close})
+    delta = close.diff(5)
+    expected = delta.rank(axis=1) - (delta / close.rolling(20).sum()).rank(axis=1)
+    assert res.shape == close.shape
+    assert res.index.equals(close.index) and res.columns.equals(close.columns)
+    assert np.allclose(res.values, expected.values, equal_nan=True)
+
+
+def test_plan_multiple_formulas():
+    close, volume = _make_data()
+    parser = Parser()
+    formulas = OrderedDict([('a', 'Rank(Delta(close, 5))'),
+                            ('b', 'Delta(close, 5) * volume'),
+                            ('c', '(close > Delay(close, 1)) && (volume >= 500000)'),
+                            ('d', '-close + 1 / (close - close)')])
+    plan = parser.compile(formulas)
+    n_delta_calls = sum(1 for kind, payload, children in plan._nodes
+                        if kind == 'call' and plan._nodes[children[0]][1] == 'Delta')
+    assert n_delta_calls == 1
+    res = plan.evaluate({'close': close, 'volume': volume})
+    assert list(res.keys()) == ['a', 'b', 'c', 'd']
+
+    for name, formula in formulas.items():
+        parser.parse(formula)
+        # the same input frames are shared by all formulas and must not be modified
+        expected = parser.evaluate({'close': close.copy(), 'volume': volume.copy()})
+        assert isinstance(res[name], pd.DataFrame)
+        assert np.allclose(res[name].values, expected.values, equal_nan=True)
+
+    expected_c = ((close > close.shift(1)) & (volume >= 500000)).astype(float)
+    expected_c.iloc[0] = np.nan
+    assert np.allclose(res['c'].values, expected_c.values, equal_nan=True)
+    assert np.isnan(res['d'].values).all()
+
+
+def test_plan_inputs_not_modified():
+    close, volume = _make_data()
+    close_orig = close.copy()
+    index_member = close > 10.5
+    parser = Parser()
+    parser.parse('Rank(close) + Cutoff(close, 1.0) + Mask(close, IsNan(volume))')
+    parser.evaluate({'close': close, 'volume': volume}, index_member=index_member)
+    assert close.equals(close_orig)
@@ -0,0 +1,245 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from jaqs.data.fieldstore import FieldStore, CategoryBlock
+from jaqs.data import DataView
+
+
+def _make_frame():
+    dates = [20170103, 20170104, 20170105, 20170106]
+    symbols = ['000001.SZ', '600030.SH']
+    cols = pd.MultiIndex.from_product([symbols, ['close', 'status']], names=['symbol', 'field'])
+    df = pd.DataFrame(index=pd.Index(dates, name='trade_date'), columns=cols)
+    df.loc[:, pd.IndexSlice[:, 'close']] = np.arange(8, dtype=float).reshape(4, 2)
+    df.loc[:, pd.IndexSlice[:, 'status']] = [['a', 'b'], ['a', np.nan], ['c', 'b'], ['a', 'a']]
+    return df
+
+
+def test_store_set_get():
+    store = FieldStore([20170103, 20170104, 20170105], ['A', 'B'])
+    df = pd.DataFrame(index=[20170104, 20170105, 20170106], columns=['B', 'C'], data=1.0)
+    store.set_field('f', df)
+
+    res = store.get_frame('f')
+    assert res.shape == (3, 2)
+    assert np.isnan(res.loc[20170103, 'B'])
+    assert np.isnan(res.loc[20170104, 'A'])
+    assert res.loc[20170105, 'B'] == 1.0
+
+    res = store.get_frame('f', symbols=['B'], start_date=20170104, end_date=20170105)
+    assert res.shape == (2, 1)
+
+    store.set_field('g', np.zeros((3, 2), dtype=np.int64))
+    assert store.fields == ['f', 'g']
+    assert store.shape == (3, 4)
+    store.remove_field('g')
+    assert 'g' not in store
+
+    try:
+        store.set_field('h', np.zeros((2, 2)))
+        assert False
+    except ValueError:
+        pass
+
+
+def test_category_block():
+    arr = np.array([['x', np.nan], ['y', 'x']], dtype=object)
+    block = CategoryBlock.from_array(arr)
+    assert block.codes.dtype == np.int32
+    res = block.decode()
+    assert res[0, 0] == 'x' and res[1, 0] == 'y'
+    assert res[0, 1] != res[0, 1]  # NaN
+
+
+def test_store_frame_round_trip():
+    df = _make_frame()
+    store = FieldStore.from_frame(df)
+    assert store.fields == ['close', 'status']
+    assert isinstance(store._blocks['status'], CategoryBlock)
+
+    df2 = store.to_frame()
+    assert df2.shape == df.shape
+    assert df2.columns.equals(df.columns)
+    assert np.allclose(df2.loc[:, pd.IndexSlice[:, 'close']].values.astype(float),
+                       df.loc[:, pd.IndexSlice[:, 'close']].values.astype(float))
+    assert df2.loc[20170105, ('000001.SZ', 'status')] == 'c'
+
+    sub = store.take(start_date=20170104, end_date=20170105, symbols=['600030.SH'], fields=['close'])
+    assert sub.shape == (2, 1)
+    assert sub.get_frame('close').iloc[0, 0] == 3.0
+
+    # a date range gives views unless copy is required, as in DataView.dup
+    sub = store.take(start_date=20170104)
+    assert np.shares_memory(sub.get_values('close'), store.get_values('close'))
+    sub = store.take(start_date=20170104, copy=True)
+    assert not np.shares_memory(sub.get_values('close'), store.get_values('close'))
+    assert not np.shares_memory(sub._blocks['status'].codes, store._blocks['status'].codes)
+    sub.set_values('close', np.zeros((3, 2)))
+    assert store.get_frame('close').loc[20170104, '000001.SZ'] == 2.0
+
+    row = store.get_row(20170106, fields=['close'])
+    assert row.loc['600030.SH', 'close'] == 7.0
+    assert store.get_row(20170107) is None
+
+
+def test_dataview_store():
+    dv = DataView()
+    dv.data_d = _make_frame()
+    dv.fields = ['close', 'status']
+    dv.symbol = ['000001.SZ', '600030.SH']
+    dv.start_date, dv.end_date = 20170103, 20170106
+
+    ts = dv.get_ts('close')
+    assert ts.shape == (4, 2)
+    ts.iloc[0, 0] = 100.0  # returned frames are copies
+    assert dv.get_ts('close').iloc[0, 0] == 0.0
+
+    assert len(dv.get_ts('not_exist').columns) == 0
+
+    dv.append_df(dv.get_ts('close') * 2, 'close2')
+    assert 'close2' in dv.fields
+    assert dv.data_d.shape == (4, 6)
+
+    snap = dv.get_snapshot(20170104, fields='close,close2')
+    assert snap.loc['600030.SH', 'close2'] == 6.0
+
+    dv.remove_field('close2')
+    assert dv.data_d.shape == (4, 4)
+
+
+def test_dataview_slice_dates():
+    dv = DataView()
+    dv.data_d = _make_frame()
+    dv.fields = ['close', 'status']
+    dv.symbol = ['000001.SZ', '600030.SH']
+    dv.start_date, dv.end_date = 20170104, 20170106
+    dv.extended_start_date_d = 20170103
+
+    dv2 = dv.slice_dates(20170105, 20170105)
+    assert dv2.start_date == 20170105 and dv2.end_date == 20170105
+    # earlier dates are kept as in init_from_config, later dates are not
+    assert list(dv2.dates) == [20170103, 20170104, 20170105]
+    assert dv2.get_ts('close').shape == (1, 2)
+    assert dv2.get_snapshot(20170105, fields='status').loc['000001.SZ', 'status'] == 'c'
+
+    # fields are shared, not copied, and modifying the slice copies them first
+    assert np.shares_memory(dv2._store_d.get_values('close'), dv._store_d.get_values('close'))
+    dv2._store_d.set_values('close', np.full((1, 2), -1.0), rows=slice(2, 3))
+    assert dv2.get_ts('close').iloc[0, 0] == -1.0
+    assert dv.get_ts('close', start_date=20170105, end_date=20170105).iloc[0, 0] == 4.0
+
+    # fields added to the slice are not added to this dataview
+    dv2.append_df(dv2.get_ts('close') * 2, 'close2')
+    assert 'close2' in dv2.fields and 'close2' not in dv.fields
+    assert dv.fields == ['close', 'status'] and dv2.fields is not dv.fields
+    assert dv2.formulas is not dv.formulas
+
+    try:
+        dv.slice_dates(20170101, 20170105)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_dataview_status():
+    dates = [20170103, 20170104, 20170105]
+    symbols = ['000001.SZ', '600030.SH', '600519.SH']
+    fields = ['trade_status', '_limit', 'index_member', '_daily_adjust_factor']
+    cols = pd.MultiIndex.from_product([symbols, fields], names=['symbol', 'field'])
+    df = pd.DataFrame(index=pd.Index(dates, name='trade_date'), columns=cols)
+    df.loc[:, pd.IndexSlice[:, 'trade_status']] = [[u'交易', u'停牌', u'交易'],
+                                                   [u'交易', u'交易', u'交易'],
+                                                   [u'停牌', u'交易', np.nan]]
+    df.loc[:, pd.IndexSlice[:, '_limit']] = [[0.01, np.nan, 0.02],
+                                             [0.1, 0.0, 0.02],
+                                             [np.nan, 0.0, 0.099]]
+    df.loc[:, pd.IndexSlice[:, 'index_member']] = [[1.0, 1.0, 0.0],
+                                                   [1.0, np.nan, 1.0],
+                                                   [1.0, 1.0, 1.0]]
+    df.loc[:, pd.IndexSlice[:, '_daily_adjust_factor']] = 1.0
+
+    dv = DataView()
+    dv.data_d = df
+    dv.fields = list(fields)
+    dv.symbol = symbols
+    dv.universe = ['000300.SH']
+    dv.start_date, dv.end_date = 20170103, 20170105
+    dv._data_inst = pd.DataFrame(index=pd.Index(symbols[:2], name='symbol'),
+                                 data={'list_date': [19910403, 20170104], 'delist_date': [99999999, 99999999]})
+
+    assert list(dv.get_status_symbols(20170103, 'suspended')) == ['600030.SH']
+    assert list(dv.get_status_symbols(20170104, 'limit_reached')) == ['000001.SZ']
+    assert list(dv.get_status_symbols(20170105, 'limit_reached')) == ['600519.SH']
+    # listed after list_date, never listed without instrument info
+    assert list(dv.get_status_symbols(20170104, 'listed')) == ['000001.SZ']
+    assert list(dv.get_status_symbols(20170105, 'listed')) == ['000001.SZ', '600030.SH']
+    assert list(dv.get_status_symbols(20170104, 'index_member')) == ['000001.SZ', '600519.SH']
+    assert list(dv.get_status_symbols(20170103, 'index_member,listed')) == ['000001.SZ']
+    assert list(dv.get_status_symbols(20170105, 'tradable')) == ['600030.SH']
+    assert len(dv.get_status_symbols(20170106, 'tradable')) == 0
+    assert dv.get_ts('_tradable').values.dtype == bool
+
+    # status matrices are saved with the view
+    folder = tempfile.mkdtemp()
+    try:
+        dv.save_dataview(folder, file_format='npy')
+        dv2 = DataView()
+        dv2.load_dataview(folder)
+        assert '_tradable' in dv2._store_d
+        # no snapshot is built by default, fields stay on disk until used
+        assert dv2._snapshot is None
+        assert dv2.get_ts('_suspended').equals(dv.get_ts('_suspended'))
+    finally:
+        shutil.rmtree(folder)
+
+    try:
+        dv.get_status_symbols(20170103, 'halted')
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_store_save_load_lazy():
+    from jaqs.data.fieldstore import _LazyBlock
+    folder = tempfile.mkdtemp()
+    try:
+        store = FieldStore.from_frame(_make_frame())
+        store.save(folder)
+
+        store2 = FieldStore.load(folder)
+        assert store2.fields == ['close', 'status']
+        assert all(isinstance(b, _LazyBlock) for b in store2._blocks.values())
+
+        df = store2.get_frame('close')
+        assert isinstance(store2._blocks['close'], np.memmap)
+        assert isinstance(store2._blocks['status'], _LazyBlock)
+        assert df.loc[20170106, '600030.SH'] == 7.0
+        assert store2.to_frame().equals(store.to_frame())
+
+        # saving onto its own files keeps data intact
+        store2.set_field('close2', store2.get_frame('close') * 2)
+        store2.save(folder)
+        store3 = FieldStore.load(folder)
+        assert store3.get_frame('close2').loc[20170106, '600030.SH'] == 14.0
+        assert store3.get_frame('status').loc[20170105, '000001.SZ'] == 'c'
+
+        # fields named as files of axes do not overwrite them
+        store3.set_field('index', store3.get_frame('close'))
+        store3.set_field('symbols', store3.get_frame('status'))
+        store3.save(folder)
+        assert os.path.exists(os.path.join(folder, 'field.index.npy'))
+        store4 = FieldStore.load(folder)
+        assert list(store4.index) == list(store.index) and list(store4.symbols) == list(store.symbols)
+        assert store4.get_frame('index').equals(store.get_frame('close'))
+        assert store4.get_frame('symbols').equals(store.get_frame('status'))
+    finally:
+        shutil.rmtree(folder)
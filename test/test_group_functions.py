@@ -0,0 +1,71 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import numpy as np
+import pandas as pd
+
+from jaqs.data import Parser
+from jaqs.util import rank_with_mask
+import jaqs.util.numeric as numeric
+
+
+def _make_data(n_dates=30, n_symbols=40):
+    np.random.seed(2)
+    shape = (n_dates, n_symbols)
+    # rounded values to produce ties
+    df_val = pd.DataFrame(np.round(np.random.rand(*shape), 1))
+    df_val.iloc[np.random.rand(*shape) < 0.1] = np.nan
+    df_group = pd.DataFrame(np.random.randint(1, 6, size=shape).astype(float))
+    df_group.iloc[np.random.rand(*shape) < 0.05] = np.nan
+    df_group.iloc[:, 0] = 9  # single member group
+    return df_val, df_group
+
+
+def _loop_group_rank(df, group, normalize):
+    """Reference: rank the whole frame once per group."""
+    res = pd.DataFrame(np.nan, index=df.index, columns=df.columns)
+    for val in np.unique(pd.Series(group.values.flatten()).dropna()):
+        res = res.fillna(rank_with_mask(df, mask=(group == val), axis=1, normalize=normalize))
+    return res
+
+
+def test_group_rank_percentile():
+    df_val, df_group = _make_data()
+    parser = Parser()
+    for normalize, func in [(False, parser.group_rank), (True, parser.group_percentile)]:
+        res = func(df_val, df_group)
+        expected = _loop_group_rank(df_val, df_group, normalize)
+        assert res.shape == expected.shape
+        assert np.allclose(res.values, expected.values, equal_nan=True)
+
+
+def test_group_quantile():
+    # without ties, as order of equal values is not defined in quantilize_without_nan
+    df_val, df_group = _make_data()
+    df_val = df_val + pd.DataFrame(np.random.rand(*df_val.shape) * 1e-3)
+    parser = Parser()
+    res = parser.group_quantile(df_val, df_group, 3)
+
+    expected = pd.DataFrame(np.nan, index=df_val.index, columns=df_val.columns)
+    for val in np.unique(pd.Series(df_group.values.flatten()).dropna()):
+        arr = numeric.quantilize_without_nan(df_val[df_group == val].values, n_quantiles=3, axis=1)
+        expected = expected.fillna(pd.DataFrame(arr, index=df_val.index, columns=df_val.columns))
+    assert np.allclose(res.values, expected.values, equal_nan=True)
+
+
+def test_group_demean_standardize():
+    df_val, df_group = _make_data()
+    parser = Parser()
+    parser.parse('GroupDemean(val, g) + GroupStandardize(val, g)')
+    res = parser.evaluate({'val': df_val, 'g': df_group})
+
+    stacked = pd.DataFrame({'val': df_val.stack(), 'g': df_group.stack()}).dropna()
+    stacked['date'] = stacked.index.get_level_values(0)
+    gp = stacked.groupby(['date', 'g'])['val']
+    demean = stacked['val'] - gp.transform('mean')
+    expected = (demean + demean / gp.transform('std')).unstack().reindex(index=df_val.index, columns=df_val.columns)
+    # groups of equal values have zero deviation
+    expected = expected.replace([np.inf, -np.inf], np.nan)
+    assert np.allclose(res.values, expected.values, equal_nan=True)
+    # single member groups have no standard deviation
+    assert np.isnan(res.iloc[:, 0]).all()
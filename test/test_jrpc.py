@@ -0,0 +1,162 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import threading
+import time
+
+import zmq
+
+from jaqs.data import DataApi
+from jaqs.data.dataapi import jrpc_py
+
+
+class EchoServer(object):
+    """
+    Minimal ROUTER speaking the jrpc protocol: answers heartbeats and auth.login,
+    'test.echo' replies are sent in reverse order of arrival once n_batch requests have arrived,
+    'test.ignore' is never answered, 'jsq.subscribe' is followed by n_quotes pushed quotes,
+    other methods return their params as one-row columns.
+
+    """
+    def __init__(self, n_batch=1, n_quotes=3):
+        self.n_batch = n_batch
+        self.n_quotes = n_quotes
+        self.identities = set()
+        self.n_logins = 0
+        self._ctx = zmq.Context()
+        self._sock = self._ctx.socket(zmq.ROUTER)
+        self._sock.setsockopt(zmq.LINGER, 0)
+        port = self._sock.bind_to_random_port('tcp://127.0.0.1')
+        self.addr = 'tcp://127.0.0.1:{}'.format(port)
+        self._should_close = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _reply(self, identity, msg, **kwargs):
+        rsp = {'jsonrpc': '2.0', 'method': msg['method'], 'id': msg['id']}
+        rsp.update(kwargs)
+        self._sock.send_multipart([identity, jrpc_py._pack_msgpack_snappy(rsp)])
+
+    def _run(self):
+        pending = []
+        while not self._should_close:
+            if not self._sock.poll(100):
+                continue
+            identity, data = self._sock.recv_multipart()
+            msg = jrpc_py._unpack_msgpack_snappy(data)
+            method = msg['method']
+            if method == '.sys.heartbeat':
+                self._reply(identity, msg, result={})
+            elif method == 'auth.login':
+                self.n_logins += 1
+                self._reply(identity, msg, result={'username': msg['params']['username']}, error={'error': 0})
+            elif method == 'test.echo':
+                pending.append((identity, msg))
+                if len(pending) == self.n_batch:
+                    for identity_, msg_ in reversed(pending):
+                        self._reply(identity_, msg_, result=msg_['params'])
+                    pending = []
+            elif method == 'jsq.subscribe':
+                schema = [{'id': 0, 'name': 'symbol'}, {'id': 1, 'name': 'last'}]
+                symbols = msg['params']['symbol']
+                self._reply(identity, msg, error={'error': 0},
+                            result={'schema_id': 1, 'schema': schema, 'sub_hash': 'h', 'symbols': symbols})
+                for i in range(self.n_quotes):
+                    quote_ind = {'schema_id': 1, 'indicators': [0, 1], 'values': [symbols.split(',')[0], i]}
+                    notification = {'jsonrpc': '2.0', 'method': 'jsq.quote_ind', 'result': quote_ind}
+                    self._sock.send_multipart([identity, jrpc_py._pack_msgpack_snappy(notification)])
+            elif method != 'test.ignore':
+                self.identities.add(identity)
+                params = {k: [v] for k, v in msg['params'].items()}
+                self._reply(identity, msg, result=params, error={'error': 0})
+
+    def close(self):
+        self._should_close = True
+        self._thread.join()
+        self._sock.close()
+        self._ctx.term()
+
+
+def _wait_connected(client):
+    for _ in range(50):
+        if client._connected:
+            return
+        time.sleep(0.1)
+    raise AssertionError("not connected")
+
+
+def test_call_async():
+    server = EchoServer(n_batch=10)
+    client = jrpc_py.JRpcClient()
+    client.connect(server.addr)
+    _wait_connected(client)
+    try:
+        # replies arrive in reverse order, results are matched by call id
+        done = []
+        futures = [client.call_async('test.echo', {'x': i}, timeout=5) for i in range(10)]
+        futures[0].add_done_callback(lambda f: done.append(f))
+        assert [future.result()['result']['x'] for future in futures] == list(range(10))
+        assert done == [futures[0]]
+        assert client.n_pending == 0
+
+        # lost calls expire
+        future = client.call_async('test.ignore', {}, timeout=0.3)
+        assert not future.wait(0.01)
+        assert future.result() == {'error': {'error': -1, 'message': "timeout"}}
+        assert client.n_pending == 0
+        assert client.call('test.ignore', {}, timeout=0.3)['error']['message'] == 'timeout'
+    finally:
+        client.close()
+        server.close()
+
+
+def test_data_api_sessions():
+    server = EchoServer()
+    api = DataApi(server.addr, n_sessions=3)
+    try:
+        r, msg = api.login('user', 'password')
+        assert r and msg == '0,'
+        for _ in range(50):
+            if len(api._loggined_remotes) == 3:
+                break
+            time.sleep(0.1)
+        assert server.n_logins == 3
+
+        futures = [api.call_async('query', 'lb.secIndustry', filter='symbol=S{}'.format(i), fields='')
+                   for i in range(30)]
+        results = [future.result() for future in futures]
+        assert [df['filter'].iloc[0] for df, msg in results] == ['symbol=S{}'.format(i) for i in range(30)]
+        assert all(msg == '0,' for df, msg in results)
+        # queries are spread over all sessions
+        assert len(server.identities) == 3
+
+        df, msg = api.call_async('daily', 'S1', start_date=None, end_date=20170301).result()
+        assert df == -1 and msg == "Begin date format error"
+    finally:
+        api.close()
+        server.close()
+
+
+def test_data_api_subscribe_batch():
+    server = EchoServer(n_quotes=5)
+    api = DataApi(server.addr)
+    batches = []
+    try:
+        r, msg = api.login('user', 'password')
+        assert r
+        # quotes of the first subscription may arrive before its schema
+        api.subscribe_batch('600030.SH', batches.append, batch_interval=20)
+        symbols, msg = api.subscribe_batch('600030.SH', batches.append, batch_interval=20)
+        assert msg == '0,'
+        for _ in range(50):
+            if api.quote_stats['n_delivered'] >= 5:
+                break
+            time.sleep(0.1)
+        assert api.quote_stats['n_delivered'] >= 5
+        assert all(set(batch['symbol']) == {'600030.SH'} for batch in batches)
+        last = [x for batch in batches for x in batch['last']]
+        assert last[-5:] == [0.0, 1.0, 2.0, 3.0, 4.0]
+    finally:
+        api.close()
+        server.close()
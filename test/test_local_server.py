@@ -0,0 +1,89 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from jaqs.data import DataApi
+from jaqs.data.dataapi.local_server import LocalDataServer
+
+DATA_DIR = os.path.abspath('../output/tests/test_local_server')
+DATES = [20170103, 20170104, 20170105, 20170106]
+
+
+def _tables():
+    symbols = ['000001.SZ', '600030.SH']
+    daily = pd.DataFrame({'symbol': np.repeat(symbols, len(DATES)), 'trade_date': DATES * 2,
+                          'close': np.arange(8, dtype=float), 'volume': np.arange(8) * 100})
+    bar = pd.DataFrame({'symbol': '600030.SH', 'trade_date': 20170104, 'date': 20170104,
+                        'time': [93100, 93200, 150000], 'close': [1.0, 2.0, 3.0]})
+    quote = pd.DataFrame({'symbol': ['600030.SH', '000001.SZ', '600030.SH'], 'last': [1.0, 2.0, 3.0]})
+    cal = pd.DataFrame({'trade_date': DATES})
+    return {'daily': daily, 'bar': bar, 'quote': quote, 'jz.secTradeCal': cal}
+
+
+def _login(server):
+    api = DataApi(server.addr)
+    r, msg = api.login('user', 'password')
+    assert r, msg
+    return api
+
+
+def test_local_server_queries():
+    server = LocalDataServer(tables=_tables()).start()
+    api = _login(server)
+    try:
+        df, msg = api.daily('600030.SH', start_date=20170104, end_date=20170105, fields='close')
+        assert msg == '0,'
+        assert list(df.columns) == ['symbol', 'trade_date', 'close']
+        assert list(df['close']) == [5.0, 6.0]
+
+        df, msg = api.bar('600030.SH', trade_date=20170104, start_time=93000, end_time=113000)
+        assert list(df['time']) == [93100, 93200]
+
+        df, msg = api.query('jz.secTradeCal', fields='trade_date', filter='start_date=20170104&end_date=20170110')
+        assert list(df['trade_date']) == DATES[1:]
+
+        df, msg = api.query('lb.unknown')
+        assert msg.startswith('-1,')
+        assert server.stats['jsd.query'] == 1 and server.stats['n_rows'] == 2 + 2 + 3
+
+        batches = []
+        api.subscribe_batch('600030.SH', batches.append, batch_interval=20)
+        api.subscribe_batch('600030.SH', batches.append, batch_interval=20)
+        for _ in range(50):
+            if api.quote_stats['n_delivered'] >= 2:
+                break
+            time.sleep(0.1)
+        assert set(x for batch in batches for x in batch['symbol']) == {'600030.SH'}
+    finally:
+        api.close()
+        server.close()
+
+
+def test_local_server_files_and_latency():
+    if os.path.exists(DATA_DIR):
+        shutil.rmtree(DATA_DIR)
+    os.makedirs(DATA_DIR)
+    _tables()['daily'].to_csv(os.path.join(DATA_DIR, 'daily.csv'), index=False)
+
+    server = LocalDataServer(data_dir=DATA_DIR, latency=0.2, users={'user': 'password'}).start()
+    api = _login(server)
+    try:
+        t0 = time.time()
+        df, msg = api.daily('000001.SZ', start_date=20170101, end_date=20170110)
+        assert time.time() - t0 >= 0.2
+        assert len(df) == 4
+
+        api2 = DataApi(server.addr)
+        r, msg = api2.login('user', 'wrong')
+        assert not r
+        api2.close()
+    finally:
+        api.close()
+        server.close()
+        shutil.rmtree(DATA_DIR, ignore_errors=True)
@@ -0,0 +1,66 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import threading
+import time
+
+import pandas as pd
+
+from jaqs.data.basic import Bar
+from jaqs.data.prefetch import BarPrefetcher, to_columns
+
+
+def _bars(date):
+    return pd.DataFrame({'symbol': ['B', 'A', 'A', 'B'], 'date': date, 'trade_date': date,
+                         'time': [93200, 93200, 93100, 93100], 'close': [1.0, 2.0, 3.0, 4.0]})
+
+
+def test_prefetch_order_and_look_ahead():
+    dates = [20170103, 20170104, 20170105, 20170106, 20170109]
+    fetched = []
+    lock = threading.Lock()
+
+    def fetch(date):
+        time.sleep(0.05 if date == dates[0] else 0.0)
+        with lock:
+            fetched.append(date)
+        return None if date == 20170105 else _bars(date)
+
+    seen = []
+    for date, columns in BarPrefetcher(fetch, dates, look_ahead=2, n_workers=3):
+        if date == dates[0]:
+            # following dates are being queried while the first one is processed
+            assert len(fetched) >= 2
+        seen.append(date)
+        if date == 20170105:
+            assert columns is None
+        else:
+            assert list(columns['time']) == [93100, 93100, 93200, 93200]
+            assert list(columns['symbol']) == ['A', 'B', 'A', 'B']
+    assert seen == dates
+    assert sorted(fetched) == dates
+
+
+def test_prefetch_sync_and_error():
+    dates = [20170103, 20170104]
+    res = list(BarPrefetcher(_bars, dates, look_ahead=0))
+    assert [date for date, _ in res] == dates
+
+    def fetch(date):
+        raise ValueError(date)
+    try:
+        list(BarPrefetcher(fetch, dates, look_ahead=1))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("error of query is not raised")
+
+
+def test_bars_from_columns():
+    columns = to_columns(_bars(20170103))
+    groups = BarPrefetcher.split_by(columns, 'time')
+    assert [(t, s, e) for t, s, e in groups] == [(93100, 0, 2), (93200, 2, 4)]
+    bars = Bar.create_from_columns(columns, 2, 4)
+    assert [(bar.symbol, bar.close, bar.time) for bar in bars] == [('A', 2.0, 93200), ('B', 1.0, 93200)]
+    assert isinstance(bars[0].time, int)
+    assert to_columns(pd.DataFrame()) is None
@@ -0,0 +1,74 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import time
+
+import numpy as np
+
+from jaqs.data.dataapi.quote_stream import QuoteBuffer
+from jaqs.data.dataapi.utils import long_nan
+
+SCHEMA = [{'id': 0, 'name': 'symbol'}, {'id': 1, 'name': 'last'}, {'id': 2, 'name': 'volume'},
+          {'id': 3, 'name': 'status'}]
+
+
+def _quote(symbol, last, volume=100, schema_id=1):
+    return {'schema_id': schema_id, 'indicators': [0, 1, 2], 'values': [symbol, last, volume]}
+
+
+def test_quote_buffer_batch():
+    batches = []
+    buf = QuoteBuffer(batches.append, capacity=10, batch_size=100, start=False)
+    buf.set_schema(1, SCHEMA)
+    assert buf.put(_quote('600030.SH', 10.0))
+    assert buf.put({'schema_id': 1, 'indicators': [0, 1, 2, 3, 9], 'values': ['000001.SZ', 11.5, long_nan, 'S', 0]})
+    assert not buf.put(_quote('600030.SH', 10.1, schema_id=2))
+    buf.flush()
+    buf.flush()
+
+    assert len(batches) == 1
+    batch = batches[0]
+    assert list(batch['symbol']) == ['600030.SH', '000001.SZ']
+    assert list(batch['last']) == [10.0, 11.5]
+    assert batch['volume'][0] == 100 and np.isnan(batch['volume'][1])
+    assert list(batch['status']) == [None, 'S']
+    stats = buf.stats
+    assert stats['n_received'] == 2 and stats['n_delivered'] == 2 and stats['n_batches'] == 1
+    assert stats['pending'] == 0
+
+
+def test_quote_buffer_conflate_and_drop():
+    batches = []
+    buf = QuoteBuffer(batches.append, capacity=4, batch_size=2, conflate_after=2, start=False)
+    buf.set_schema(1, SCHEMA)
+    buf.put(_quote('A', 1.0))
+    buf.put(_quote('B', 2.0))
+    buf.put(_quote('A', 3.0))  # not behind yet: new row
+    buf.put(_quote('A', 4.0))  # behind: replaces latest pending quote of A
+    buf.put(_quote('C', 5.0))
+    buf.put(_quote('D', 6.0))  # full: oldest quote dropped
+    buf.flush()
+
+    batch = batches[0]
+    assert list(batch['symbol']) == ['B', 'A', 'C', 'D']
+    assert list(batch['last']) == [2.0, 4.0, 5.0, 6.0]
+    stats = buf.stats
+    assert stats['n_received'] == 6 and stats['n_conflated'] == 1 and stats['n_dropped'] == 1
+    assert stats['n_delivered'] == 4
+
+
+def test_quote_buffer_thread():
+    batches = []
+    buf = QuoteBuffer(batches.append, batch_size=1000, batch_interval=20)
+    buf.set_schema(1, SCHEMA)
+    try:
+        for i in range(10):
+            buf.put(_quote('600030.SH', float(i)))
+        for _ in range(50):
+            if buf.stats['n_delivered'] == 10:
+                break
+            time.sleep(0.02)
+        assert sum(len(b['last']) for b in batches) == 10
+        assert buf.stats['max_lag'] >= 0
+    finally:
+        buf.close()
@@ -13,6 +13,10 @@ def test_seq_gen():
     for i in range(3, 999):
         assert sg.get_next(text) == i
 
+    assert list(sg.get_next_batch(text, 3)) == [999, 1000, 1001]
+    assert sg.get_next(text) == 1002
+    assert list(sg.get_next_batch('fill', 0)) == []
+
 
 if __name__ == "__main__":
     test_seq_gen()
@@ -0,0 +1,107 @@
+# encoding: utf-8
+
+from __future__ import print_function
+
+import numpy as np
+
+import jaqs.trade.analyze as ana
+from jaqs.data import DataView
+from jaqs.trade import model, AlphaStrategy, PortfolioManager, AlphaBacktestInstance, AlphaTradeApi
+from jaqs.trade.sweep import ParameterSweep, expand_grid, run_alpha_in_memory
+
+# saved by test_backtest_alpha.test_save_dataview
+dataview_dir_path = '../output/wine_industry_momentum/dataview'
+result_dir_path = '../output/tests/test_sweep'
+
+BENCHMARK = '399997.SZ'
+
+
+def my_selector(context, user_options=None):
+    rank_ret = context.snapshot['rank_ret']
+    return rank_ret >= 0.9
+
+
+def build(props):
+    stock_selector = model.StockSelector()
+    stock_selector.add_filter(name='rank_ret_top10', func=my_selector)
+    return AlphaStrategy(stock_selector=stock_selector, pc_method='equal_weight')
+
+
+def get_props(dv):
+    return {"benchmark": BENCHMARK,
+            "universe": ','.join(dv.symbol),
+            "start_date": dv.start_date,
+            "end_date": dv.end_date,
+            "period": "day",
+            "days_delay": 0,
+            "init_balance": 1e8,
+            "position_ratio": 1.0,
+            }
+
+
+def test_expand_grid():
+    combinations = expand_grid({'position_ratio': [0.5, 1.0], 'n_periods': [1, 2, 3]})
+    assert len(combinations) == 6
+    assert combinations[0] == {'n_periods': 1, 'position_ratio': 0.5}
+    assert combinations[-1] == {'n_periods': 3, 'position_ratio': 1.0}
+    assert expand_grid({}) == [{}]
+
+
+def test_in_memory_analysis():
+    dv = DataView()
+    dv.load_dataview(folder_path=dataview_dir_path)
+    props = get_props(dv)
+
+    ta_mem = run_alpha_in_memory(dv, build(props), props)
+
+    # same backtest analyzed from saved files
+    strategy = build(props)
+    bt = AlphaBacktestInstance()
+    context = model.Context(dataview=dv, instance=bt, strategy=strategy, trade_api=AlphaTradeApi(),
+                            pm=PortfolioManager())
+    strategy.stock_selector.register_context(context)
+    bt.init_from_config(props)
+    bt.run_alpha()
+    bt.save_results(folder_path=result_dir_path)
+
+    ta_file = ana.AlphaAnalyzer()
+    ta_file.initialize(dataview=dv, file_folder=result_dir_path)
+    ta_file.process_trades()
+    ta_file.get_daily()
+    ta_file.get_returns(consider_commission=True)
+
+    for key, value in ta_file.performance_metrics.items():
+        assert np.isclose(ta_mem.performance_metrics[key], value)
+    assert ta_mem.risk_metrics == ta_file.risk_metrics
+
+
+def test_parameter_sweep():
+    dv = DataView()
+    dv.load_dataview(folder_path=dataview_dir_path)
+    props = get_props(dv)
+    grid = {'n_periods': [1, 2], 'position_ratio': [0.5, 1.0]}
+
+    df_serial = ParameterSweep(dv, build, props, grid, n_workers=1, keep_returns=True).run()
+    sweep = ParameterSweep(dv, build, props, grid, n_workers=2, keep_returns=True)
+    df_parallel = sweep.run()
+
+    assert len(df_parallel) == 4
+    assert list(df_parallel.columns[:2]) == ['n_periods', 'position_ratio']
+    assert 'Sharpe Ratio' in df_parallel.columns and 'Maximum Drawdown (%)' in df_parallel.columns
+    assert np.allclose(df_serial['Total PNL'].values, df_parallel['Total PNL'].values)
+    assert len(sweep.returns) == 4
+
+
+if __name__ == "__main__":
+    import time
+    t_start = time.time()
+
+    g = globals()
+    g = {k: v for k, v in g.items() if k.startswith('test_') and callable(v)}
+    for test_name, test_func in g.items():
+        print("\n==========\nTesting {:s}...".format(test_name))
+        test_func()
+    print("Test Complete.")
+
+    t3 = time.time() - t_start
+    print("\n\n\nTime lapsed in total: {:.1f}".format(t3))
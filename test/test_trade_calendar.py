@@ -0,0 +1,93 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import jaqs.util as jutil
+from jaqs.data import RemoteDataService
+from jaqs.data.trade_calendar import TradingCalendar
+
+# 2017-10-01 ~ 2017-10-08 is a holiday
+DATES = [20170927, 20170928, 20170929, 20171009, 20171010, 20171011, 20171012, 20171013,
+         20171016, 20171101, 20171102]
+
+
+class FakeDataApi(object):
+    """Logged-in stand-in of DataApi, counts calendar queries."""
+    _loggined = True
+    _connected = True
+
+    def __init__(self):
+        self.n_calls = 0
+
+    def query(self, view, filter="", fields="", **kwargs):
+        self.n_calls += 1
+        return pd.DataFrame({'trade_date': DATES[::-1]}), '0,'
+
+
+def test_trading_calendar():
+    cal = TradingCalendar(DATES[::-1] + DATES[:2])
+    assert len(cal) == len(DATES)
+    assert cal.start_date == 20170927 and cal.end_date == 20171102
+
+    assert cal.is_trade_date(20170929)
+    assert not cal.is_trade_date(20171001)
+    assert not cal.is_trade_date(20200101)
+    assert list(cal.is_trade_date(np.array([20170929, 20171001]))) == [True, False]
+    assert 20171009 in cal
+
+    assert list(cal.get_trade_dates(20170929, 20171010)) == [20170929, 20171009, 20171010]
+    assert len(cal.get_trade_dates(20171002, 20171006)) == 0
+
+    assert cal.get_next_trade_date(20170929) == 20171009
+    assert cal.get_next_trade_date(20171001, n=2) == 20171010
+    assert cal.get_last_trade_date(20171009) == 20170929
+    assert cal.get_last_trade_date(20171005, n=3) == 20170927
+    assert cal.offset(20171003, 0) == 20171009
+    assert cal.offset(20171009, -1) == 20170929
+    with pytest.raises(IndexError):
+        cal.get_next_trade_date(20171102)
+    with pytest.raises(IndexError):
+        cal.get_last_trade_date(20170927)
+
+
+def test_trading_calendar_save_load():
+    path = os.path.abspath('../output/tests/test_trade_calendar/calendar.npy')
+    jutil.create_dir(path)
+    cal = TradingCalendar(DATES)
+    cal.save(path)
+    assert list(TradingCalendar.load(path).dates) == DATES
+
+
+def test_next_period_day_with_calendar():
+    cal = TradingCalendar(DATES)
+    assert jutil.get_next_period_day(20170929, 'day', calendar=cal) == 20171009
+    assert jutil.get_next_period_day(20170929, 'day', extra_offset=1, calendar=cal) == 20171010
+    assert jutil.get_next_period_day(20170928, 'week', calendar=cal) == 20171009
+    assert jutil.get_next_period_day(20171013, 'month', extra_offset=1, calendar=cal) == 20171102
+
+
+def test_remote_data_service_calendar():
+    ds = RemoteDataService()
+    data_api_orig, cache_orig = ds.data_api, ds.cache
+    api = FakeDataApi()
+    ds.data_api = api
+    ds.set_cache(None)
+    try:
+        assert list(ds.query_trade_dates(20170928, 20171009)) == [20170928, 20170929, 20171009]
+        assert ds.query_next_trade_date(20170929) == 20171009
+        assert ds.query_next_trade_date(20170929, n=3) == 20171011
+        assert ds.query_last_trade_date(20171009) == 20170929
+        assert ds.is_trade_date(20171010)
+        assert not ds.is_trade_date(20171001)
+        assert api.n_calls == 1
+
+        ds.data_api = FakeDataApi()
+        ds.is_trade_date(20171010)
+        assert ds.data_api.n_calls == 1
+    finally:
+        ds.data_api, ds.cache = data_api_orig, cache_orig
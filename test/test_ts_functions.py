@@ -0,0 +1,72 @@
+# encoding: utf-8
+
+from __future__ import print_function
+import numpy as np
+import pandas as pd
+
+from jaqs.data import Parser
+import jaqs.util.numeric as numeric
+
+
+def _make_data(n_dates=60, n_symbols=5):
+    np.random.seed(1)
+    df = pd.DataFrame(np.random.rand(n_dates, n_symbols) + 0.5,
+                      index=np.arange(n_dates) + 20170101, columns=list('ABCDE'))
+    df.iloc[3, 0] = np.nan
+    df.iloc[20:23, 2] = np.nan
+    df.iloc[:, 4] = np.nan
+    return df
+
+
+def _rolling_apply(df, window, func):
+    """Reference: the per-window callbacks used before the vectorized kernels."""
+    return df.rolling(window).apply(func, raw=True)
+
+
+def _assert_equal(res, expected):
+    assert res.shape == expected.shape
+    assert res.index.equals(expected.index) and res.columns.equals(expected.columns)
+    assert np.allclose(res.values, expected.values, equal_nan=True)
+
+
+def test_ts_rank_percentile_quantile():
+    df = _make_data()
+    parser = Parser()
+    window = 7
+
+    def _rank(arr):
+        return np.argsort(np.argsort(arr, kind='mergesort'), kind='mergesort')[-1] + 1.0
+
+    _assert_equal(parser.ts_rank(df, window), _rolling_apply(df, window, _rank))
+    _assert_equal(parser.ts_percentile(df, window), _rolling_apply(df, window, _rank) / window)
+
+    func = lambda arr: numeric.quantilize_without_nan(arr, n_quantiles=3, axis=0)[-1]
+    _assert_equal(parser.ts_quantile(df, window, 3), _rolling_apply(df, window, func))
+
+    # ties are ranked by order of appearance
+    df_tie = pd.DataFrame({'A': [1.0, 2.0, 1.0, 1.0]})
+    assert list(parser.ts_rank(df_tie, 3).values[2:, 0]) == [2.0, 2.0]
+
+
+def test_ts_product_decay():
+    df = _make_data()
+    parser = Parser()
+    window = 5
+
+    _assert_equal(parser.ts_product(df, window), _rolling_apply(df, window, np.prod))
+    _assert_equal(parser.decay_linear(df, window), _rolling_apply(df, window, parser.decay_linear_array))
+    _assert_equal(parser.decay_exp(df, 0.8, window),
+                  _rolling_apply(df, window, lambda arr: parser.decay_exp_array(arr, 0.8)))
+
+    # window longer than data
+    assert np.isnan(parser.decay_linear(df.iloc[:3], window).values).all()
+
+
+def test_rolling_moments():
+    df = _make_data()
+    parser = Parser()
+    parser.parse('Ts_Mean(x, 5) + Ts_Min(x, 5) - Ts_Max(x, 5) + StdDev(x, 5) + CountNans(x, 5)')
+    res = parser.evaluate({'x': df})
+    roll = df.rolling(5)
+    expected = roll.mean() + roll.min() - roll.max() + roll.std() + (5 - df.rolling(5, min_periods=0).count())
+    _assert_equal(res, expected)
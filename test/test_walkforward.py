@@ -0,0 +1,82 @@
+# encoding: utf-8
+
+from __future__ import print_function
+
+import numpy as np
+
+from jaqs.data import DataView
+from jaqs.trade import model, AlphaStrategy
+from jaqs.trade.walkforward import WalkForward, get_windows
+
+# saved by test_backtest_alpha.test_save_dataview, 20170901 ~ 20171129
+dataview_dir_path = '../output/wine_industry_momentum/dataview'
+
+BENCHMARK = '399997.SZ'
+
+
+def my_selector(context, user_options=None):
+    rank_ret = context.snapshot['rank_ret']
+    return rank_ret >= 0.9
+
+
+def build(props, dataview):
+    assert dataview.start_date == props['train_start_date']
+    assert dataview.end_date == props['end_date']
+    stock_selector = model.StockSelector()
+    stock_selector.add_filter(name='rank_ret_top10', func=my_selector)
+    return AlphaStrategy(stock_selector=stock_selector, pc_method='equal_weight')
+
+
+def test_get_windows():
+    dates = [20170103, 20170125, 20170203, 20170228, 20170301, 20170331, 20170405, 20170428, 20170502]
+    windows = get_windows(dates, train_months=2, test_months=1)
+    assert windows == [(20170103, 20170228, 20170301, 20170331),
+                       (20170203, 20170331, 20170405, 20170428),
+                       (20170301, 20170428, 20170502, 20170502)]
+
+    windows = get_windows(dates, train_months=2, test_months=2)
+    assert windows == [(20170103, 20170228, 20170301, 20170428),
+                       (20170301, 20170428, 20170502, 20170502)]
+    assert get_windows(dates, train_months=5, test_months=1) == []
+
+
+def test_walk_forward():
+    dv = DataView()
+    dv.load_dataview(folder_path=dataview_dir_path)
+    props = {"benchmark": BENCHMARK,
+             "universe": ','.join(dv.symbol),
+             "period": "week",
+             "days_delay": 0,
+             "init_balance": 1e8,
+             "position_ratio": 1.0,
+             }
+
+    wf = WalkForward(dv, build, props, train_months=1, test_months=1, n_workers=2)
+    assert len(wf.windows) == 2
+    ta = wf.run()
+
+    # one PnL series over all out-of-sample dates
+    test_start, test_end = wf.windows[0][2], wf.windows[-1][3]
+    assert ta.df_pnl.index[0] >= test_start and ta.df_pnl.index[-1] <= test_end
+    assert ta.returns.index.is_monotonic_increasing
+    assert len(wf.window_metrics) == 2
+    total = wf.window_metrics['Total PNL'].fillna(0.0).sum()
+    assert np.isclose(ta.performance_metrics['Total PNL'], total)
+
+    ta_serial = WalkForward(dv, build, props, train_months=1, test_months=1, n_workers=1).run()
+    assert np.isclose(ta_serial.performance_metrics['Total PNL'], ta.performance_metrics['Total PNL'])
+
+
+if __name__ == "__main__":
+    import time
+    t_start = time.time()
+
+    g = globals()
+    g = {k: v for k, v in g.items() if k.startswith('test_') and callable(v)}
+    for test_name, test_func in g.items():
+        print("\n==========\nTesting {:s}...".format(test_name))
+        test_func()
+    print("Test Complete.")
+
+    t3 = time.time() - t_start
+    print("\n\n\nTime lapsed in total: {:.1f}".format(t3))